@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""Cycle time of `StatsCollector` by number of channels.
+
+The first cycle reads every message in full, later cycles only refresh the
+counters of known messages. Between the second and the third cycle the views of
+a tenth of the messages change, the rows ingested by each cycle show how many
+unchanged snapshots are skipped. Telegram requests get a fixed latency so that
+the concurrency of the collector shows up in the numbers, the read rate limit
+is lifted. Prints the results as JSON.
+"""
+import asyncio
+import logging
+
+import common  # noqa: F401, sets up the environment
+
+from dao import chat_dao  # noqa: E402
+from service.rate_limiter import FloodAwareRateLimiter  # noqa: E402
+from service.stats_collector import StatsCollector  # noqa: E402
+
+NUM_CHANNELS = (10, 100)
+MESSAGES_PER_CHANNEL = 200
+TELEGRAM_LATENCY_SEC = 0.02
+CHANGED_EVERY = 10
+
+
+class CountingIngester:
+    def __init__(self):
+        self.num_rows = 0
+
+    async def save_many(self, rows):
+        self.num_rows += len(rows)
+
+
+async def bench_channels(questdb, num_channels):
+    telegram_client = common.FakeTelegramClient(latency=TELEGRAM_LATENCY_SEC)
+    common.install_telegram_client(telegram_client)
+
+    questdb.chats.clear()
+    chat_dao._chats = None
+    for i in range(num_channels):
+        chat_id = common.make_channel_id(num_channels * 1000 + i)
+        questdb.add_chat(chat_id, f"Channel {i}")
+        telegram_client.add_channel(
+            chat_id, common.make_messages(chat_id, MESSAGES_PER_CHANNEL, weeks_back=1),
+        )
+
+    ingester = CountingIngester()
+    collector = StatsCollector(ingester)
+    collector.rate_limiter = FloodAwareRateLimiter(max_rate=10 ** 9, burst=10 ** 9)
+    await collector.watermarks.load(since=collector._get_collection_start())
+
+    cycles = []
+    for cycle in range(3):
+        if cycle == 2:
+            for messages in telegram_client.channels.values():
+                for message_id, message in messages.items():
+                    if message_id % CHANGED_EVERY == 0:
+                        message.views += 1
+        rows_before = ingester.num_rows
+        requests_before = telegram_client.num_requests
+        report = await collector._collect_stats()
+        cycles.append({
+            "sec": report.duration,
+            "rows_ingested": ingester.num_rows - rows_before,
+            "telegram_requests": telegram_client.num_requests - requests_before,
+        })
+
+    return {
+        "messages": cycles[0]["rows_ingested"],
+        "first_cycle": cycles[0],
+        "unchanged_cycle": cycles[1],
+        f"changed_1_in_{CHANGED_EVERY}_cycle": cycles[2],
+    }
+
+
+async def run():
+    questdb = common.FakeQuestDb()
+    await questdb.connect()
+
+    results = {
+        "messages_per_channel": MESSAGES_PER_CHANNEL,
+        "telegram_latency_sec": TELEGRAM_LATENCY_SEC,
+    }
+    for num_channels in NUM_CHANNELS:
+        results[str(num_channels)] = await bench_channels(questdb, num_channels)
+    return results
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    common.dump_results("collector", asyncio.run(run()))
+
+
+if __name__ == "__main__":
+    main()
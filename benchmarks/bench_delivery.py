@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Cost of browsing a report through the paginated viewer.
+
+Opens a report with `GetStatsHandler`, turns to the next page and downloads
+the whole report, counting the Bot API requests and the rows read from
+Telegram by each step. Requests go through the send scheduler with the
+default limits to a local fake Bot API server. Also measures rendering a
+large report into each document format. Prints the results as JSON.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+import common  # noqa: F401, sets up the environment
+
+from bench_updates import make_callback  # noqa: E402
+from bot import Bot  # noqa: E402
+from service.report_cursors import report_cursors  # noqa: E402
+from service.report_renderer import render_csv, render_html  # noqa: E402
+
+NUM_MESSAGES = 1000
+WEEKS_BACK = 4
+TELEGRAM_LATENCY_SEC = 0.05
+RENDER_ROWS = 10_000
+
+
+async def step(bot, api, update_id, data):
+    api.calls.clear()
+    started = time.perf_counter()
+    await bot._process_update(make_callback(update_id, data))
+    return {
+        "handler_sec": time.perf_counter() - started,
+        "requests": dict(api.calls),
+    }
+
+
+def bench_render():
+    chat_id = common.make_channel_id(RENDER_ROWS)
+    rows = [
+        (message.text, message.date, message.get_stats())
+        for message in common.make_messages(chat_id, RENDER_ROWS, WEEKS_BACK)
+    ]
+    results = {}
+    for name, render in (
+        ("html", lambda: render_html(rows, "Bench channel")),
+        ("csv", lambda: render_csv(rows)),
+    ):
+        started = time.perf_counter()
+        content = render()
+        results[name] = {
+            "render_sec": time.perf_counter() - started,
+            "bytes": len(content),
+        }
+    return results
+
+
+async def run():
+    questdb = common.FakeQuestDb()
+    await questdb.connect()
+    telegram_client = common.FakeTelegramClient(latency=TELEGRAM_LATENCY_SEC)
+    common.install_telegram_client(telegram_client)
+    api = common.FakeBotApi()
+    await api.start()
+
+    # a channel added just now, so the report is read live from Telegram
+    chat_id = common.make_channel_id(NUM_MESSAGES)
+    telegram_client.add_channel(
+        chat_id, common.make_messages(chat_id, NUM_MESSAGES, WEEKS_BACK),
+    )
+    questdb.add_chat(
+        chat_id, "Bench channel",
+        created_at=datetime.now(timezone.utc).replace(tzinfo=None),
+    )
+
+    bot = Bot()
+    results = {"messages": NUM_MESSAGES}
+    try:
+        results["first_page"] = await step(
+            bot, api, 1, {"a": "get_stats", "cid": chat_id, "p": "m"},
+        )
+        cursor_id, cursor = next(iter(report_cursors._cursors.items()))
+        results["first_page"]["rows_read"] = len(cursor.rows)
+
+        results["next_page"] = await step(
+            bot, api, 1, {"a": "report_page", "c": cursor_id, "n": 1},
+        )
+        results["next_page"]["rows_read"] = len(cursor.rows)
+
+        results["download"] = await step(
+            bot, api, 1, {"a": "report_file", "c": cursor_id},
+        )
+        results["download"]["rows_read"] = len(cursor.rows)
+        # what sending every page up front would have cost
+        results["pages"] = cursor.num_pages
+        results[f"render_{RENDER_ROWS}_rows"] = bench_render()
+    finally:
+        await bot.bot_api.close()
+        await api.stop()
+
+    return results
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    common.dump_results("delivery", asyncio.run(run()))
+
+
+if __name__ == "__main__":
+    main()
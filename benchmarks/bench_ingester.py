@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""Rows per second through `QuestDbIngester` into a local line protocol sink.
+
+Rows are enqueued with `save_many` from a coroutine, as the collector does,
+and counted once the sink has received them. Prints the results as JSON.
+"""
+import asyncio
+import logging
+import time
+
+import common  # noqa: F401, sets up the environment
+
+from db import QuestDbIngester  # noqa: E402
+from db import ingester as ingester_module  # noqa: E402
+
+NUM_ROWS = 200_000
+SAVE_BATCH_SIZE = 500
+
+
+async def enqueue(ingester, rows):
+    for i in range(0, len(rows), SAVE_BATCH_SIZE):
+        await ingester.save_many(rows[i:i + SAVE_BATCH_SIZE])
+
+
+def bench_ingester(sink, rows, max_queue_size):
+    ingester = QuestDbIngester(max_queue_size=max_queue_size)
+    ingester.FLUSH_INTERVAL_SEC = 0.05
+    ingester.start()
+    num_rows_before = sink.num_rows
+
+    started = time.perf_counter()
+    asyncio.run(enqueue(ingester, rows))
+    enqueue_time = time.perf_counter() - started
+    while sink.num_rows - num_rows_before < len(rows):
+        time.sleep(0.001)
+    total_time = time.perf_counter() - started
+    ingester.stop()
+
+    return {
+        "enqueue_rows_per_sec": len(rows) / enqueue_time,
+        "ingest_rows_per_sec": len(rows) / total_time,
+    }
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    sink = common.IlpSink()
+    ingester_module.Sender = sink.make_sender
+    rows = common.make_stats_rows(NUM_ROWS)
+
+    common.dump_results("ingester", {
+        "rows": NUM_ROWS,
+        "unbounded_queue": bench_ingester(sink, rows, max_queue_size=0),
+        "bounded_queue": bench_ingester(sink, rows, max_queue_size=10_000),
+    })
+
+
+if __name__ == "__main__":
+    main()
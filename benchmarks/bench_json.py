@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Cost of JSON parsing and serialization per update.
+
+Measures the active codec of `bot_api.codec` next to the json module's
+defaults that were used before: decoding a getUpdates response, decoding
+callback data, encoding a sendMessage body and building a keyboard. Prints
+the results as JSON.
+"""
+import json
+import logging
+import time
+
+import common  # noqa: F401, sets up the environment
+
+from bench_updates import make_updates  # noqa: E402
+from bot_api import codec  # noqa: E402
+
+NUM_UPDATES = 100
+REPEAT = 200
+ROUNDS = 5
+
+
+def make_message_body():
+    return {
+        "chat_id": 1234,
+        "text": "<b>Synthetic post</b>\n<i>Mon 01 Jan 2024 12:00</i>\n" * 15,
+        "parse_mode": "HTML",
+        "reply_markup": {"inline_keyboard": make_keyboard(json.dumps)},
+    }
+
+
+def make_keyboard(dumps):
+    buttons = [
+        (f"Channel {i}", {"a": "select_channel", "cid": common.make_channel_id(i)})
+        for i in range(10)
+    ]
+    return [{"text": text, "callback_data": dumps(data)} for text, data in buttons]
+
+
+def time_per_call(func, arg, n):
+    """Best of `ROUNDS` in microseconds per item, like timeit."""
+    best = float("inf")
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        for _ in range(REPEAT):
+            func(arg)
+        best = min(best, time.perf_counter() - started)
+    return best / (REPEAT * n) * 1e6
+
+
+def bench_codec(loads, dumps, dumps_str):
+    response = json.dumps({"ok": True, "result": make_updates(NUM_UPDATES)}).encode()
+    callback_data = json.dumps({"a": "get_stats", "cid": -1001234567890, "p": "w"})
+    body = make_message_body()
+
+    return {
+        "decode_update_usec": time_per_call(loads, response, NUM_UPDATES),
+        "decode_callback_data_usec": time_per_call(loads, callback_data, 1),
+        "encode_send_message_usec": time_per_call(dumps, body, 1),
+        "build_keyboard_usec": time_per_call(
+            lambda _: make_keyboard(dumps_str), None, 1,
+        ),
+    }
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    common.dump_results("json", {
+        "codec": codec.NAME,
+        codec.NAME: bench_codec(codec.loads, codec.dumps, codec.dumps_str),
+        "json_defaults": bench_codec(
+            json.loads, lambda obj: json.dumps(obj).encode(), json.dumps,
+        ),
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Routing cost and memory of the Bot API models per update.
+
+Parses decoded updates into models and reads what `Bot._route_update` needs
+to pick a handler: the command, the forwarded chat or the callback action.
+Memory is what the models of one update keep alive, without the decoded JSON.
+Prints the results as JSON.
+"""
+import logging
+import time
+import tracemalloc
+
+import common  # noqa: F401, sets up the environment
+
+from bench_updates import make_updates  # noqa: E402
+from bot_api.models import Callback, Message  # noqa: E402
+
+NUM_UPDATES = 10_000
+ROUNDS = 5
+
+
+def make_forward(update_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "chat": {"id": 1000, "type": "private"},
+            "from": {"id": 1000, "username": "bench"},
+            "date": 0,
+            "text": "A forwarded post with a #hashtag and a link",
+            "entities": [
+                {"offset": 21, "length": 8, "type": "hashtag"},
+                {"offset": 36, "length": 4, "type": "url"},
+            ],
+            "forward_from_chat": {
+                "id": common.make_channel_id(0),
+                "title": "Bench channel",
+                "type": "channel",
+            },
+        },
+    }
+
+
+def route(update_json):
+    if message_json := update_json.get("message"):
+        update = Message.from_json(message_json)
+        if command := update.command:
+            return update, command.command
+        if update.forward_from_chat:
+            return update, "forward"
+    elif callback_json := update_json.get("callback_query"):
+        update = Callback.from_json(callback_json)
+        return update, update.data.get("a")
+
+    return None, None
+
+
+def bench_route(updates):
+    best = float("inf")
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        for update_json in updates:
+            route(update_json)
+        best = min(best, time.perf_counter() - started)
+    return best / len(updates) * 1e6
+
+
+def bench_memory(updates):
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    routed = [route(update_json) for update_json in updates]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # the list of results itself isn't part of the models
+    list_size = routed.__sizeof__() + len(routed) * tuple().__sizeof__()
+    return (after - before - list_size) / len(updates)
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    updates = make_updates(NUM_UPDATES)
+    updates += [make_forward(i) for i in range(NUM_UPDATES // 4)]
+
+    common.dump_results("models", {
+        "updates": len(updates),
+        "route_usec_per_update": bench_route(updates),
+        "memory_bytes_per_update": bench_memory(updates),
+    })
+
+
+if __name__ == "__main__":
+    main()
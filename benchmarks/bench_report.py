@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Time of `StatsService.get_report` by report size and data source.
+
+Each size is measured for the three ways a report can be built: from the
+in-memory snapshot store, from the latest snapshots in QuestDB and live from
+Telegram. The time to the first rendered line is what the user waits for
+before the first page is sent. Prints the results as JSON.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+import common  # noqa: F401, sets up the environment
+
+from telethon.utils import resolve_id  # noqa: E402
+
+from dao import chat_dao  # noqa: E402
+from service.snapshot_store import snapshot_store  # noqa: E402
+from service.stats_service import stats_service  # noqa: E402
+
+SIZES = (1_000, 10_000, 100_000)
+WEEKS_BACK = 4
+
+
+async def get_report(chat_id):
+    """Return the number of lines, the time to the first one and the total time."""
+    started = time.perf_counter()
+    first_line_sec = None
+    num_lines = 0
+    async for _ in stats_service.get_report(chat_id, WEEKS_BACK):
+        if first_line_sec is None:
+            first_line_sec = time.perf_counter() - started
+        num_lines += 1
+    return num_lines, first_line_sec, time.perf_counter() - started
+
+
+async def bench_size(questdb, telegram_client, n):
+    chat_id = common.make_channel_id(n)
+    peer_channel_id, _ = resolve_id(chat_id)
+    messages = common.make_messages(chat_id, n, weeks_back=WEEKS_BACK)
+    questdb.add_chat(chat_id, f"Channel of {n} messages")
+    questdb.set_latest_stats(peer_channel_id, messages)
+    telegram_client.add_channel(chat_id, messages)
+
+    num_lines, questdb_first_sec, questdb_sec = await get_report(chat_id)
+
+    snapshot = snapshot_store.get_or_create(chat_id)
+    for message in messages:
+        snapshot.update(message.id, message.get_stats(), message.date, message.text)
+    _, snapshot_first_sec, snapshot_sec = await get_report(chat_id)
+    snapshot_store._channels.pop(chat_id)
+
+    # a channel added just now has no collected snapshots to build from
+    created_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    questdb.add_chat(chat_id, f"Channel of {n} messages", created_at=created_at)
+    chat_dao.cache.invalidate(chat_id)
+    _, telegram_first_sec, telegram_sec = await get_report(chat_id)
+
+    return {
+        "lines": num_lines,
+        "snapshot_store_sec": snapshot_sec,
+        "snapshot_store_first_line_sec": snapshot_first_sec,
+        "questdb_sec": questdb_sec,
+        "questdb_first_line_sec": questdb_first_sec,
+        "telegram_sec": telegram_sec,
+        "telegram_first_line_sec": telegram_first_sec,
+    }
+
+
+async def run():
+    questdb = common.FakeQuestDb()
+    await questdb.connect()
+    telegram_client = common.FakeTelegramClient()
+    common.install_telegram_client(telegram_client)
+
+    return {
+        str(n): await bench_size(questdb, telegram_client, n) for n in SIZES
+    }
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    common.dump_results("report", asyncio.run(run()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Throughput of the QuestDB ingester while rows are spilled to disk.
+
+Runs offline: QuestDB is replaced by an in-process sender that can be switched
+between "down" (every flush fails) and "up". Prints the results as JSON.
+"""
+import asyncio
+import logging
+import tempfile
+import time
+
+import common  # noqa: F401, sets up the environment
+
+from questdb.ingress import IngressError, IngressErrorCode  # noqa: E402
+
+from db import ingester as ingester_module  # noqa: E402
+from db import QuestDbIngester, SpillLog  # noqa: E402
+
+NUM_ROWS = 200_000
+
+
+class FakeSender:
+    up = False
+
+    def __init__(self, **kwargs):
+        self.rows = 0
+        self.ingested = 0
+
+    def connect(self):
+        pass
+
+    def close(self):
+        pass
+
+    def row(self, table, symbols=None, columns=None, at=None):
+        self.rows += 1
+
+    def __len__(self):
+        return self.rows * 80
+
+    def flush(self):
+        rows, self.rows = self.rows, 0
+        if not FakeSender.up:
+            raise IngressError(IngressErrorCode.SocketError, "QuestDB is down")
+        FakeSender.ingested += rows
+
+
+FakeSender.ingested = 0
+ingester_module.Sender = FakeSender
+
+
+def bench_spill_log(directory, rows):
+    spill_log = SpillLog(directory, segment_size=8 * 1024 * 1024, max_size=1 << 40)
+    rows = [row._replace(at=ingester_module.TimestampNanos.now()) for row in rows]
+
+    started = time.perf_counter()
+    for i in range(0, len(rows), QuestDbIngester.BATCH_SIZE):
+        spill_log.append(rows[i:i + QuestDbIngester.BATCH_SIZE])
+    append_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    num_read = 0
+    while spill_log:
+        number, segment_rows = spill_log.read_oldest()
+        num_read += len(segment_rows)
+        spill_log.remove(number)
+    read_time = time.perf_counter() - started
+
+    return {
+        "spill_append_rows_per_sec": len(rows) / append_time,
+        "spill_read_rows_per_sec": num_read / read_time,
+    }
+
+
+def bench_ingester(directory, rows):
+    spill_log = SpillLog(directory, segment_size=8 * 1024 * 1024, max_size=1 << 40)
+    ingester = QuestDbIngester(
+        spill_log=spill_log, replay_rows_per_sec=10 ** 9, max_queue_size=10_000,
+    )
+    ingester.RECONNECT_INTERVAL_SEC = 0.05
+    FakeSender.up = False
+    ingester.start()
+
+    started = time.perf_counter()
+    asyncio.run(ingester.save_many(rows))
+    while ingester.queue_size or ingester.num_pending:
+        time.sleep(0.01)
+    spill_time = time.perf_counter() - started
+
+    FakeSender.up = True
+    started = time.perf_counter()
+    while FakeSender.ingested < len(rows):
+        time.sleep(0.01)
+    replay_time = time.perf_counter() - started
+    ingester.stop()
+
+    return {
+        "ingest_with_spill_rows_per_sec": len(rows) / spill_time,
+        "replay_rows_per_sec": len(rows) / replay_time,
+    }
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    rows = common.make_stats_rows(NUM_ROWS)
+    results = {"rows": NUM_ROWS}
+    with tempfile.TemporaryDirectory() as directory:
+        results.update(bench_spill_log(directory, rows))
+    with tempfile.TemporaryDirectory() as directory:
+        results.update(bench_ingester(directory, rows))
+
+    common.dump_results("spill", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""Latency of the trends query on a month of synthetic snapshots in QuestDB.
+
+Times how long `StatsRollup` takes to build the rollups, and the trends
+query on them for every granularity, which has to stay under `TARGET_SEC`.
+Needs a running QuestDB at QDB_HOST, the results only say "skipped" when it
+can't be reached. The data goes into separate `bench_` copies of the tables,
+which are dropped afterwards. Prints the results as JSON.
+"""
+import asyncio
+import logging
+import socket
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import common  # noqa: F401, sets up the environment
+
+from telethon.utils import resolve_id  # noqa: E402
+
+import service.stats_rollup as stats_rollup_module  # noqa: E402
+from dao import StatsDao, to_timestamp  # noqa: E402
+from db import db  # noqa: E402
+from db.schema import SCHEMA  # noqa: E402
+from service.stats_rollup import StatsRollup  # noqa: E402
+from service.stats_service import stats_service  # noqa: E402
+from settings import QDB_HOST, QDB_POSTGRES_PORT  # noqa: E402
+
+NUM_MESSAGES = 1000
+DAYS = 30
+SNAPSHOT_INTERVAL_SEC = 5 * 60
+ROUNDS = 3
+LOAD_TIMEOUT_SEC = 300
+# a month of trends has to come back well under a second
+TARGET_SEC = 1.0
+
+# every message gets a snapshot every 5 minutes, its counters only grow
+INSERT_SQL = """
+INSERT INTO bench_stats (ts, message_id, chat_id, views, forwards, reactions, replies)
+SELECT
+    cast(%(start)s + ((x - 1) / %(n)s) * %(interval)s AS TIMESTAMP),
+    cast((x - 1) %% %(n)s AS STRING),
+    %(chat_id)s,
+    ((x - 1) / %(n)s) * ((x - 1) %% 50 + 1),
+    ((x - 1) / %(n)s) * ((x - 1) %% 50 + 1) / 200,
+    ((x - 1) / %(n)s) * ((x - 1) %% 50 + 1) / 40,
+    ((x - 1) / %(n)s) * ((x - 1) %% 50 + 1) / 500
+FROM long_sequence(%(rows)s);
+"""
+
+
+class BenchStatsDao(StatsDao):
+    STATS_TABLE = "bench_stats"
+    ROLLUP_TABLES = {
+        sample_by: tuple(f"bench_{table}" for table in tables)
+        for sample_by, tables in StatsDao.ROLLUP_TABLES.items()
+    }
+
+
+def get_bench_tables():
+    tables = [BenchStatsDao.STATS_TABLE]
+    for rollup_tables in BenchStatsDao.ROLLUP_TABLES.values():
+        tables.extend(rollup_tables)
+    return tables
+
+
+def make_create_sql(bench_table):
+    """The schema's statement for the table, creating its `bench_` copy."""
+    table = bench_table.removeprefix("bench_")
+    for statement in SCHEMA.split(";"):
+        if f" EXISTS {table} (" in statement:
+            return statement.replace(f" {table} (", f" {bench_table} (") + ";"
+    raise LookupError(f"Table {table} is not in the schema")
+
+
+def is_reachable(host, port):
+    try:
+        socket.create_connection((host, port), timeout=2).close()
+    except OSError:
+        return False
+    return True
+
+
+async def drop_tables():
+    for table in get_bench_tables():
+        await db.execute(f"DROP TABLE IF EXISTS {table};")
+
+
+async def load_data(peer_channel_id, start, num_rows):
+    await drop_tables()
+    for table in get_bench_tables():
+        await db.execute(make_create_sql(table))
+
+    started = time.perf_counter()
+    await db.execute(INSERT_SQL, {
+        "start": to_timestamp(start),
+        "n": NUM_MESSAGES,
+        "interval": SNAPSHOT_INTERVAL_SEC * 1_000_000,
+        "chat_id": str(peer_channel_id),
+        "rows": num_rows,
+    })
+    # WAL tables become readable once the WAL is applied
+    while (await db.fetch_one("SELECT count() FROM bench_stats;"))["count"] < num_rows:
+        if time.perf_counter() - started > LOAD_TIMEOUT_SEC:
+            raise TimeoutError("bench_stats wasn't loaded in time")
+        await asyncio.sleep(0.5)
+    return time.perf_counter() - started
+
+
+async def bench_trends(stats_dao, peer_channel_id):
+    results = {}
+    for granularity, (sample_by, _) in stats_service.TRENDS.items():
+        since = stats_service.get_trends_since(granularity)
+        best = float("inf")
+        for _ in range(ROUNDS):
+            started = time.perf_counter()
+            points = await stats_dao.get_trends(peer_channel_id, since, sample_by)
+            best = min(best, time.perf_counter() - started)
+        results[granularity] = {
+            "points": len(points),
+            "query_sec": best,
+            "within_target": best < TARGET_SEC,
+        }
+    return results
+
+
+async def roll_up(stats_dao):
+    """Build the rollups with `StatsRollup` and wait until they can be read."""
+    stats_rollup_module.stats_dao = stats_dao
+    stats_rollup = StatsRollup(retention_days=0)
+
+    started = time.perf_counter()
+    await stats_rollup.run()
+    rollup_sec = time.perf_counter() - started
+
+    # the last synthetic snapshots are from just now, so every rollup ends with
+    # the last interval that has settled
+    settled_at = datetime.now(timezone.utc) - timedelta(seconds=StatsRollup.SETTLE_SEC)
+    for sample_by, interval in StatsRollup.INTERVALS.items():
+        until = stats_rollup_module._floor(settled_at, sample_by)
+        while (last_ts := await stats_dao.get_last_rollup_ts(sample_by)) is None or (
+            last_ts + interval < until
+        ):
+            if time.perf_counter() - started > LOAD_TIMEOUT_SEC:
+                raise TimeoutError("Rollups weren't applied in time")
+            await asyncio.sleep(0.5)
+
+    return rollup_sec
+
+
+async def run():
+    if not is_reachable(QDB_HOST, QDB_POSTGRES_PORT):
+        return {"skipped": f"QuestDB unreachable at {QDB_HOST}:{QDB_POSTGRES_PORT}"}
+
+    await db.connect()
+    stats_dao = BenchStatsDao(db)
+    peer_channel_id, _ = resolve_id(common.make_channel_id(0))
+    num_rows = NUM_MESSAGES * DAYS * 24 * 3600 // SNAPSHOT_INTERVAL_SEC
+    # the snapshots end just now
+    start = datetime.now(timezone.utc) - timedelta(
+        seconds=num_rows // NUM_MESSAGES * SNAPSHOT_INTERVAL_SEC,
+    )
+    try:
+        load_sec = await load_data(peer_channel_id, start, num_rows)
+        rollup_sec = await roll_up(stats_dao)
+        return {
+            "messages": NUM_MESSAGES,
+            "rows": num_rows,
+            "load_sec": load_sec,
+            "rollup_sec": rollup_sec,
+            "target_sec": TARGET_SEC,
+            "trends": await bench_trends(stats_dao, peer_channel_id),
+        }
+    finally:
+        await drop_tables()
+        await db.disconnect()
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    results = asyncio.run(run())
+    common.dump_results("trends", results)
+
+    for granularity, trends in results.get("trends", {}).items():
+        if not trends["within_target"]:
+            print(
+                f"{granularity} trends took {trends['query_sec']:.3f}s, "
+                f"over the {TARGET_SEC}s target",
+                file=sys.stderr,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""Updates per second through `Bot._process_update`.
+
+Bot API calls go to a local fake server and database lookups to an in-memory
+QuestDB stand-in, so the numbers cover parsing, routing, handlers and the HTTP
+client. Prints the results as JSON.
+
+Updates are run sequentially and through the dispatcher: once against a
+server that answers instantly and once with a round trip like Telegram's.
+Without latency there is nothing for the per-chat lanes to overlap, so the
+dispatcher only adds its cost: a worker task per lane and the handlers of all
+chats competing for the connection pool of the HTTP client. The dispatcher
+pays off once handlers wait on I/O.
+
+Both ways of receiving updates are run end to end as well: long polling
+getUpdates of the fake server, and POSTing the updates to a local
+`WebhookServer` over several connections, as Telegram does. The webhook run
+includes the HTTP client that posts the updates, and it first checks that
+requests with a wrong secret or a malformed body are rejected.
+"""
+import asyncio
+import json
+import logging
+from contextlib import suppress
+
+import httpx
+
+import common  # noqa: F401, sets up the environment
+
+from bot import Bot  # noqa: E402
+from bot_api.scheduler import SendScheduler  # noqa: E402
+from bot_api.webhook import WebhookServer  # noqa: E402
+
+NUM_UPDATES = 5000
+# round trip to the Bot API for the run with latency, fewer updates keep the
+# sequential run short
+BOT_API_LATENCY_SEC = 0.05
+NUM_UPDATES_WITH_LATENCY = 200
+# updates of different chats are processed concurrently by the dispatcher
+NUM_USERS = 50
+CHANNEL_ID = common.make_channel_id(0)
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_SECRET = "bench-secret"
+# Telegram's default for the connections it delivers webhook updates over
+WEBHOOK_CONNECTIONS = 40
+
+
+def make_message(update_id, text):
+    command, _, _ = text.partition(" ")
+    user_id = 1000 + update_id % NUM_USERS
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "username": "bench"},
+            "date": 0,
+            "text": text,
+            "entities": [{"offset": 0, "length": len(command), "type": "bot_command"}],
+        },
+    }
+
+
+def make_callback(update_id, data):
+    message = make_message(update_id, "/channels")["message"]
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "message": message,
+            "data": json.dumps(data),
+        },
+    }
+
+
+def make_updates(n):
+    """A mix of commands and callbacks that doesn't build reports."""
+    kinds = (
+        lambda i: make_message(i, "/start"),
+        lambda i: make_message(i, "/channels"),
+        lambda i: make_callback(i, {"a": "select_channel", "cid": CHANNEL_ID}),
+        lambda i: make_message(i, "/unknown"),
+    )
+    # Telegram's update ids start at 1, the client takes 0 for no offset
+    return [kinds[i % len(kinds)](i) for i in range(1, n + 1)]
+
+
+async def bench_sequential(bot, updates):
+    started = asyncio.get_running_loop().time()
+    for update in updates:
+        await bot._process_update(update)
+    return len(updates) / (asyncio.get_running_loop().time() - started)
+
+
+async def bench_dispatcher(bot, updates):
+    started = asyncio.get_running_loop().time()
+    for update in updates:
+        await bot.dispatcher.dispatch(update)
+    await bot.dispatcher.join()
+    return len(updates) / (asyncio.get_running_loop().time() - started)
+
+
+async def bench_polling(bot, bot_api, updates):
+    bot_api.queue_updates(updates)
+    started = asyncio.get_running_loop().time()
+    polling = asyncio.create_task(bot._process_updates())
+    await bot_api.drained.wait()
+    await bot.dispatcher.join()
+    elapsed = asyncio.get_running_loop().time() - started
+
+    polling.cancel()
+    with suppress(asyncio.CancelledError):
+        await polling
+    return len(updates) / elapsed
+
+
+async def bench_webhook(bot, updates):
+    webhook_server = WebhookServer(
+        bot.dispatcher.dispatch,
+        host="127.0.0.1",
+        port=0,
+        path=WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+    )
+    await webhook_server.start()
+    port = webhook_server.http_server._server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}{WEBHOOK_PATH}"
+    headers = {
+        "Content-Type": "application/json",
+        WebhookServer.SECRET_HEADER: WEBHOOK_SECRET,
+    }
+
+    limits = httpx.Limits(
+        max_connections=WEBHOOK_CONNECTIONS,
+        max_keepalive_connections=WEBHOOK_CONNECTIONS,
+    )
+    async with httpx.AsyncClient(limits=limits) as client:
+        bad_secret = await client.post(
+            url,
+            content=json.dumps(updates[0]),
+            headers={**headers, WebhookServer.SECRET_HEADER: "wrong"},
+        )
+        bad_json = await client.post(url, content=b"{", headers=headers)
+        assert (bad_secret.status_code, bad_json.status_code) == (403, 400), (
+            f"Webhook answered {bad_secret.status_code} to a wrong secret and "
+            f"{bad_json.status_code} to a malformed body"
+        )
+
+        pending = iter(updates)
+
+        async def deliver():
+            for update in pending:
+                resp = await client.post(
+                    url, content=json.dumps(update), headers=headers,
+                )
+                resp.raise_for_status()
+
+        started = asyncio.get_running_loop().time()
+        await asyncio.gather(*(deliver() for _ in range(WEBHOOK_CONNECTIONS)))
+        await bot.dispatcher.join()
+        elapsed = asyncio.get_running_loop().time() - started
+
+    await webhook_server.stop()
+    return {
+        "updates_per_sec": len(updates) / elapsed,
+        "wrong_secret_status": bad_secret.status_code,
+        "malformed_body_status": bad_json.status_code,
+    }
+
+
+async def bench_server(latency, num_updates):
+    bot_api = common.FakeBotApi(latency=latency)
+    await bot_api.start()
+
+    bot = Bot()
+    # with Telegram's limits this would only measure the pacing
+    unlimited = 10 ** 9
+    bot.bot_api.scheduler = SendScheduler(
+        rate=unlimited, chat_rate=unlimited, chat_burst=unlimited, group_rate=unlimited,
+    )
+    updates = make_updates(num_updates)
+    # warm up the caches and the HTTP connection
+    await bench_sequential(bot, updates[:10])
+
+    results = {
+        "updates": num_updates,
+        "bot_api_latency_sec": latency,
+        "sequential_updates_per_sec": await bench_sequential(bot, updates),
+        "dispatcher_updates_per_sec": await bench_dispatcher(bot, updates),
+        "polling_updates_per_sec": await bench_polling(bot, bot_api, updates),
+        "webhook": await bench_webhook(bot, updates),
+        "bot_api_calls": sum(bot_api.calls.values()),
+    }
+
+    await bot.bot_api.close()
+    await bot_api.stop()
+    return results
+
+
+async def run():
+    questdb = common.FakeQuestDb()
+    questdb.add_chat(CHANNEL_ID, "Bench channel")
+    await questdb.connect()
+
+    return {
+        "no_latency": await bench_server(0.0, NUM_UPDATES),
+        "with_latency": await bench_server(
+            BOT_API_LATENCY_SEC, NUM_UPDATES_WITH_LATENCY,
+        ),
+    }
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    common.dump_results("updates", asyncio.run(run()))
+
+
+if __name__ == "__main__":
+    main()
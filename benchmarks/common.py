@@ -0,0 +1,481 @@
+"""Offline stand-ins for Telegram, the Bot API and QuestDB shared by the benchmarks.
+
+Importing this module sets up the environment the bot's modules expect, so it
+has to be imported before anything from `statsbot`.
+"""
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("BOT_TOKEN", "bench")
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "bench")
+# keep the Telethon session file out of the source tree
+os.environ.setdefault(
+    "SESSION_PATH", os.path.join(tempfile.gettempdir(), "statsbot-bench")
+)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "statsbot"))
+
+from http import HTTPStatus  # noqa: E402
+
+from telethon.tl.functions.messages import (  # noqa: E402
+    GetMessagesReactionsRequest,
+    GetMessagesViewsRequest,
+)
+from telethon.tl.types import (  # noqa: E402
+    MessageReactions,
+    MessageReplies,
+    MessageViews,
+    PeerChannel,
+    ReactionCount,
+    ReactionEmoji,
+    UpdateMessageReactions,
+    Updates,
+)
+from telethon.tl.types.messages import MessageViews as MessagesMessageViews  # noqa: E402
+from telethon.utils import get_peer_id, resolve_id  # noqa: E402
+
+from bot_api.client import BotApiClient  # noqa: E402
+from db import IngestRow, db  # noqa: E402
+from dto import StatsDto  # noqa: E402
+from http_server import HttpServer, Response  # noqa: E402
+from settings import BOT_TOKEN  # noqa: E402
+
+import telegram_client as telegram_client_module  # noqa: E402
+
+
+async def measure_async(coro):
+    """Await `coro` and return its result and the wall time it took."""
+    started = time.perf_counter()
+    result = await coro
+    return result, time.perf_counter() - started
+
+
+def dump_results(name, results, file=sys.stdout):
+    """Print results as JSON together with what's needed to compare runs."""
+    json.dump(
+        {
+            "benchmark": name,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": _get_commit(),
+            "python": platform.python_version(),
+            "results": results,
+        },
+        file,
+        indent=2,
+    )
+    print(file=file)
+
+
+def _get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Telegram
+
+
+def make_channel_id(n):
+    """Return the marked (-100...) id of the n-th synthetic channel."""
+    return get_peer_id(PeerChannel(1_000_000_000 + n))
+
+
+class FakeMessage:
+    """The subset of a Telethon message the bot reads."""
+
+    __slots__ = (
+        "id", "peer_id", "text", "date", "views", "reactions", "forwards", "replies",
+    )
+
+    def __init__(self, message_id, peer_channel_id, date):
+        self.id = message_id
+        self.peer_id = PeerChannel(peer_channel_id)
+        self.text = f"Synthetic post #{message_id}\nwith a second line of text"
+        self.date = date
+        self.views = 1000 + message_id % 5000
+        self.reactions = MessageReactions(
+            results=[ReactionCount(ReactionEmoji("👍"), count=message_id % 50)],
+        )
+        self.forwards = message_id % 7
+        self.replies = MessageReplies(replies=message_id % 11, replies_pts=0)
+
+    @property
+    def raw_text(self):
+        return self.text
+
+    def get_stats(self):
+        return StatsDto(
+            self.views,
+            self.reactions.results[0].count,
+            self.forwards,
+            self.replies.replies,
+        )
+
+
+def make_messages(chat_id, num_messages, weeks_back=4):
+    """Messages evenly spread over the last `weeks_back` weeks, oldest first."""
+    peer_channel_id, _ = resolve_id(int(chat_id))
+    now = datetime.now(timezone.utc)
+    span = timedelta(weeks=weeks_back) - timedelta(days=1)
+    step = span / max(num_messages, 1)
+    start = now - span
+
+    return [
+        FakeMessage(i + 1, peer_channel_id, start + step * i)
+        for i in range(num_messages)
+    ]
+
+
+class FakeTelegramClient:
+    """Serves synthetic channels through the calls the bot makes to Telethon.
+
+    `latency` is added to every request to emulate the round trip to Telegram.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.channels = {}
+        self.num_requests = 0
+
+    def add_channel(self, chat_id, messages):
+        self.channels[int(chat_id)] = {message.id: message for message in messages}
+
+    async def get_dialogs(self, limit=None):
+        return []
+
+    async def get_input_entity(self, entity):
+        return int(entity)
+
+    async def iter_messages(
+        self, entity, reverse=False, offset_date=None, min_id=0, limit=None,
+    ):
+        # like Telegram, only messages newer than `min_id` and `offset_date` are
+        # paged through
+        messages = [
+            message for message in self.channels[int(entity)].values()
+            if message.id > min_id
+            and (offset_date is None or message.date >= offset_date)
+        ]
+        await self._request()
+        for i, message in enumerate(messages):
+            # Telethon fetches history in pages of 100 messages
+            if i and i % 100 == 0:
+                await self._request()
+            yield message
+
+    async def __call__(self, request):
+        await self._request()
+        messages = self.channels[int(request.peer)]
+
+        if isinstance(request, GetMessagesViewsRequest):
+            return MessagesMessageViews(
+                views=[
+                    MessageViews(
+                        views=messages[i].views,
+                        forwards=messages[i].forwards,
+                        replies=messages[i].replies,
+                    )
+                    for i in request.id
+                ],
+                chats=[],
+                users=[],
+            )
+
+        if isinstance(request, GetMessagesReactionsRequest):
+            peer = messages[request.id[0]].peer_id if request.id else None
+            return Updates(
+                updates=[
+                    UpdateMessageReactions(peer, i, messages[i].reactions)
+                    for i in request.id
+                ],
+                users=[],
+                chats=[],
+                date=datetime.now(timezone.utc),
+                seq=0,
+            )
+
+        raise NotImplementedError(f"{type(request).__name__} is not faked")
+
+    async def _request(self):
+        self.num_requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        else:
+            await asyncio.sleep(0)
+
+
+def install_telegram_client(client):
+    """Replace the Telethon client in every module that imported it."""
+    original = telegram_client_module.telegram_client
+    for module in list(sys.modules.values()):
+        if getattr(module, "telegram_client", None) is original:
+            module.telegram_client = client
+
+
+# Bot API
+
+
+class FakeBotApi:
+    """Local Bot API server answering every method with an empty success.
+
+    `latency` is added to every request to emulate the round trip to Telegram.
+    getUpdates hands out the updates of `queue_updates` in batches, like
+    Telegram, and long polls once they're all out.
+    """
+
+    METHODS = (
+        "answerCallbackQuery",
+        "deleteMessage",
+        "deleteWebhook",
+        "editMessageText",
+        "sendDocument",
+        "sendMessage",
+        "setMyCommands",
+        "setWebhook",
+    )
+    RESPONSE = json.dumps({"ok": True, "result": True}).encode()
+    UPDATES_LIMIT = 100
+    LONG_POLLING_TIMEOUT_SEC = 1
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.http_server = HttpServer("127.0.0.1", 0)
+        self.calls = {}
+        self.updates = []
+        self.num_served = 0
+        # set once the client asks for more after getting the last update
+        self.drained = asyncio.Event()
+        self._new_updates = asyncio.Event()
+        for method in self.METHODS:
+            self.http_server.route("POST", f"/bot{BOT_TOKEN}/{method}", self._handle)
+        self.http_server.route(
+            "GET", f"/bot{BOT_TOKEN}/getUpdates", self._handle_get_updates,
+        )
+
+    async def start(self):
+        await self.http_server.start()
+        port = self.http_server._server.sockets[0].getsockname()[1]
+        BotApiClient.BASE_URL = f"http://127.0.0.1:{port}/bot{BOT_TOKEN}"
+
+    async def stop(self):
+        await self.http_server.stop()
+
+    def queue_updates(self, updates):
+        self.updates.extend(updates)
+        self.drained.clear()
+        self._new_updates.set()
+
+    async def _handle_get_updates(self, request):
+        # the client polls again only after it has dispatched the last batch
+        if self.num_served == len(self.updates):
+            self.drained.set()
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(
+                    self._new_updates.wait(), self.LONG_POLLING_TIMEOUT_SEC,
+                )
+            except asyncio.TimeoutError:
+                pass
+
+        updates = self.updates[self.num_served:self.num_served + self.UPDATES_LIMIT]
+        self.num_served += len(updates)
+        return await self._handle(request, result=updates)
+
+    async def _handle(self, request, result=True):
+        method = request.path.rsplit("/", 1)[-1]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        body = self.RESPONSE
+        if result is not True:
+            body = json.dumps({"ok": True, "result": result}).encode()
+        return Response(HTTPStatus.OK, body, {"Content-Type": "application/json"})
+
+
+# QuestDB
+
+
+class FakeCursor:
+    def __init__(self, questdb):
+        self.questdb = questdb
+        self.rows = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def execute(self, query, params=None):
+        self.rows = self.questdb.respond(query, params)
+
+    async def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    async def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    closed = False
+    broken = False
+
+    def __init__(self, questdb):
+        self.questdb = questdb
+
+    def cursor(self):
+        return FakeCursor(self.questdb)
+
+    async def execute(self, query, params=None):
+        self.questdb.respond(query, params)
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeQuestDb:
+    """Answers the queries of the DAO layer from in-memory tables.
+
+    Connections go through the real `Database` and connection pool, only the
+    psycopg connection is replaced.
+    """
+
+    def __init__(self):
+        self.chats = {}
+        self.latest_stats = {}
+        self.num_queries = 0
+        self.num_inserts = 0
+
+    async def connect(self):
+        db._connect = self._connect
+        await db.connect()
+
+    async def _connect(self):
+        return FakeConnection(self)
+
+    def add_chat(self, chat_id, title, created_at=None):
+        if created_at is None:
+            # QuestDB returns timestamps as naive UTC
+            created_at = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(
+                weeks=52,
+            )
+        self.chats[str(chat_id)] = {
+            "chat_id": str(chat_id), "title": title, "created_at": created_at,
+        }
+
+    def set_latest_stats(self, peer_channel_id, messages):
+        self.latest_stats[str(peer_channel_id)] = [
+            {
+                "message_id": str(message.id),
+                "text": message.text,
+                "posted_at": message.date.replace(tzinfo=None),
+                "views": stats.views,
+                "reactions": stats.reactions,
+                "forwards": stats.forwards,
+                "replies": stats.replies,
+            }
+            for message, stats in ((m, m.get_stats()) for m in messages)
+        ]
+
+    def respond(self, query, params):
+        self.num_queries += 1
+        if query.startswith("INSERT"):
+            self.num_inserts += 1
+            return []
+        if "LATEST ON" in query:
+            return self.latest_stats.get(params["chat_id"], [])
+        if "FROM messages" in query and "%(chat_id)s" in query:
+            return self.latest_stats.get(params["chat_id"], [])
+        if "FROM chats WHERE" in query:
+            row = self.chats.get(params[0])
+            return [row] if row else []
+        if "FROM chats" in query:
+            return list(self.chats.values())
+        return []
+
+
+class IlpSink:
+    """TCP server that reads InfluxDB line protocol and counts the rows."""
+
+    def __init__(self):
+        self.num_rows = 0
+        self._socket = socket.create_server(("127.0.0.1", 0))
+        self.port = self._socket.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def make_sender(self, **kwargs):
+        """Drop-in for `questdb.ingress.Sender` writing to this sink."""
+        return IlpSender("127.0.0.1", self.port)
+
+    def _serve(self):
+        while True:
+            conn, _ = self._socket.accept()
+            threading.Thread(target=self._read, args=(conn,), daemon=True).start()
+
+    def _read(self, conn):
+        with conn:
+            while data := conn.recv(1024 * 1024):
+                self.num_rows += data.count(b"\n")
+
+
+class IlpSender:
+    """Minimal line protocol sender with the interface the ingester uses."""
+
+    def __init__(self, host, port):
+        self.address = (host, port)
+        self._socket = None
+        self._buffer = []
+        self._size = 0
+
+    def connect(self):
+        self._socket = socket.create_connection(self.address)
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+
+    def row(self, table, symbols=None, columns=None, at=None):
+        line = table
+        if symbols:
+            line += "," + ",".join(f"{name}={value}" for name, value in symbols.items())
+        line += " " + ",".join(
+            f"{name}={value}i" for name, value in (columns or {}).items()
+        )
+        if at is not None:
+            line += f" {at.value}"
+        line += "\n"
+        self._buffer.append(line)
+        self._size += len(line)
+
+    def __len__(self):
+        return self._size
+
+    def flush(self):
+        self._socket.sendall("".join(self._buffer).encode())
+        self._buffer, self._size = [], 0
+
+
+def make_stats_rows(n):
+    return [
+        IngestRow(
+            "stats",
+            symbols={"message_id": str(i), "chat_id": "1234567890"},
+            columns={"views": i, "reactions": 3, "forwards": 2, "replies": 1},
+        )
+        for i in range(n)
+    ]
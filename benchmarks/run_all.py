@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""Run every benchmark and print their results as one JSON list.
+
+Each benchmark patches the bot's modules with its own stand-ins, so every one
+runs in a separate interpreter. Pass a path to also write the results there,
+e.g. to compare them with a previous run.
+"""
+import glob
+import json
+import os
+import subprocess
+import sys
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_benchmark(path):
+    result = subprocess.run(
+        [sys.executable, path], capture_output=True, text=True, cwd=BENCHMARKS_DIR,
+    )
+    if result.returncode != 0:
+        print(result.stderr, file=sys.stderr)
+        return {"benchmark": os.path.basename(path), "error": result.returncode}
+
+    return json.loads(result.stdout)
+
+
+def main():
+    results = []
+    for path in sorted(glob.glob(os.path.join(BENCHMARKS_DIR, "bench_*.py"))):
+        print(f"Running {os.path.basename(path)}", file=sys.stderr)
+        results.append(run_benchmark(path))
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "w") as output_file:
+            output_file.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
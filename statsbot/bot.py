@@ -1,22 +1,51 @@
 import asyncio
 import logging
+import time
 
 from bot_api.client import BotApiClient
 from bot_api.models import Message, Callback
+from bot_api.webhook import WebhookServer
+from dispatcher import UpdateDispatcher
 from handlers import HandlerRegistry
+from metrics import registry
+from settings import (
+    MAX_CONCURRENT_UPDATES,
+    UPDATES_MODE,
+    WEBHOOK_LISTEN_HOST,
+    WEBHOOK_LISTEN_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+)
 from telegram_client import telegram_client
 
 logger = logging.getLogger(__name__)
 
+UPDATES_SECONDS = registry.histogram(
+    "statsbot_update_seconds", "Time to process an update", ("key",),
+)
+
 
 class Bot:
+    ALLOWED_UPDATES = ["message", "callback_query"]
+
     def __init__(self):
         self.bot_api = BotApiClient()
+        self.dispatcher = UpdateDispatcher(
+            self._process_update, max_in_flight=MAX_CONCURRENT_UPDATES,
+        )
+        registry.gauge(
+            "statsbot_updates_in_flight", "Updates queued or being processed",
+        ).set_function(lambda: self.dispatcher.in_flight)
 
     async def start(self):
         # populate entity cache
         await self.load_dialogs()
-        await asyncio.gather(self._set_commands(), self._process_updates())
+        if UPDATES_MODE == "webhook":
+            receive_updates = self._serve_webhook()
+        else:
+            receive_updates = self._process_updates()
+        await asyncio.gather(self._set_commands(), receive_updates)
 
     async def load_dialogs(self, limit=20):
         logger.info("Start loading dialogs")
@@ -39,14 +68,44 @@ class Bot:
         else:
             logger.warning("No commands to set")
 
+    async def _serve_webhook(self):
+        webhook_server = WebhookServer(
+            self.dispatcher.dispatch,
+            host=WEBHOOK_LISTEN_HOST,
+            port=WEBHOOK_LISTEN_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+        )
+        await webhook_server.start()
+        await self.bot_api.set_webhook(
+            WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=self.ALLOWED_UPDATES,
+        )
+        logger.info(f"Webhook set, receiving updates at {WEBHOOK_URL}")
+        await webhook_server.serve_forever()
+
     async def _process_updates(self):
+        # getUpdates is rejected while a webhook is set
+        await self.bot_api.delete_webhook()
+
         logger.info("Enter updates-processing loop")
         while True:
             for update_json in await self.bot_api.get_updates():
-                await self._process_update(update_json)
+                await self.dispatcher.dispatch(update_json)
         logger.info("Updates-processing loop shut down")
 
     async def _process_update(self, update_json):
+        started_at = time.perf_counter()
+        handled_key = "unrecognized"
+        try:
+            handled_key = await self._route_update(update_json)
+        finally:
+            UPDATES_SECONDS.labels(handled_key).observe(
+                time.perf_counter() - started_at
+            )
+
+    async def _route_update(self, update_json):
         update_id = update_json.get("update_id")
         logger.info("Start processing update id=%s: %s", update_id, update_json)
 
@@ -63,12 +122,13 @@ class Bot:
 
         if key is None:
             logger.warning("Unrecognized update type, skipping processing")
-            return
+            return "unrecognized"
 
         if handler_cls := HandlerRegistry.get_handler(key):
             handler = handler_cls(self)
             await handler.handle(update)
         else:
+            key = "unhandled"
             if command := getattr(update, "command", None):
                 await self.bot_api.post_message(
                     update.chat.id,
@@ -77,4 +137,5 @@ class Bot:
             logger.warning(f"No handler found for key {key}")
 
         logger.info("Finished processing update id=%s", update_id)
+        return key
 
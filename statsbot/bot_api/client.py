@@ -1,30 +1,122 @@
+import asyncio
 import logging
+import random
+import time
 
 import httpx
 
-from settings import BOT_TOKEN
+from metrics import registry
+from settings import (
+    BOT_API_HTTP2,
+    BOT_API_MAX_CONNECTIONS,
+    BOT_API_URL,
+    BOT_TOKEN,
+    SEND_CHAT_BURST,
+    SEND_CHAT_RATE_PER_SEC,
+    SEND_GROUP_RATE_PER_MIN,
+    SEND_RATE_PER_SEC,
+)
+
+from . import codec
+from .scheduler import SendScheduler
+
+try:
+    import h2  # noqa: F401
+except ImportError:
+    HTTP2_AVAILABLE = False
+else:
+    HTTP2_AVAILABLE = True
 
 logger = logging.getLogger(__name__)
 
+REQUEST_SECONDS = registry.histogram(
+    "statsbot_bot_api_request_seconds", "Latency of Bot API requests", ("method",),
+)
+RESPONSES = registry.counter(
+    "statsbot_bot_api_responses_total", "Bot API responses by status",
+    ("method", "status"),
+)
+RETRIES = registry.counter(
+    "statsbot_bot_api_retries_total", "Bot API requests sent again", ("method",),
+)
+
 
 class BotApiClient:
+    PRIORITY_INTERACTIVE = SendScheduler.PRIORITY_INTERACTIVE
+    PRIORITY_BULK = SendScheduler.PRIORITY_BULK
+
     TIMEOUT = 15
+    CONNECT_TIMEOUT = 5
     LONG_POLLING_TIMEOUT = 60
-    BASE_URL = f"https://api.telegram.org/bot{BOT_TOKEN}"
+    KEEPALIVE_EXPIRY_SEC = 60
+    BASE_URL = f"{BOT_API_URL}/bot{BOT_TOKEN}"
+
+    MAX_RETRIES = 3
+    RETRY_BASE_DELAY_SEC = 0.2
+    RETRY_MAX_DELAY_SEC = 5
+    # methods that can be repeated without visible effects, sending a message
+    # twice would post it twice
+    IDEMPOTENT_METHODS = frozenset({
+        "answerCallbackQuery",
+        "deleteMessage",
+        "deleteWebhook",
+        "editMessageText",
+        "getUpdates",
+        "setMyCommands",
+        "setWebhook",
+    })
+    # the request never left the client, so any method can be retried
+    NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
 
     def __init__(self):
         self.last_update_id = None
-        self.http_client = httpx.AsyncClient(timeout=self.TIMEOUT)
         self.headers = {"Content-Type": "application/json"}
 
+        http2 = BOT_API_HTTP2 and HTTP2_AVAILABLE
+        if BOT_API_HTTP2 and not HTTP2_AVAILABLE:
+            logger.warning("HTTP/2 is enabled but the h2 package is not installed")
+
+        # sends get their own pool so that they never wait behind a long poll
+        self.http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.TIMEOUT, connect=self.CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=BOT_API_MAX_CONNECTIONS,
+                max_keepalive_connections=BOT_API_MAX_CONNECTIONS,
+                keepalive_expiry=self.KEEPALIVE_EXPIRY_SEC,
+            ),
+            http2=http2,
+        )
+        self.polling_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                self.LONG_POLLING_TIMEOUT + 5, connect=self.CONNECT_TIMEOUT,
+            ),
+            limits=httpx.Limits(
+                max_connections=1,
+                max_keepalive_connections=1,
+                keepalive_expiry=self.LONG_POLLING_TIMEOUT + 5,
+            ),
+        )
+        self.scheduler = SendScheduler(
+            rate=SEND_RATE_PER_SEC,
+            chat_rate=SEND_CHAT_RATE_PER_SEC,
+            chat_burst=SEND_CHAT_BURST,
+            group_rate=SEND_GROUP_RATE_PER_MIN / 60,
+        )
+
     @property
     def offset(self):
         return self.last_update_id + 1 if self.last_update_id else None
 
+    async def close(self):
+        await self.scheduler.close()
+        await self.http_client.aclose()
+        await self.polling_client.aclose()
+
     async def get_updates(self):
-        resp = await self.http_client.get(
-            f"{self.BASE_URL}/getUpdates",
-            timeout=self.LONG_POLLING_TIMEOUT + 5,
+        resp = await self._request(
+            self.polling_client,
+            "GET",
+            "getUpdates",
             params={
                 "offset": self.offset,
                 "timeout": self.LONG_POLLING_TIMEOUT,
@@ -32,7 +124,7 @@ class BotApiClient:
             headers=self.headers,
         )
 
-        if data := resp.json():
+        if data := codec.loads(resp.content):
             if updates := data["result"]:
                 last_update = updates[-1]
                 self.last_update_id = last_update["update_id"]
@@ -41,17 +133,90 @@ class BotApiClient:
         return []
 
     async def _post(self, method, **params):
-        url = f"{self.BASE_URL}/{method}"
-        resp = await self.http_client.post(url, headers=self.headers, **params)
+        if "json" in params:
+            params["content"] = codec.dumps(params.pop("json"))
+            params["headers"] = self.headers
+        resp = await self._request(self.http_client, "POST", method, **params)
         logging.debug(
-            "POST result: url=%s status=%s body=%s", url, resp.status_code, resp.text
+            "POST result: method=%s status=%s body=%s",
+            method, resp.status_code, resp.text,
         )
         return resp
 
+    async def _request(self, client, http_method, method, **params):
+        """Send a request, retrying transient failures with jittered backoff.
+
+        Connection failures are retried for any method. Timeouts, dropped
+        connections and 5xx responses only for idempotent methods.
+        """
+        url = f"{self.BASE_URL}/{method}"
+        idempotent = method in self.IDEMPOTENT_METHODS
+
+        for attempt in range(self.MAX_RETRIES + 1):
+            started_at = time.perf_counter()
+            try:
+                resp = await client.request(http_method, url, **params)
+            except httpx.TransportError as exc:
+                RESPONSES.labels(method, "error").inc()
+                if attempt == self.MAX_RETRIES or not (
+                    idempotent or isinstance(exc, self.NOT_SENT_ERRORS)
+                ):
+                    raise
+                reason = repr(exc)
+            else:
+                self._record_response(method, resp, started_at)
+                if (
+                    attempt == self.MAX_RETRIES
+                    or not idempotent
+                    or resp.status_code < 500
+                ):
+                    return resp
+                reason = f"status {resp.status_code}"
+
+            delay = self._get_retry_delay(attempt)
+            RETRIES.labels(method).inc()
+            logger.warning(f"{method} failed ({reason}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    def _get_retry_delay(self, attempt):
+        # "full jitter": spreads the retries of concurrent requests apart
+        cap = min(self.RETRY_MAX_DELAY_SEC, self.RETRY_BASE_DELAY_SEC * 2 ** attempt)
+        return random.uniform(0, cap)
+
+    async def _send(self, chat_id, method, priority=PRIORITY_INTERACTIVE, **params):
+        """Post through the scheduler, which paces sends and retries on 429."""
+        return await self.scheduler.submit(
+            chat_id, lambda: self._post(method, **params), priority,
+        )
+
+    @staticmethod
+    def _record_response(method, resp, started_at):
+        REQUEST_SECONDS.labels(method).observe(time.perf_counter() - started_at)
+        RESPONSES.labels(method, resp.status_code).inc()
+
     async def set_my_commands(self, commands):
         return await self._post("setMyCommands", json={"commands": commands})
 
-    async def post_message(self, chat_id, text, parse_mode="HTML", reply_markup=None):
+    async def set_webhook(self, url, secret_token=None, allowed_updates=None):
+        body = {"url": url}
+        if secret_token:
+            body["secret_token"] = secret_token
+        if allowed_updates:
+            body["allowed_updates"] = allowed_updates
+
+        return await self._post("setWebhook", json=body)
+
+    async def delete_webhook(self):
+        return await self._post("deleteWebhook", json={})
+
+    async def post_message(
+        self,
+        chat_id,
+        text,
+        parse_mode="HTML",
+        reply_markup=None,
+        priority=PRIORITY_INTERACTIVE,
+    ):
         body = {
             "chat_id": chat_id,
             "text": text,
@@ -61,14 +226,17 @@ class BotApiClient:
         if reply_markup:
             body["reply_markup"] = reply_markup
 
-        return await self._post("sendMessage", json=body)
+        return await self._send(chat_id, "sendMessage", priority, json=body)
 
-    async def answer_callback(self, callback_query_id):
+    async def answer_callback(self, callback_query_id, text=None):
         body = {
             "callback_query_id": callback_query_id,
         }
+        if text:
+            body["text"] = text
 
-        return await self._post("answerCallbackQuery", json=body)
+        # not sent to a chat, only the global limit applies
+        return await self._send(None, "answerCallbackQuery", json=body)
 
     async def edit_message_text(
         self, chat_id, message_id, text, parse_mode="HTML", reply_markup=None,
@@ -83,7 +251,7 @@ class BotApiClient:
         if reply_markup:
             body["reply_markup"] = reply_markup
 
-        return await self._post("editMessageText", json=body)
+        return await self._send(chat_id, "editMessageText", json=body)
 
     async def delete_message(self, chat_id, message_id):
         body = {
@@ -91,5 +259,29 @@ class BotApiClient:
             "message_id": message_id,
         }
 
-        return await self._post("deleteMessage", json=body)
+        return await self._send(chat_id, "deleteMessage", json=body)
 
+    async def send_document(
+        self,
+        chat_id,
+        filename,
+        content,
+        mime_type,
+        caption=None,
+        parse_mode=None,
+        priority=PRIORITY_INTERACTIVE,
+    ):
+        """Upload `content` as a file with multipart/form-data."""
+        data = {"chat_id": str(chat_id)}
+        if caption:
+            data["caption"] = caption
+            if parse_mode:
+                data["parse_mode"] = parse_mode
+
+        return await self._send(
+            chat_id,
+            "sendDocument",
+            priority,
+            data=data,
+            files={"document": (filename, content, mime_type)},
+        )
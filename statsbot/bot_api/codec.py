@@ -0,0 +1,33 @@
+"""JSON codec of the Bot API path.
+
+Uses orjson when it's installed and the json module otherwise. Both encode
+without whitespace, which also keeps callback data under Telegram's 64 bytes.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    NAME = "orjson"
+
+    def dumps(obj):
+        return orjson.dumps(obj)
+
+    def dumps_str(obj):
+        return orjson.dumps(obj).decode()
+
+    loads = orjson.loads
+else:
+    NAME = "json"
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def dumps(obj):
+        return _encoder.encode(obj).encode()
+
+    def dumps_str(obj):
+        return _encoder.encode(obj)
+
+    loads = json.loads
@@ -1,10 +1,13 @@
 from dataclasses import dataclass, field
-from functools import cached_property
 from typing import Any, Self
-import json
 
+from . import codec
 
-@dataclass
+# marks lazily parsed attributes that haven't been accessed yet
+_UNSET = object()
+
+
+@dataclass(slots=True)
 class ForwardFromChat:
     chat_id: int
     title: str | None = field(repr=False)
@@ -20,7 +23,7 @@ class ForwardFromChat:
         return cls(chat_id, title, username, chat_type)
 
 
-@dataclass
+@dataclass(slots=True)
 class Chat:
     id: int
     title: str | None = field(repr=False)
@@ -34,7 +37,7 @@ class Chat:
         return cls(chat_id, title, chat_type)
 
 
-@dataclass
+@dataclass(slots=True)
 class Entity:
     offset: int
     length: int
@@ -48,7 +51,7 @@ class Entity:
         return Entity(offset, length, type)
 
 
-@dataclass
+@dataclass(slots=True)
 class Command:
     command: str
     params: list[str]
@@ -58,7 +61,7 @@ class Command:
     params_clean: list[Any] = field(default_factory=list, init=False)
 
 
-@dataclass
+@dataclass(slots=True)
 class Peer:
     id: int
     username: str | None
@@ -70,47 +73,87 @@ class Peer:
         return Peer(id_, username)
 
 
-@dataclass
 class Message:
-    text: str | None = field(repr=False)
-    message_id: int
-    chat: Chat
-    from_: Peer
-    date: int
-    entities: list[Entity]
-    forward_from_chat: ForwardFromChat | None
+    """Message wrapping its decoded JSON.
 
-    @classmethod
-    def from_json(cls, message_json: dict) -> Self:
-        text = message_json.get("text")
-        message_id = message_json["message_id"]
-        chat = Chat.from_json(message_json["chat"])
-        date = message_json["date"]
-
-        entities_json = message_json.get("entities", [])
-        if entities_json:
-            entities = [Entity.from_json(entity) for entity in entities_json]
-        else:
-            entities = []
+    Nested objects are only built when they're first accessed, routing an
+    update usually needs nothing but the command or the forwarded chat.
+    """
 
-        if forward_json := message_json.get("forward_from_chat"):
-            forward_from_chat = ForwardFromChat.from_json(forward_json)
-        else:
-            forward_from_chat = None
+    __slots__ = (
+        "_json", "_chat", "_from", "_forward_from_chat", "_entities", "_command",
+    )
 
-        if from_ := message_json.get("from"):
-            from_ = Peer.from_json(from_)
-        else:
-            from_ = None
+    def __init__(self, message_json: dict):
+        self._json = message_json
+        self._chat = _UNSET
+        self._from = _UNSET
+        self._forward_from_chat = _UNSET
+        self._entities = _UNSET
+        self._command = _UNSET
 
-        return cls(text, message_id, chat, from_, date, entities, forward_from_chat)
+    def __repr__(self) -> str:
+        return f"Message(message_id={self.message_id}, chat_id={self.chat.id})"
 
-    @cached_property
+    @classmethod
+    def from_json(cls, message_json: dict) -> Self:
+        return cls(message_json)
+
+    @property
+    def text(self) -> str | None:
+        return self._json.get("text")
+
+    @property
+    def message_id(self) -> int:
+        return self._json["message_id"]
+
+    @property
+    def date(self) -> int:
+        return self._json["date"]
+
+    @property
+    def chat(self) -> Chat:
+        if self._chat is _UNSET:
+            self._chat = Chat.from_json(self._json["chat"])
+        return self._chat
+
+    @property
+    def from_(self) -> Peer | None:
+        if self._from is _UNSET:
+            from_json = self._json.get("from")
+            self._from = Peer.from_json(from_json) if from_json else None
+        return self._from
+
+    @property
+    def forward_from_chat(self) -> ForwardFromChat | None:
+        if self._forward_from_chat is _UNSET:
+            forward_json = self._json.get("forward_from_chat")
+            self._forward_from_chat = (
+                ForwardFromChat.from_json(forward_json) if forward_json else None
+            )
+        return self._forward_from_chat
+
+    @property
+    def entities(self) -> list[Entity]:
+        if self._entities is _UNSET:
+            self._entities = [
+                Entity.from_json(entity) for entity in self._json.get("entities", ())
+            ]
+        return self._entities
+
+    @property
     def command(self) -> Command | None:
-        entities = self.get_entities_by_type("bot_command")
-        entity = next(iter(entities), None)
-
-        if not entity:
+        if self._command is _UNSET:
+            self._command = self._parse_command()
+        return self._command
+
+    def _parse_command(self) -> Command | None:
+        # only the first command entity is parsed, the others are never built
+        for entity_json in self._json.get("entities", ()):
+            if entity_json["type"] == "bot_command":
+                entity = Entity.from_json(entity_json)
+                break
+        else:
             return None
 
         assert self.text
@@ -130,7 +173,6 @@ class Message:
         assert self.text
 
         offset, length = entity.offset, entity.length
-        command_str = self.text[offset + 1 : offset + length].lower()
         return self.text[offset + 1 : offset + length]
 
     def get_tags(self) -> list[str]:
@@ -144,23 +186,37 @@ class Message:
         return tags
 
 
-@dataclass
 class Callback:
-    id: int
-    message: Message
-    data: dict
+    """Callback query wrapping its decoded JSON, parsed on first access."""
 
-    @classmethod
-    def from_json(cls, callback_json: dict) -> Self:
-        id_ = callback_json.get("id")
+    __slots__ = ("_json", "_message", "_data")
 
-        if data := callback_json.get("data"):
-            data = json.loads(data)
+    def __init__(self, callback_json: dict):
+        self._json = callback_json
+        self._message = _UNSET
+        self._data = _UNSET
 
-        if message_json := callback_json.get("message"):
-            message = Message.from_json(message_json)
-        else:
-            message = None
-
-        return Callback(id_, message, data)
+    def __repr__(self) -> str:
+        return f"Callback(id={self.id}, data={self.data})"
 
+    @classmethod
+    def from_json(cls, callback_json: dict) -> Self:
+        return cls(callback_json)
+
+    @property
+    def id(self) -> str | None:
+        return self._json.get("id")
+
+    @property
+    def message(self) -> Message | None:
+        if self._message is _UNSET:
+            message_json = self._json.get("message")
+            self._message = Message.from_json(message_json) if message_json else None
+        return self._message
+
+    @property
+    def data(self) -> dict | None:
+        if self._data is _UNSET:
+            data = self._json.get("data")
+            self._data = codec.loads(data) if data else data
+        return self._data
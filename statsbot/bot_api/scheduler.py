@@ -0,0 +1,276 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from heapq import heappop, heappush
+from itertools import count
+from typing import Any, Awaitable, Callable
+
+from metrics import registry
+
+from . import codec
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SECONDS = registry.histogram(
+    "statsbot_send_queue_seconds", "Time outgoing requests wait to be sent",
+    ("priority",),
+)
+RETRY_AFTERS = registry.counter(
+    "statsbot_send_retry_after_total", "Requests rejected by Telegram with 429",
+)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    @property
+    def is_full(self):
+        self._refill()
+        return self.tokens >= self.burst
+
+    def get_wait_time(self):
+        """Seconds until a token is available, 0 if one is available now."""
+        self._refill()
+        return max(0, (1 - self.tokens) / self.rate)
+
+    def take(self):
+        self.tokens -= 1
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+
+@dataclass(order=True)
+class _Job:
+    priority: int
+    seq: int
+    chat_id: Any = field(compare=False)
+    send: Callable[[], Awaitable] = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    queued_at: float = field(compare=False, default_factory=time.monotonic)
+    attempts: int = field(compare=False, default=0)
+
+
+class SendScheduler:
+    """Paces outgoing Bot API requests to stay within Telegram's limits.
+
+    Every request takes a token from the global bucket and, when it's sent to
+    a chat, from the bucket of that chat (groups get a slower one). Requests
+    to the same chat are sent one at a time in the order they were submitted,
+    whatever their priority. Among the chats' next requests and the requests
+    without a chat, interactive ones go first, so answering a button press
+    isn't stuck behind the pages of a long report to another chat. A 429
+    response pauses the chat (or everything, for requests without a chat) for
+    its `retry_after` and the request is sent again.
+
+    Every chat has a queue of its own, only its oldest request is a candidate
+    for sending. Candidates are kept in a heap by priority, and those waiting
+    for their chat's rate limit in another one by the time they can be sent.
+    """
+
+    PRIORITY_INTERACTIVE = 0
+    PRIORITY_BULK = 1
+    PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BULK: "bulk"}
+    MAX_RETRIES = 5
+    MAX_IDLE_CHATS = 10_000
+    # pause after an unexpected error in the worker, so it doesn't spin on it
+    ERROR_BACKOFF_SEC = 1
+
+    def __init__(self, rate, chat_rate, chat_burst, group_rate):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.bucket = TokenBucket(rate, burst=rate)
+        self.chat_buckets = {}
+        self.blocked_until = {}
+        # chat_id -> jobs to the chat in the order they were submitted
+        self.chat_queues = {}
+        # jobs that can be sent once there's a token, by priority
+        self.ready = []
+        # `(time they can be sent at, seq, job)` of jobs waiting for their chat
+        self.delayed = []
+        self.num_queued = 0
+        self.busy_chats = set()
+        self._seq = count()
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self._sending = set()
+        registry.gauge(
+            "statsbot_send_queue_size", "Outgoing requests waiting to be sent",
+        ).set_function(lambda: self.num_queued)
+
+    async def submit(self, chat_id, send, priority=PRIORITY_INTERACTIVE):
+        """Schedule `send()` and return its response once it was sent."""
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(_Job(priority, next(self._seq), chat_id, send, future))
+        return await future
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    def _enqueue(self, job, retry=False):
+        self.num_queued += 1
+        if job.chat_id is None:
+            heappush(self.ready, job)
+        elif (jobs := self.chat_queues.get(job.chat_id)) is None:
+            self.chat_queues[job.chat_id] = deque((job,))
+            if job.chat_id not in self.busy_chats:
+                heappush(self.ready, job)
+        elif retry:
+            # a retried job is older than the rest of its chat's jobs
+            jobs.appendleft(job)
+        else:
+            jobs.append(job)
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                self._wakeup.clear()
+                job, wait_time = self._pop_ready_job()
+                if job is None:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=wait_time)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                task = asyncio.create_task(self._send(job))
+                self._sending.add(task)
+                task.add_done_callback(self._sending.discard)
+            except Exception:
+                # a dead worker would leave every submitted request hanging
+                logger.exception("Failed to schedule outgoing requests")
+                await asyncio.sleep(self.ERROR_BACKOFF_SEC)
+
+    def _pop_ready_job(self):
+        """Return the first job that can be sent now, or how long to wait for one."""
+        now = time.monotonic()
+        if (global_wait := self.blocked_until.get(None, 0) - now) > 0:
+            return None, global_wait
+
+        while self.delayed and self.delayed[0][0] <= now:
+            _, _, job = heappop(self.delayed)
+            heappush(self.ready, job)
+
+        while self.ready:
+            job = heappop(self.ready)
+            # drop the jobs whose callers have given up on them
+            if job.future.done():
+                self._remove(job)
+                continue
+
+            blocked = self.blocked_until.get(job.chat_id, 0) - now
+            chat_bucket = self._get_chat_bucket(job.chat_id)
+            if chat_bucket and blocked <= 0:
+                blocked = chat_bucket.get_wait_time()
+            if blocked > 0:
+                heappush(self.delayed, (now + blocked, job.seq, job))
+                continue
+
+            if (global_wait := self.bucket.get_wait_time()) > 0:
+                heappush(self.ready, job)
+                return None, global_wait
+
+            self.bucket.take()
+            if chat_bucket:
+                chat_bucket.take()
+                self.busy_chats.add(job.chat_id)
+            self._remove(job)
+            return job, None
+
+        self._forget_idle_chats()
+        return None, self.delayed[0][0] - now if self.delayed else None
+
+    def _remove(self, job):
+        """Take a job off the queue, its chat's next job becomes a candidate."""
+        self.num_queued -= 1
+        if job.chat_id is None:
+            return
+
+        jobs = self.chat_queues[job.chat_id]
+        jobs.popleft()
+        if not jobs:
+            del self.chat_queues[job.chat_id]
+        elif job.chat_id not in self.busy_chats:
+            heappush(self.ready, jobs[0])
+
+    def _on_chat_idle(self, chat_id):
+        self.busy_chats.discard(chat_id)
+        if jobs := self.chat_queues.get(chat_id):
+            heappush(self.ready, jobs[0])
+
+    def _get_chat_bucket(self, chat_id):
+        if chat_id is None:
+            return None
+
+        if (chat_bucket := self.chat_buckets.get(chat_id)) is None:
+            # ids of groups and channels are negative, private chats positive
+            if int(chat_id) < 0:
+                chat_bucket = TokenBucket(self.group_rate, burst=1)
+            else:
+                chat_bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self.chat_buckets[chat_id] = chat_bucket
+        return chat_bucket
+
+    def _forget_idle_chats(self):
+        if len(self.chat_buckets) <= self.MAX_IDLE_CHATS:
+            return
+
+        now = time.monotonic()
+        self.chat_buckets = {
+            chat_id: bucket for chat_id, bucket in self.chat_buckets.items()
+            if chat_id in self.busy_chats or not bucket.is_full
+        }
+        self.blocked_until = {
+            chat_id: until for chat_id, until in self.blocked_until.items()
+            if until > now
+        }
+
+    async def _send(self, job):
+        QUEUE_SECONDS.labels(self.PRIORITY_NAMES[job.priority]).observe(
+            time.monotonic() - job.queued_at
+        )
+        try:
+            resp = await job.send()
+        except Exception as exc:
+            if not job.future.done():
+                job.future.set_exception(exc)
+        else:
+            if resp.status_code == 429 and job.attempts < self.MAX_RETRIES:
+                self._retry_later(job, self._get_retry_after(resp))
+            elif not job.future.done():
+                job.future.set_result(resp)
+        finally:
+            if job.chat_id is not None:
+                self._on_chat_idle(job.chat_id)
+            self._wakeup.set()
+
+    def _retry_later(self, job, retry_after):
+        RETRY_AFTERS.inc()
+        logger.warning(
+            f"Too many requests to chat_id={job.chat_id}, retrying in {retry_after}s"
+        )
+        self.blocked_until[job.chat_id] = time.monotonic() + retry_after
+        job.attempts += 1
+        self._enqueue(job, retry=True)
+
+    @staticmethod
+    def _get_retry_after(resp):
+        try:
+            return codec.loads(resp.content)["parameters"]["retry_after"]
+        except (ValueError, KeyError, TypeError):
+            return 1
@@ -0,0 +1,47 @@
+import hmac
+import logging
+from http import HTTPStatus
+
+from http_server import HttpServer, Response
+
+from . import codec
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookServer:
+    SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+    def __init__(self, on_update, host, port, path, secret_token=None):
+        self.on_update = on_update
+        self.secret_token = secret_token
+        self.http_server = HttpServer(host, port)
+        self.http_server.route("POST", path, self._handle_update)
+
+    async def start(self):
+        await self.http_server.start()
+
+    async def serve_forever(self):
+        await self.http_server.serve_forever()
+
+    async def stop(self):
+        await self.http_server.stop()
+
+    async def _handle_update(self, request):
+        if self.secret_token:
+            received_token = request.headers.get(self.SECRET_HEADER, "")
+            if not hmac.compare_digest(received_token, self.secret_token):
+                logger.warning("Webhook request with invalid secret token rejected")
+                return Response(HTTPStatus.FORBIDDEN)
+
+        try:
+            update_json = codec.loads(request.body)
+        except ValueError:
+            logger.warning("Webhook request with invalid JSON body rejected")
+            return Response(HTTPStatus.BAD_REQUEST)
+
+        if not isinstance(update_json, dict) or "update_id" not in update_json:
+            return Response(HTTPStatus.BAD_REQUEST)
+
+        await self.on_update(update_json)
+        return Response(HTTPStatus.OK)
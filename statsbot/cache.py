@@ -0,0 +1,48 @@
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class LruCache:
+    """Bounded mapping that evicts the least recently used entries.
+
+    `None` values are only cached when `cache_none` is set, which allows
+    remembering lookups that found nothing.
+    """
+
+    def __init__(self, max_size, cache_none=False):
+        self.max_size = max_size
+        self.cache_none = cache_none
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=MISSING):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if value is None and not self.cache_none:
+            self._data.pop(key, None)
+            return
+
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
@@ -1,6 +1,9 @@
-from datetime import datetime
-from dto import ChatDto, UserDto
+from datetime import datetime, timedelta, timezone
+from cache import LruCache, MISSING
+from dto import ChatDto, MessageDto, StatsDto, UserDto
 from db import db
+from settings import CHAT_CACHE_SIZE, DAO_CACHE_MISSING, DEFAULT_TZ, USER_CACHE_SIZE
+from utils import batch
 
 
 def to_timestamp(date):
@@ -8,69 +11,145 @@ def to_timestamp(date):
 
 
 class BaseDao:
-    INSERT_SQL = "INSERT INTO {table} ({fields}) VALUES ({values});"
+    INSERT_SQL = "INSERT INTO {table} ({fields}) VALUES {values};"
 
     def __init__(self, db):
         self.db = db
 
-    def _make_insert_sql(self, table, fields, values=None):
+    def _make_insert_sql(self, table, fields, values=None, num_rows=1):
         fields_str = ",".join(fields)
         if values is None:
             values_str = ",".join(["%s"] * len(fields))
         else:
             values_str = ",".join(values)
+        rows_str = ",".join([f"({values_str})"] * num_rows)
 
         return self.INSERT_SQL.format(
-            table=table, fields=fields_str, values=values_str
+            table=table, fields=fields_str, values=rows_str
         )
 
     async def _insert(self, table, fields, values):
         sql = self._make_insert_sql(table, fields)
         await self.db.execute(sql, values)
 
+    async def _insert_many(self, table, fields, rows):
+        sql = self._make_insert_sql(table, fields, num_rows=len(rows))
+        await self.db.execute(sql, [value for row in rows for value in row])
+
 
 class MessageDao(BaseDao):
+    FIELDS = ("message_id", "chat_id", "text", "posted_at")
+    INSERT_BATCH_SIZE = 100
+    SEEN_CAPACITY = 100_000
+
+    def __init__(self, db):
+        super().__init__(db)
+        # (chat_id, message_id) -> hash of the content last written
+        self._seen = {}
+
     async def create_message(self, message_dto):
         return await self._insert(
-            "messages",
-            ("message_id", "chat_id", "text", "posted_at"),
-            (
-                str(message_dto.message_id),
-                str(message_dto.chat_id),
-                message_dto.text,
-                to_timestamp(message_dto.date)
-            ),
+            "messages", self.FIELDS, self._make_message_row(message_dto),
+        )
+
+    async def save_messages(self, message_dtos):
+        """Insert messages in multi-row batches, skipping the ones already written.
+
+        Returns the number of messages actually written.
+        """
+        changed = {}
+        for message_dto in message_dtos:
+            key = (message_dto.chat_id, message_dto.message_id)
+            content_hash = self._hash_content(message_dto)
+            if self._seen.get(key) != content_hash:
+                changed[key] = (message_dto, content_hash)
+
+        changed = list(changed.items())
+        for changed_batch in batch(changed, n=self.INSERT_BATCH_SIZE):
+            await self._insert_many(
+                "messages",
+                self.FIELDS,
+                [self._make_message_row(dto) for _, (dto, _) in changed_batch],
+            )
+            for key, (_, content_hash) in changed_batch:
+                self._remember(key, content_hash)
+
+        return len(changed)
+
+    def _remember(self, key, content_hash):
+        self._seen.pop(key, None)
+        self._seen[key] = content_hash
+        if len(self._seen) > self.SEEN_CAPACITY:
+            # dicts keep insertion order, so this forgets the oldest entry
+            del self._seen[next(iter(self._seen))]
+
+    @staticmethod
+    def _hash_content(message_dto):
+        return hash((message_dto.text, to_timestamp(message_dto.date)))
+
+    @staticmethod
+    def _make_message_row(message_dto):
+        return (
+            str(message_dto.message_id),
+            str(message_dto.chat_id),
+            message_dto.text,
+            to_timestamp(message_dto.date),
+        )
+
+    async def get_messages_since(self, since):
+        sql = (
+            "SELECT chat_id, message_id, posted_at FROM messages "
+            "WHERE posted_at >= %s;"
         )
+        return await self.db.fetch_all(sql, (to_timestamp(since),))
 
 message_dao = MessageDao(db)
 
 
 class ChatDao(BaseDao):
+    def __init__(self, db):
+        super().__init__(db)
+        self.cache = LruCache(CHAT_CACHE_SIZE, cache_none=DAO_CACHE_MISSING)
+        self._chats = None
 
     async def get_chat(self, chat_id):
+        chat_id = int(chat_id)
+        if (chat_dto := self.cache.get(chat_id)) is not MISSING:
+            return chat_dto
+
         sql = "SELECT chat_id, title, created_at FROM chats WHERE chat_id = %s;"
 
+        chat_dto = None
         if row := await self.db.fetch_one(sql, (str(chat_id),)):
-            return self._make_chat_dto(row)
+            chat_dto = self._make_chat_dto(row)
 
-        return None
+        self.cache.set(chat_id, chat_dto)
+        return chat_dto
 
     async def get_chats(self):
-        sql = "SELECT chat_id, title, created_at FROM chats;"
+        if self._chats is None:
+            sql = "SELECT chat_id, title, created_at FROM chats;"
 
-        chats = []
-        for row in await self.db.fetch_all(sql):
-            chat_dto = self._make_chat_dto(row)
-            chats.append(chat_dto)
+            # keyed by chat_id, so a chat created twice is only listed once
+            chats = {}
+            for row in await self.db.fetch_all(sql):
+                chat_dto = self._make_chat_dto(row)
+                chats[chat_dto.chat_id] = chat_dto
+
+            self._chats = chats
 
-        return chats
+        return list(self._chats.values())
 
     @staticmethod
     def _make_chat_dto(row):
-        return ChatDto(int(row["chat_id"]), row["title"], row["created_at"])
+        return ChatDto(
+            int(row["chat_id"]),
+            row["title"],
+            row["created_at"].replace(tzinfo=timezone.utc),
+        )
 
     async def create_chat(self, chat_dto):
-        return await self._insert(
+        await self._insert(
             "chats",
             ("chat_id", "title", "created_at"),
             (
@@ -80,20 +159,38 @@ class ChatDao(BaseDao):
             ),
         )
 
+        self.cache.set(int(chat_dto.chat_id), chat_dto)
+        if self._chats is not None:
+            self._chats[int(chat_dto.chat_id)] = chat_dto
+
 chat_dao = ChatDao(db)
 
 
 class UserDao(BaseDao):
+    def __init__(self, db):
+        super().__init__(db)
+        self.cache = LruCache(USER_CACHE_SIZE, cache_none=DAO_CACHE_MISSING)
+
     async def get_user(self, user_id):
+        user_id = int(user_id)
+        if (user_dto := self.cache.get(user_id)) is not MISSING:
+            return user_dto
+
         sql = "SELECT user_id, username, created_at FROM users WHERE user_id = %s;"
 
+        user_dto = None
         if row := await self.db.fetch_one(sql, (str(user_id),)):
-            return UserDto(int(row["user_id"]), row["username"], row["created_at"])
+            user_dto = UserDto(
+                int(row["user_id"]),
+                row["username"],
+                row["created_at"].replace(tzinfo=timezone.utc),
+            )
 
-        return None
+        self.cache.set(user_id, user_dto)
+        return user_dto
 
     async def create_user(self, user_dto):
-        return await self._insert(
+        await self._insert(
             "users",
             ("user_id", "username", "created_at"),
             (
@@ -103,5 +200,272 @@ class UserDao(BaseDao):
             ),
         )
 
+        self.cache.set(int(user_dto.user_id), user_dto)
+
 user_dao = UserDao(db)
 
+
+class StatsDao(BaseDao):
+    STATS_TABLE = "stats"
+    INSERT_BATCH_SIZE = 500
+    CHANNEL_TOTALS_FIELDS = (
+        "ts", "chat_id", "views", "reactions", "forwards", "replies", "messages",
+    )
+    # per-message and per-channel rollups of the stats table by interval
+    ROLLUP_TABLES = {
+        "1h": ("stats_hourly", "channel_stats_hourly"),
+        "1d": ("stats_daily", "channel_stats_daily"),
+    }
+
+    async def get_latest_stats(self, peer_channel_id, since, rolled_up_until=None):
+        """Return the latest collected snapshot of every message posted after `since`.
+
+        Snapshots before `rolled_up_until` are read from the daily rollup, so
+        long reports don't scan weeks of raw stats. The result is a list of
+        `(MessageDto, StatsDto)` tuples ordered by the posting time.
+        """
+        params = {"chat_id": str(peer_channel_id), "since": to_timestamp(since)}
+        latest_sql = """
+            SELECT message_id, views, reactions, forwards, replies
+            FROM {table}
+            WHERE chat_id = %(chat_id)s AND {where}
+            LATEST ON ts PARTITION BY message_id;
+        """
+
+        stats = {}
+        if rolled_up_until is not None and rolled_up_until > since:
+            message_table, _ = self.ROLLUP_TABLES["1d"]
+            # a daily row starts at midnight of the day its snapshot was taken
+            daily_params = {
+                **params,
+                "day_since": to_timestamp(since - timedelta(days=1)),
+                "until": to_timestamp(rolled_up_until),
+            }
+            sql = latest_sql.format(
+                table=message_table,
+                where="ts >= %(day_since)s AND ts < %(until)s",
+            )
+            for row in await self.db.fetch_all(sql, daily_params):
+                stats[row["message_id"]] = self._make_stats_dto(row)
+            params["since"] = to_timestamp(rolled_up_until)
+
+        sql = latest_sql.format(table=self.STATS_TABLE, where="ts >= %(since)s")
+        for row in await self.db.fetch_all(sql, params):
+            stats[row["message_id"]] = self._make_stats_dto(row)
+
+        sql = """
+            SELECT message_id, text, posted_at
+            FROM messages
+            WHERE chat_id = %(chat_id)s AND posted_at >= %(since)s
+            ORDER BY posted_at;
+        """
+        params = {"chat_id": str(peer_channel_id), "since": to_timestamp(since)}
+
+        results = []
+        for row in await self.db.fetch_all(sql, params):
+            if (stats_dto := stats.get(row["message_id"])) is None:
+                continue
+            message_dto = MessageDto(
+                int(row["message_id"]),
+                peer_channel_id,
+                row["text"],
+                row["posted_at"].replace(tzinfo=timezone.utc),
+            )
+            results.append((message_dto, stats_dto))
+
+        return results
+
+    async def get_latest_counters(self, since, until=None, sample_by=None):
+        """Return the last snapshot written in `[since, until)` of every message.
+
+        Snapshots are read from the per-message rollup of `sample_by` if it's
+        given, raw stats otherwise. The result is a list of
+        `(peer_channel_id, message_id, ts, StatsDto)`.
+        """
+        table = self.STATS_TABLE
+        if sample_by is not None:
+            table, _ = self.ROLLUP_TABLES[sample_by]
+        where = "ts >= %(since)s"
+        params = {"since": to_timestamp(since)}
+        if until is not None:
+            where += " AND ts < %(until)s"
+            params["until"] = to_timestamp(until)
+        sql = f"""
+            SELECT ts, chat_id, message_id, views, reactions, forwards, replies
+            FROM {table}
+            WHERE {where}
+            LATEST ON ts PARTITION BY chat_id, message_id;
+        """
+
+        return [
+            (
+                int(row["chat_id"]),
+                int(row["message_id"]),
+                row["ts"].replace(tzinfo=timezone.utc),
+                self._make_stats_dto(row),
+            )
+            for row in await self.db.fetch_all(sql, params)
+        ]
+
+    async def get_trends(self, peer_channel_id, since, sample_by):
+        """Return the channel's rolled up totals per `sample_by` interval since `since`.
+
+        The result is a list of `(datetime, StatsDto)` tuples ordered by time,
+        see `get_channel_totals` for what the totals are.
+        """
+        _, channel_table = self.ROLLUP_TABLES[sample_by]
+        sql = f"""
+            SELECT ts, views, reactions, forwards, replies
+            FROM {channel_table}
+            WHERE chat_id = %(chat_id)s AND ts >= %(since)s
+            ORDER BY ts;
+        """
+        params = {"chat_id": str(peer_channel_id), "since": to_timestamp(since)}
+
+        return [
+            (row["ts"].replace(tzinfo=timezone.utc), self._make_stats_dto(row))
+            for row in await self.db.fetch_all(sql, params)
+        ]
+
+    async def get_latest_channel_total(self, peer_channel_id, sample_by):
+        """Return the channel's newest rolled up `(datetime, StatsDto)`, or `None`."""
+        _, channel_table = self.ROLLUP_TABLES[sample_by]
+        sql = f"""
+            SELECT ts, views, reactions, forwards, replies
+            FROM {channel_table}
+            WHERE chat_id = %(chat_id)s
+            LATEST ON ts PARTITION BY chat_id;
+        """
+        row = await self.db.fetch_one(sql, {"chat_id": str(peer_channel_id)})
+        if not row:
+            return None
+        return row["ts"].replace(tzinfo=timezone.utc), self._make_stats_dto(row)
+
+    async def get_channel_totals(self, sample_by, before):
+        """Return the newest totals of every channel rolled up before `before`.
+
+        Totals are the sums of the last counters of every message collected so
+        far, also of messages that are no longer refreshed. The result maps
+        peer channel ids to `(StatsDto, number of messages)`.
+        """
+        _, channel_table = self.ROLLUP_TABLES[sample_by]
+        sql = f"""
+            SELECT chat_id, views, reactions, forwards, replies, messages
+            FROM {channel_table}
+            WHERE ts < %(before)s
+            LATEST ON ts PARTITION BY chat_id;
+        """
+        rows = await self.db.fetch_all(sql, {"before": to_timestamp(before)})
+        return {
+            int(row["chat_id"]): (self._make_stats_dto(row), row["messages"] or 0)
+            for row in rows
+        }
+
+    async def save_channel_totals(self, sample_by, totals):
+        """Write `(ts, peer_channel_id, StatsDto, number of messages)` totals."""
+        _, channel_table = self.ROLLUP_TABLES[sample_by]
+        for totals_batch in batch(totals, n=self.INSERT_BATCH_SIZE):
+            await self._insert_many(
+                channel_table,
+                self.CHANNEL_TOTALS_FIELDS,
+                [
+                    (
+                        to_timestamp(ts),
+                        str(peer_channel_id),
+                        stats_dto.views,
+                        stats_dto.reactions,
+                        stats_dto.forwards,
+                        stats_dto.replies,
+                        num_messages,
+                    )
+                    for ts, peer_channel_id, stats_dto, num_messages in totals_batch
+                ],
+            )
+
+    async def roll_up_messages(self, sample_by, since, until):
+        """Aggregate raw stats of `[since, until)` into the per-message rollup.
+
+        The rollup table deduplicates on its keys, so rolling up the same
+        intervals again only overwrites them.
+        """
+        message_table, _ = self.ROLLUP_TABLES[sample_by]
+        sample_sql = self._make_last_per_message_sql(
+            sample_by, "ts >= %(since)s AND ts < %(until)s",
+        )
+        await self.db.execute(
+            f"INSERT INTO {message_table} {sample_sql};",
+            self._make_sample_params(since, until),
+        )
+
+    async def get_last_per_message(self, sample_by, since, until):
+        """Return the last snapshot of every message per interval of `[since, until)`.
+
+        The result is a list of `(ts, peer_channel_id, message_id, StatsDto)`
+        tuples ordered by the start of the interval.
+        """
+        sample_sql = self._make_last_per_message_sql(
+            sample_by, "ts >= %(since)s AND ts < %(until)s",
+        )
+        rows = await self.db.fetch_all(
+            f"SELECT * FROM ({sample_sql}) ORDER BY ts;",
+            self._make_sample_params(since, until),
+        )
+        return [
+            (
+                row["ts"].replace(tzinfo=timezone.utc),
+                int(row["chat_id"]),
+                int(row["message_id"]),
+                self._make_stats_dto(row),
+            )
+            for row in rows
+        ]
+
+    async def get_last_rollup_ts(self, sample_by):
+        """Return the start of the newest rolled up interval, `None` if there's none."""
+        _, channel_table = self.ROLLUP_TABLES[sample_by]
+        row = await self.db.fetch_one(f"SELECT max(ts) ts FROM {channel_table};")
+        return row["ts"].replace(tzinfo=timezone.utc) if row["ts"] else None
+
+    async def get_first_stats_ts(self):
+        row = await self.db.fetch_one(f"SELECT min(ts) ts FROM {self.STATS_TABLE};")
+        return row["ts"].replace(tzinfo=timezone.utc) if row["ts"] else None
+
+    async def drop_stats_before(self, before):
+        """Drop the raw stats before `before`, which has to start a partition."""
+        await self.db.execute(
+            f"ALTER TABLE {self.STATS_TABLE} DROP PARTITION WHERE ts < %(before)s;",
+            {"before": to_timestamp(before)},
+        )
+
+    @staticmethod
+    def _make_sample_params(since, until):
+        return {
+            "since": to_timestamp(since),
+            "until": to_timestamp(until),
+            "tz": DEFAULT_TZ,
+        }
+
+    @staticmethod
+    def _make_stats_dto(row):
+        return StatsDto(
+            row["views"] or 0,
+            row["reactions"] or 0,
+            row["forwards"] or 0,
+            row["replies"] or 0,
+        )
+
+    def _make_last_per_message_sql(self, sample_by, where):
+        # SAMPLE BY only takes a literal, `sample_by` is a key of ROLLUP_TABLES
+        assert sample_by in self.ROLLUP_TABLES, (
+            f"Unknown sampling interval \"{sample_by}\""
+        )
+        return f"""
+            SELECT ts, message_id, chat_id,
+                last(views) views, last(forwards) forwards,
+                last(reactions) reactions, last(replies) replies
+            FROM {self.STATS_TABLE}
+            WHERE {where}
+            SAMPLE BY {sample_by} ALIGN TO CALENDAR TIME ZONE %(tz)s
+        """
+
+stats_dao = StatsDao(db)
@@ -1,6 +1,9 @@
 from .database import Database, db
 from .schema import create_schema
-from .ingester import QuestDbIngester
+from .ingester import IngestRow, QuestDbIngester
+from .spill import SpillLog
 
-__all__ = ["Database", "create_schema", "QuestDbIngester", "db"]
+__all__ = [
+    "Database", "create_schema", "IngestRow", "QuestDbIngester", "SpillLog", "db",
+]
 
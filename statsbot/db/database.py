@@ -1,29 +1,82 @@
 from psycopg.rows import dict_row
 
 import logging
+import time
 from psycopg import AsyncConnection, AsyncClientCursor
 from contextlib import asynccontextmanager
 
-from settings import QDB_HOST, QDB_POSTGRES_PORT, QDB_USER, QDB_PASSWORD
+from metrics import registry
+from settings import (
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MIN_SIZE,
+    DB_POOL_TIMEOUT_SEC,
+    QDB_HOST,
+    QDB_PASSWORD,
+    QDB_POSTGRES_PORT,
+    QDB_USER,
+)
+
+from .pool import ConnectionPool
 
 logger = logging.getLogger(__name__)
 
+QUERY_SECONDS = registry.histogram(
+    "statsbot_db_query_seconds", "Database query latency including the pool wait",
+    ("operation",),
+)
+QUERY_ERRORS = registry.counter(
+    "statsbot_db_query_errors_total", "Database queries that failed", ("operation",),
+)
+
 
 class Database:
     def __init__(self):
-        self._conn = None
+        self._pool = None
 
     @property
-    def conn(self):
-        assert self._conn, (
+    def pool(self):
+        assert self._pool, (
             "No connection to the database. You need to call `connect()` first."
         )
-        return self._conn
+        return self._pool
+
+    @property
+    def stats(self):
+        return self.pool.stats
 
     async def connect(self):
         logger.info("Connecting to the database")
 
-        self._conn = await AsyncConnection.connect(
+        self._pool = ConnectionPool(
+            self._connect,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            timeout=DB_POOL_TIMEOUT_SEC,
+        )
+        await self._pool.open()
+        self._register_pool_metrics()
+
+        logger.info("Database connection established")
+
+    def _register_pool_metrics(self):
+        pool = self._pool
+        registry.gauge(
+            "statsbot_db_pool_connections", "Open database connections",
+        ).set_function(lambda: pool.size)
+        registry.gauge(
+            "statsbot_db_pool_idle_connections", "Idle database connections",
+        ).set_function(lambda: pool.num_idle)
+        registry.counter(
+            "statsbot_db_pool_wait_seconds_total",
+            "Total time spent waiting for a connection",
+        ).set_function(lambda: pool.stats.wait_time_sec)
+        registry.gauge(
+            "statsbot_db_pool_max_wait_seconds", "Longest wait for a connection",
+        ).set_function(lambda: pool.stats.max_wait_time_sec)
+
+    @staticmethod
+    async def _connect():
+        return await AsyncConnection.connect(
             f"postgres://{QDB_USER}@{QDB_HOST}:{QDB_POSTGRES_PORT}/qdb",
             password=QDB_PASSWORD,
             autocommit=True,
@@ -32,33 +85,37 @@ class Database:
             cursor_factory=AsyncClientCursor,
         )
 
-        logger.info("Database connection established")
-
     async def disconnect(self):
         logger.info("Closing database connection")
 
-        await self._conn.close()
+        await self.pool.close()
 
         logger.info("Database connection closed")
 
     @asynccontextmanager
-    async def _execute(self, query, params=None):
-        async with self.conn.cursor() as cur:
-            logging.debug("Executing query=\"%s\" with params=%s", query, params)
-            await cur.execute(query, params)
-            yield cur
+    async def _execute(self, operation, query, params=None):
+        started_at = time.perf_counter()
+        try:
+            async with self.pool.connection() as conn, conn.cursor() as cur:
+                logging.debug("Executing query=\"%s\" with params=%s", query, params)
+                await cur.execute(query, params)
+                yield cur
+        except Exception:
+            QUERY_ERRORS.labels(operation).inc()
+            raise
+        finally:
+            QUERY_SECONDS.labels(operation).observe(time.perf_counter() - started_at)
 
     async def execute(self, query, params=None):
-        async with self._execute(query, params):
+        async with self._execute("execute", query, params):
             return
 
     async def fetch_one(self, query, params=None):
-        async with self._execute(query, params) as cur:
+        async with self._execute("fetch_one", query, params) as cur:
             return await cur.fetchone()
 
     async def fetch_all(self, query, params=None):
-        async with self._execute(query, params) as cur:
+        async with self._execute("fetch_all", query, params) as cur:
             return await cur.fetchall()
 
 db = Database()
-
@@ -1,65 +1,384 @@
+import asyncio
 import threading
 import time
 import logging
-from queue import Queue, Empty
+from collections import deque, namedtuple
+from datetime import datetime, timezone
+from queue import Queue, Empty, Full
 
-from questdb.ingress import Sender, TimestampNanos
+from questdb.ingress import IngressError, Sender, TimestampNanos
 
-from settings import QDB_HOST, QDB_INFLUX_PORT
+from metrics import registry
+from settings import (
+    INGEST_OVERFLOW_POLICY,
+    INGEST_QUEUE_SIZE,
+    INGEST_REPLAY_ROWS_PER_SEC,
+    INGEST_SPILL_THRESHOLD,
+    QDB_HOST,
+    QDB_INFLUX_PORT,
+)
 
 logger = logging.getLogger(__name__)
 
+IngestRow = namedtuple(
+    "IngestRow", ("table", "columns", "symbols", "at"), defaults=(None, None),
+)
+
+# wakes the ingestion thread up when it's waiting on an empty queue
+_STOP = object()
+
+ROWS_FLUSHED = registry.counter(
+    "statsbot_ingest_rows_flushed_total", "Rows flushed to QuestDB",
+)
+ROWS_SPILLED = registry.counter(
+    "statsbot_ingest_rows_spilled_total", "Rows written to the spill log",
+)
+ROWS_REPLAYED = registry.counter(
+    "statsbot_ingest_rows_replayed_total", "Spilled rows replayed to QuestDB",
+)
+FLUSH_SECONDS = registry.histogram(
+    "statsbot_ingest_flush_seconds", "Latency of flushes to QuestDB",
+)
+
 
 class QuestDbIngester(threading.Thread):
-    WATERMARK = 1024
-    QUEUE_TIMEOUT_SEC = 0.1
+    OVERFLOW_BLOCK = "block"
+    OVERFLOW_DROP_OLDEST = "drop_oldest"
+    OVERFLOW_SPILL = "spill"
+
+    BATCH_SIZE = 1000
+    FLUSH_ROWS = 5000
+    FLUSH_BYTES = 1024 * 1024
     FLUSH_INTERVAL_SEC = 5
+    RECONNECT_INTERVAL_SEC = 5
+    # how often a producer blocked on a full queue checks the thread is alive
+    PUT_TIMEOUT_SEC = 1
 
-    def __init__(self, *args, **kwargs):
+    def __init__(
+        self,
+        *args,
+        max_queue_size=INGEST_QUEUE_SIZE,
+        overflow_policy=INGEST_OVERFLOW_POLICY,
+        spill_log=None,
+        spill_threshold=INGEST_SPILL_THRESHOLD,
+        replay_rows_per_sec=INGEST_REPLAY_ROWS_PER_SEC,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
-        self.queue = Queue()
-        self.last_flush = 0
-        self.sender = Sender(
-            host=QDB_HOST, port=QDB_INFLUX_PORT, auto_flush=self.WATERMARK,
+        assert overflow_policy in (
+            self.OVERFLOW_BLOCK, self.OVERFLOW_DROP_OLDEST, self.OVERFLOW_SPILL,
+        ), f"Unknown ingestion overflow policy \"{overflow_policy}\""
+        # without a spill log the overflow would grow for as long as QuestDB is down
+        assert overflow_policy != self.OVERFLOW_SPILL or spill_log is not None, (
+            "The \"spill\" ingestion overflow policy needs a spill log"
         )
+
+        self.queue = Queue(maxsize=max_queue_size)
+        self.overflow_policy = overflow_policy
+        # rows that didn't fit into the queue under the "spill" policy
+        self.overflow = deque()
+        self.spill_log = spill_log
+        self.spill_threshold = spill_threshold
+        self.replay_rows_per_sec = replay_rows_per_sec
+        self.num_dropped = 0
+        # rows buffered in the sender since the last successful flush
+        self.pending = []
+        self.last_flush = 0
+        self.next_replay = 0
+        self.next_reconnect = 0
+        self.sender = None
         self.running = True
+        # table -> time of the oldest row replayed since it was last taken
+        self._replayed_since = {}
+        self._replayed_lock = threading.Lock()
+        self._register_metrics()
+
+    @property
+    def queue_size(self):
+        return self.queue.qsize() + len(self.overflow)
+
+    @property
+    def num_pending(self):
+        return len(self.pending)
+
+    def _register_metrics(self):
+        registry.gauge(
+            "statsbot_ingest_queue_size", "Rows waiting in the ingestion queue",
+        ).set_function(lambda: self.queue_size)
+        registry.gauge(
+            "statsbot_ingest_pending_rows", "Rows buffered since the last flush",
+        ).set_function(lambda: self.num_pending)
+        registry.counter(
+            "statsbot_ingest_rows_dropped_total", "Rows dropped by the ingester",
+        ).set_function(self._get_num_dropped)
+        if self.spill_log is not None:
+            registry.gauge(
+                "statsbot_ingest_spill_bytes", "Size of the spill log",
+            ).set_function(lambda: self.spill_log.size)
+
+    def _get_num_dropped(self):
+        spill_dropped = self.spill_log.num_dropped if self.spill_log else 0
+        return self.num_dropped + spill_dropped
 
     def save(self, table, columns, symbols=None, at=None):
-        self.queue.put((table, columns, symbols, at))
+        self._put(IngestRow(table, columns, symbols, at or TimestampNanos.now()))
+
+    async def save_many(self, rows):
+        """Enqueue rows from a coroutine.
+
+        Under the "block" policy a full queue suspends the caller until the
+        ingestion thread catches up, without blocking the event loop.
+        """
+        for row in rows:
+            if not row.at:
+                row = row._replace(at=TimestampNanos.now())
+
+            try:
+                self.queue.put_nowait(row)
+            except Full:
+                if self.overflow_policy == self.OVERFLOW_BLOCK:
+                    await asyncio.to_thread(self._put_blocking, row)
+                else:
+                    self._put(row)
+
+    def take_replayed_since(self, table):
+        """Return the time of the oldest row of `table` replayed since the last call.
+
+        Replayed rows can be hours older than the rest, `None` if there were none.
+        """
+        with self._replayed_lock:
+            return self._replayed_since.pop(table, None)
 
     def stop(self):
         self.running = False
+        try:
+            self.queue.put_nowait(_STOP)
+        except Full:
+            pass
         self.join()
 
     def run(self):
         logger.info("Enter QuestDB ingestion loop")
         self.running = True
-        with self.sender:
-            self.last_flush = time.monotonic()
+        self._connect()
+        self.last_flush = time.monotonic()
 
+        try:
             while self.running:
-                self._process_message()
-            if len(self.sender):
-                self.sender.flush()
+                self._process_batch()
+
+            # ingest whatever is still queued before shutting down
+            while self.queue_size:
+                self._process_batch(timeout=0)
+            if self.pending:
+                self._flush()
+        finally:
+            if self.sender is not None:
+                self.sender.close()
+            if self.spill_log is not None:
+                self.spill_log.close()
             logger.info("QuestDb ingestion loop shut down")
 
-    def _process_message(self):
-        try:
-            table, columns, symbols, at = self.queue.get(
-                timeout=self.QUEUE_TIMEOUT_SEC
-            )
-        except Empty:
+    def _put(self, row):
+        if self.overflow_policy == self.OVERFLOW_BLOCK:
+            self._put_blocking(row)
             return
-        else:
-            logger.debug(f"Saving a row for table {table}")
-            if not at:
-                at = TimestampNanos.now()
 
-            self.sender.row(table, columns=columns, symbols=symbols, at=at)
+        try:
+            self.queue.put_nowait(row)
+        except Full:
+            if self.overflow_policy == self.OVERFLOW_SPILL:
+                self.overflow.append(row)
+            else:
+                self._put_dropping_oldest(row)
 
-            if not len(self.sender):
+    def _put_blocking(self, row):
+        """Wait for room in the queue for as long as the ingestion thread runs."""
+        while True:
+            try:
+                self.queue.put(row, timeout=self.PUT_TIMEOUT_SEC)
+                return
+            except Full:
+                if not (self.running and self.is_alive()):
+                    raise RuntimeError(
+                        "QuestDB ingestion thread isn't running"
+                    ) from None
+
+    def _put_dropping_oldest(self, row):
+        while True:
+            try:
+                self.queue.put_nowait(row)
+                return
+            except Full:
+                try:
+                    self.queue.get_nowait()
+                    self.num_dropped += 1
+                except Empty:
+                    pass
+
+    def _process_batch(self, timeout=None):
+        if timeout is None:
+            timeout = self._get_wait_timeout()
+
+        batch = self._get_batch(timeout)
+
+        if batch and self._should_spill():
+            self.spill_log.append(batch)
+            ROWS_SPILLED.inc(len(batch))
+        elif batch and self._connect():
+            if not self.pending:
+                # the flush interval counts from the first buffered row
                 self.last_flush = time.monotonic()
-        finally:
-            if time.monotonic() - self.last_flush > self.FLUSH_INTERVAL_SEC:
+            for row in batch:
+                self.sender.row(
+                    row.table, symbols=row.symbols, columns=row.columns, at=row.at,
+                )
+            self.pending.extend(batch)
+            logger.debug(f"Buffered a batch of {len(batch)} rows")
+        elif batch:
+            self.num_dropped += len(batch)
+            logger.warning(f"QuestDB is unavailable, dropped {len(batch)} rows")
+
+        if self._should_flush():
+            self._flush()
+
+        if self.spill_log and self.running:
+            self._replay_spilled()
+
+    def _get_wait_timeout(self):
+        timeouts = []
+        if self.pending:
+            elapsed = time.monotonic() - self.last_flush
+            timeouts.append(max(0, self.FLUSH_INTERVAL_SEC - elapsed))
+        if self.spill_log and self.sender is not None:
+            # come back for the replay even if no new rows arrive
+            timeouts.append(max(0.1, self.next_replay - time.monotonic()))
+        elif self.spill_log:
+            timeouts.append(self.RECONNECT_INTERVAL_SEC)
+
+        return min(timeouts) if timeouts else None
+
+    def _get_batch(self, timeout):
+        # waits for the first row only, the rest is drained without blocking
+        try:
+            rows = [self.queue.get(timeout=timeout)]
+        except Empty:
+            rows = []
+
+        while len(rows) < self.BATCH_SIZE:
+            try:
+                rows.append(self.queue.get_nowait())
+            except Empty:
+                break
+
+        while len(rows) < self.BATCH_SIZE and self.overflow:
+            rows.append(self.overflow.popleft())
+
+        return [row for row in rows if row is not _STOP]
+
+    def _should_spill(self):
+        if self.spill_log is None:
+            return False
+
+        return self.sender is None or self.queue_size > self.spill_threshold
+
+    def _should_flush(self):
+        if not self.pending:
+            return False
+
+        return (
+            len(self.pending) >= self.FLUSH_ROWS
+            or len(self.sender) >= self.FLUSH_BYTES
+            or time.monotonic() - self.last_flush >= self.FLUSH_INTERVAL_SEC
+        )
+
+    def _flush(self):
+        try:
+            with FLUSH_SECONDS.time():
                 self.sender.flush()
+        except IngressError as exc:
+            logger.warning(f"Failed to flush {len(self.pending)} rows: {exc}")
+            self._on_sender_failure()
+            if self.spill_log is not None:
+                self.spill_log.append(self.pending)
+                ROWS_SPILLED.inc(len(self.pending))
+            else:
+                self.num_dropped += len(self.pending)
+        else:
+            ROWS_FLUSHED.inc(len(self.pending))
+            logger.debug(f"Flushed {len(self.pending)} rows to QuestDB")
+        finally:
+            self.pending = []
+            self.last_flush = time.monotonic()
 
+    def _replay_spilled(self):
+        if (
+            time.monotonic() < self.next_replay
+            or self.queue_size > self.spill_threshold
+            or not self._connect()
+        ):
+            return
+
+        if self.pending:
+            self._flush()
+            if self.sender is None:
+                return
+
+        number, rows = self.spill_log.read_oldest()
+        if not rows:
+            return
+
+        try:
+            for table, columns, symbols, at in rows:
+                self.sender.row(table, symbols=symbols, columns=columns, at=at)
+            self.sender.flush()
+        except IngressError as exc:
+            # the segment stays on disk and will be replayed again
+            logger.warning(f"Failed to replay spilled segment {number}: {exc}")
+            self._on_sender_failure()
+            return
+
+        self.spill_log.remove(number)
+        self._note_replayed(rows)
+        ROWS_REPLAYED.inc(len(rows))
+        self.next_replay = time.monotonic() + len(rows) / self.replay_rows_per_sec
+        logger.info(f"Replayed {len(rows)} spilled rows from segment {number}")
+
+    def _note_replayed(self, rows):
+        oldest = {}
+        for table, _, _, at in rows:
+            if at is not None:
+                oldest[table] = min(oldest.get(table, at.value), at.value)
+
+        with self._replayed_lock:
+            for table, at in oldest.items():
+                replayed_at = datetime.fromtimestamp(at / 1e9, timezone.utc)
+                self._replayed_since[table] = min(
+                    self._replayed_since.get(table, replayed_at), replayed_at,
+                )
+
+    def _connect(self):
+        if self.sender is not None:
+            return True
+        if time.monotonic() < self.next_reconnect:
+            return False
+
+        sender = Sender(host=QDB_HOST, port=QDB_INFLUX_PORT, auto_flush=False)
+        try:
+            sender.connect()
+        except IngressError as exc:
+            logger.warning(f"Failed to connect to QuestDB: {exc}")
+            self.next_reconnect = time.monotonic() + self.RECONNECT_INTERVAL_SEC
+            return False
+
+        self.sender = sender
+        return True
+
+    def _on_sender_failure(self):
+        # the sender can't be reused after an error, a new one is created later
+        try:
+            self.sender.close()
+        except IngressError:
+            pass
+        self.sender = None
+        self.next_reconnect = time.monotonic() + self.RECONNECT_INTERVAL_SEC
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+import psycopg
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+@dataclass
+class PoolStats:
+    requests: int = 0
+    requests_waited: int = 0
+    wait_time_sec: float = 0.0
+    max_wait_time_sec: float = 0.0
+    connections_created: int = 0
+    connections_discarded: int = 0
+
+    @property
+    def avg_wait_time_sec(self):
+        return self.wait_time_sec / self.requests if self.requests else 0.0
+
+
+class ConnectionPool:
+    """Pool of async psycopg connections.
+
+    At most `max_size` connections are open at a time, callers wait up to
+    `timeout` seconds for a free one. Connections that come back broken are
+    discarded, and idle connections are checked with a trivial query before
+    being handed out again, so a dropped connection is replaced transparently.
+    """
+
+    HEALTH_CHECK_AFTER_IDLE_SEC = 30
+
+    def __init__(self, connect, min_size, max_size, timeout):
+        assert 0 < min_size <= max_size, "Pool size must satisfy 0 < min <= max"
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.stats = PoolStats()
+        self._slots = asyncio.Semaphore(max_size)
+        # (connection, idle since) pairs, the most recently used one last
+        self._idle = deque()
+        self._size = 0
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def num_idle(self):
+        return len(self._idle)
+
+    async def open(self):
+        for _ in range(self.min_size):
+            self._idle.append((await self._create(), time.monotonic()))
+
+    async def close(self):
+        while self._idle:
+            conn, _ = self._idle.popleft()
+            await self._discard(conn)
+
+    @asynccontextmanager
+    async def connection(self):
+        conn = await self._acquire()
+        try:
+            yield conn
+        finally:
+            await self._release(conn)
+
+    async def _acquire(self):
+        started_at = time.monotonic()
+        self.stats.requests += 1
+
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout(
+                f"No database connection available within {self.timeout}s"
+            )
+
+        self._record_wait(time.monotonic() - started_at)
+
+        try:
+            while self._idle:
+                conn, idle_since = self._idle.pop()
+                if await self._is_healthy(conn, idle_since):
+                    return conn
+                await self._discard(conn)
+
+            return await self._create()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def _release(self, conn):
+        try:
+            if conn.closed or conn.broken:
+                await self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    async def _is_healthy(self, conn, idle_since):
+        if conn.closed or conn.broken:
+            return False
+
+        if time.monotonic() - idle_since < self.HEALTH_CHECK_AFTER_IDLE_SEC:
+            return True
+
+        try:
+            await conn.execute("SELECT 1;")
+        except psycopg.Error:
+            logger.warning("Idle database connection failed the health check")
+            return False
+
+        return True
+
+    async def _create(self):
+        conn = await self._connect()
+        self._size += 1
+        self.stats.connections_created += 1
+        return conn
+
+    async def _discard(self, conn):
+        self._size -= 1
+        self.stats.connections_discarded += 1
+        try:
+            await conn.close()
+        except psycopg.Error:
+            pass
+
+    def _record_wait(self, wait_time):
+        if wait_time > 0.001:
+            self.stats.requests_waited += 1
+        self.stats.wait_time_sec += wait_time
+        self.stats.max_wait_time_sec = max(self.stats.max_wait_time_sec, wait_time)
@@ -31,12 +31,65 @@ CREATE TABLE IF NOT EXISTS stats (
     ts TIMESTAMP,
     message_id SYMBOL CAPACITY 65536,
     chat_id SYMBOL CAPACITY 32768,
+    views LONG,
     forwards LONG,
     reactions LONG,
     replies LONG
 ),
 INDEX(message_id), INDEX(chat_id)
 TIMESTAMP(ts) PARTITION BY MONTH WAL;
+
+CREATE TABLE IF NOT EXISTS stats_hourly (
+    ts TIMESTAMP,
+    message_id SYMBOL CAPACITY 65536,
+    chat_id SYMBOL CAPACITY 32768,
+    views LONG,
+    forwards LONG,
+    reactions LONG,
+    replies LONG
+),
+INDEX(chat_id)
+TIMESTAMP(ts) PARTITION BY MONTH WAL
+DEDUP UPSERT KEYS(ts, message_id, chat_id);
+
+CREATE TABLE IF NOT EXISTS stats_daily (
+    ts TIMESTAMP,
+    message_id SYMBOL CAPACITY 65536,
+    chat_id SYMBOL CAPACITY 32768,
+    views LONG,
+    forwards LONG,
+    reactions LONG,
+    replies LONG
+),
+INDEX(chat_id)
+TIMESTAMP(ts) PARTITION BY YEAR WAL
+DEDUP UPSERT KEYS(ts, message_id, chat_id);
+
+CREATE TABLE IF NOT EXISTS channel_stats_hourly (
+    ts TIMESTAMP,
+    chat_id SYMBOL CAPACITY 32768,
+    views LONG,
+    forwards LONG,
+    reactions LONG,
+    replies LONG,
+    messages LONG
+),
+INDEX(chat_id)
+TIMESTAMP(ts) PARTITION BY YEAR WAL
+DEDUP UPSERT KEYS(ts, chat_id);
+
+CREATE TABLE IF NOT EXISTS channel_stats_daily (
+    ts TIMESTAMP,
+    chat_id SYMBOL CAPACITY 32768,
+    views LONG,
+    forwards LONG,
+    reactions LONG,
+    replies LONG,
+    messages LONG
+),
+INDEX(chat_id)
+TIMESTAMP(ts) PARTITION BY YEAR WAL
+DEDUP UPSERT KEYS(ts, chat_id);
 """
 
 
@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+
+from questdb.ingress import TimestampNanos
+
+logger = logging.getLogger(__name__)
+
+
+class SpillLog:
+    """Append-only on-disk buffer of ingestion rows.
+
+    Rows are written as JSON lines into numbered segment files. The active
+    segment is rotated once it grows past `segment_size` bytes, and when the
+    whole log exceeds `max_size` bytes the oldest segments are deleted. Rows
+    are replayed a whole segment at a time, oldest first, and a segment is
+    only deleted after its rows were ingested.
+    """
+
+    SEGMENT_PREFIX = "segment-"
+    SEGMENT_SUFFIX = ".jsonl"
+
+    def __init__(self, directory, segment_size, max_size):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_size = max_size
+        self.num_dropped = 0
+        self._file = None
+        self._file_size = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._segments = self._list_segments()
+        self._next_number = self._segments[-1][0] + 1 if self._segments else 0
+
+        if self._segments:
+            logger.info(
+                f"Found {len(self._segments)} spilled segments "
+                f"({self.size} bytes) in {directory}"
+            )
+
+    def __bool__(self):
+        return bool(self._segments) or self._file_size > 0
+
+    @property
+    def size(self):
+        closed_size = sum(size for _, _, size in self._segments)
+        return closed_size + self._file_size
+
+    def append(self, rows):
+        if not rows:
+            return
+
+        if self._file is None:
+            self._open_segment()
+
+        data = "".join(self._serialize(row) for row in rows).encode()
+        self._file.write(data)
+        self._file.flush()
+        self._file_size += len(data)
+
+        if self._file_size >= self.segment_size:
+            self._close_segment()
+        self._enforce_max_size()
+
+    def read_oldest(self):
+        """Return the number of the oldest segment and its rows as tuples."""
+        if not self._segments:
+            self._close_segment()
+        if not self._segments:
+            return None, []
+
+        number, path, _ = self._segments[0]
+        with open(path, "rb") as segment_file:
+            rows = [self._deserialize(line) for line in segment_file if line.strip()]
+        return number, rows
+
+    def remove(self, number):
+        for i, (segment_number, path, _) in enumerate(self._segments):
+            if segment_number == number:
+                os.remove(path)
+                del self._segments[i]
+                return
+
+    def close(self):
+        self._close_segment()
+
+    def _open_segment(self):
+        name = f"{self.SEGMENT_PREFIX}{self._next_number:010d}{self.SEGMENT_SUFFIX}"
+        self._file = open(os.path.join(self.directory, name), "ab")
+        self._file_size = 0
+        self._next_number += 1
+
+    def _close_segment(self):
+        if self._file is None:
+            return
+
+        self._file.close()
+        path, size = self._file.name, self._file_size
+        self._file, self._file_size = None, 0
+        if size:
+            self._segments.append((self._next_number - 1, path, size))
+        else:
+            os.remove(path)
+
+    def _enforce_max_size(self):
+        while self._segments and self.size > self.max_size:
+            number, path, size = self._segments.pop(0)
+            with open(path, "rb") as segment_file:
+                self.num_dropped += sum(1 for _ in segment_file)
+            os.remove(path)
+            logger.warning(
+                f"Spill log is over {self.max_size} bytes, dropped segment {number}"
+            )
+
+    def _list_segments(self):
+        segments = []
+        for name in os.listdir(self.directory):
+            if not (
+                name.startswith(self.SEGMENT_PREFIX)
+                and name.endswith(self.SEGMENT_SUFFIX)
+            ):
+                continue
+            number = int(name[len(self.SEGMENT_PREFIX):-len(self.SEGMENT_SUFFIX)])
+            path = os.path.join(self.directory, name)
+            segments.append((number, path, os.path.getsize(path)))
+
+        return sorted(segments)
+
+    @staticmethod
+    def _serialize(row):
+        at = row.at.value if row.at is not None else None
+        return json.dumps([row.table, row.columns, row.symbols, at]) + "\n"
+
+    @staticmethod
+    def _deserialize(line):
+        table, columns, symbols, at = json.loads(line)
+        return table, columns, symbols, TimestampNanos(at) if at is not None else None
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+def get_update_chat_id(update_json):
+    if message_json := update_json.get("message"):
+        return message_json["chat"]["id"]
+
+    if callback_json := update_json.get("callback_query"):
+        if message_json := callback_json.get("message"):
+            return message_json["chat"]["id"]
+        if from_json := callback_json.get("from"):
+            return from_json["id"]
+
+    return None
+
+
+class UpdateDispatcher:
+    """Runs updates concurrently while keeping them ordered within a chat.
+
+    Every chat with pending updates gets its own lane served by a single worker
+    task, so updates for one chat are handled in the order they arrive while
+    different chats progress in parallel. The total number of updates that are
+    queued or being handled is capped by `max_in_flight`; once the cap is
+    reached `dispatch()` waits, which in turn holds back the polling loop.
+    """
+
+    def __init__(self, process_update, max_in_flight):
+        self.process_update = process_update
+        self.max_in_flight = max_in_flight
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._lanes = {}
+        self._workers = set()
+
+    @property
+    def in_flight(self):
+        return sum(len(lane) for lane in self._lanes.values())
+
+    async def dispatch(self, update_json):
+        await self._slots.acquire()
+
+        chat_id = get_update_chat_id(update_json)
+        if lane := self._lanes.get(chat_id):
+            lane.append(update_json)
+            return
+
+        self._lanes[chat_id] = deque([update_json])
+        worker = asyncio.create_task(self._drain_lane(chat_id))
+        self._workers.add(worker)
+        worker.add_done_callback(self._workers.discard)
+
+    async def _drain_lane(self, chat_id):
+        lane = self._lanes[chat_id]
+        try:
+            while lane:
+                update_json = lane[0]
+                try:
+                    await self.process_update(update_json)
+                except Exception:
+                    logger.exception(
+                        "Failed to process update id=%s",
+                        update_json.get("update_id"),
+                    )
+                finally:
+                    lane.popleft()
+                    self._slots.release()
+        finally:
+            del self._lanes[chat_id]
+
+    async def join(self):
+        while self._workers:
+            await asyncio.gather(*self._workers, return_exceptions=True)
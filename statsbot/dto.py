@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from dataclasses import dataclass, field
 
 
@@ -22,16 +22,20 @@ class MessageDto:
     date: datetime
 
 
+def _utc_now():
+    return datetime.now(timezone.utc)
+
+
 @dataclass
 class ChatDto:
     chat_id: int
     title: str
-    created_at: datetime = field(default_factory=datetime.now)
+    created_at: datetime = field(default_factory=_utc_now)
 
 
 @dataclass
 class UserDto:
     user_id: int
     username: str
-    created_at: datetime = field(default_factory=datetime.now)
+    created_at: datetime = field(default_factory=_utc_now)
 
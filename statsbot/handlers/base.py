@@ -1,11 +1,21 @@
+import time
 from abc import abstractmethod
 from functools import cached_property
 from logging import getLogger
 
+from metrics import registry
+
 from .registry import HandlerRegistry
 
 logger = getLogger("handlers")
 
+HANDLER_SECONDS = registry.histogram(
+    "statsbot_handler_seconds", "Time spent in update handlers", ("handler",),
+)
+HANDLER_ERRORS = registry.counter(
+    "statsbot_handler_errors_total", "Update handlers that raised", ("handler",),
+)
+
 
 class Handler(metaclass=HandlerRegistry):
     key = None
@@ -22,7 +32,16 @@ class Handler(metaclass=HandlerRegistry):
     async def handle(self, update):
         logger.info(f"Start handling key '{self.key}'")
         self.update = update
-        await self._process_update()
+
+        started_at = time.perf_counter()
+        try:
+            await self._process_update()
+        except Exception:
+            HANDLER_ERRORS.labels(self.key).inc()
+            raise
+        finally:
+            HANDLER_SECONDS.labels(self.key).observe(time.perf_counter() - started_at)
+
         logger.info(f"Finished handling key '{self.key}'")
 
     @abstractmethod
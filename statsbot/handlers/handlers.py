@@ -1,14 +1,20 @@
 import asyncio
 import logging
-import time
 from functools import cached_property
 
 from dao import chat_dao, user_dao
 from dto import UserDto
 from service.chat_service import chat_service
 from service.exceptions import ChannelPrivateError
+from service.report_cursors import report_cursors
+from service.report_renderer import (
+    render_csv,
+    render_html,
+    render_message_line,
+    render_trends,
+)
 from service.stats_service import stats_service
-from utils import batch
+from settings import REPORT_DOCUMENT_FORMAT
 
 from .base import MessageHandler, CallbackHandler
 from .registry import HandlerRegistry
@@ -85,6 +91,7 @@ class ChannelsHandler(MessageHandler):
             "stats."
         )
     }
+    prompt = "Select the channel to display the stats for:"
 
     async def _process_update(self):
         if not (chats := await chat_dao.get_chats()):
@@ -95,7 +102,7 @@ class ChannelsHandler(MessageHandler):
 
         await self.bot_api.post_message(
             self.chat.id,
-            "Select the channel to display the stats for:",
+            self.prompt,
             reply_markup={"inline_keyboard": keyboard},
         )
 
@@ -108,6 +115,65 @@ class ChannelsHandler(MessageHandler):
         )
 
 
+class TrendsHandler(ChannelsHandler):
+    key = "trends"
+    description = "Show how the stats of a channel change over time"
+    prompt = "Select the channel to display the trends for:"
+
+    @staticmethod
+    def _build_chats_keyboard(chats):
+        return make_keyboard(
+            (
+                chat.title, {"a": "show_trends", "cid": chat.chat_id, "g": "d"}
+            ) for chat in chats
+        )
+
+
+class ShowTrendsHandler(CallbackHandler):
+    key = "show_trends"
+    replies = {
+        "no_stats": "No stats collected yet for channel \"{channel_title}\".",
+    }
+
+    GRANULARITIES = (("h", "Hourly"), ("d", "Daily"), ("w", "Weekly"))
+
+    async def _process_update(self):
+        if not (channel_id := self.callback.data.get("cid")):
+            logger.warning("No `cid` in callback data, aborting handler")
+            return
+
+        granularity = self.callback.data.get("g")
+        if granularity not in stats_service.TRENDS:
+            logger.warning(f"Invalid `granularity` \"{granularity}\", aborting handler")
+            return
+
+        if not (chat_dto := await chat_dao.get_chat(channel_id)):
+            logger.warning(
+                f"Channel channel_id={channel_id} not found, aborting handler"
+            )
+            return
+
+        if points := await stats_service.get_trends(channel_id, granularity):
+            text = render_trends(chat_dto.title, granularity, points)
+        else:
+            text = self.replies["no_stats"].format(channel_title=chat_dto.title)
+
+        # the other granularities replace the table in place
+        keyboard = make_keyboard(
+            (label, {"a": "show_trends", "cid": channel_id, "g": key})
+            for key, label in self.GRANULARITIES if key != granularity
+        )
+        await asyncio.gather(
+            self.bot_api.answer_callback(self.callback.id),
+            self.bot_api.edit_message_text(
+                self.chat.id,
+                self.message.message_id,
+                text,
+                reply_markup={"inline_keyboard": keyboard},
+            ),
+        )
+
+
 class SelectChannelHandler(CallbackHandler):
     key = "select_channel"
 
@@ -144,17 +210,58 @@ class SelectChannelHandler(CallbackHandler):
         )
 
 
-class GetStatsHandler(CallbackHandler):
+class ReportPagesMixin:
+    replies = {
+        "expired": "This report has expired, please request it again.",
+    }
+
+    async def _get_cursor(self):
+        """Return the id and the cursor of the pressed button, `None`s if expired."""
+        if not (cursor_id := self.callback.data.get("c")):
+            logger.warning("No `c` in callback data, aborting handler")
+            return None, None
+
+        if not (cursor := await report_cursors.get(cursor_id, self.chat.id)):
+            await self.bot_api.answer_callback(
+                self.callback.id, self.replies["expired"],
+            )
+            return None, None
+
+        return cursor_id, cursor
+
+    @staticmethod
+    def _render_page(cursor, page, rows):
+        text = "".join(render_message_line(*row) for row in rows)
+        if (num_pages := cursor.num_pages) is not None:
+            return text + f"<i>Page {page + 1} of {num_pages}</i>"
+        return text + f"<i>Page {page + 1}</i>"
+
+    @staticmethod
+    def _build_page_keyboard(cursor_id, page, has_next):
+        # keys are kept short, callback data is limited to 64 bytes
+        buttons = []
+        if page > 0:
+            buttons.append(
+                ("‹ Prev", {"a": "report_page", "c": cursor_id, "n": page - 1})
+            )
+        if has_next:
+            buttons.append(
+                ("Next ›", {"a": "report_page", "c": cursor_id, "n": page + 1})
+            )
+        buttons.append(("Download", {"a": "report_file", "c": cursor_id}))
+        return make_keyboard(buttons)
+
+
+class GetStatsHandler(ReportPagesMixin, CallbackHandler):
     key = "get_stats"
     replies = {
         "no_messages": (
             "No messages found in the selected time period for channel "
             "\"{channel_title}\"."
-        )
+        ),
     }
 
     STATS_PER_MESSAGE = 15
-    POSTING_DELAY_SEC = 0.5
 
     async def _process_update(self):
         if not (channel_id := self.callback.data.get("cid")):
@@ -173,35 +280,131 @@ class GetStatsHandler(CallbackHandler):
             logger.warning(f"Invalid `period` \"{period}\", aborting handler")
             return
 
-        message_stats = await stats_service.get_report(channel_id, weeks_back)
         response_task = asyncio.gather(
             self.bot_api.delete_message(self.message.chat.id, self.message.message_id),
             self.bot_api.answer_callback(self.callback.id)
         )
 
-        if not message_stats:
-            chat_dto = await chat_dao.get_chat(channel_id)
-            await asyncio.gather(
-                self.reply("no_messages", channel_title=chat_dto.title),
-                response_task,
-            )
+        try:
+            await self.post_first_page(channel_id, weeks_back)
+        finally:
+            await response_task
+
+    async def post_first_page(self, channel_id, weeks_back):
+        """Send the first page, later ones are only read and rendered when asked for."""
+        cursor_id, cursor = await report_cursors.open(
+            stats_service.get_report(channel_id, weeks_back),
+            self.chat.id,
+            channel_id,
+            self.STATS_PER_MESSAGE,
+        )
+        rows, has_next = await cursor.get_page(0)
+
+        if not rows:
+            await report_cursors.close(cursor_id)
+            if not (chat_dto := await chat_dao.get_chat(channel_id)):
+                logger.warning(
+                    f"Channel channel_id={channel_id} not found, aborting handler"
+                )
+                return
+            await self.reply("no_messages", channel_title=chat_dto.title)
+            return
+
+        reply_markup = None
+        if has_next:
+            reply_markup = {
+                "inline_keyboard": self._build_page_keyboard(cursor_id, 0, has_next),
+            }
+        else:
+            await report_cursors.close(cursor_id)
+
+        await self.bot_api.post_message(
+            self.chat.id,
+            self._render_page(cursor, 0, rows),
+            reply_markup=reply_markup,
+        )
+
+
+class ReportPageHandler(ReportPagesMixin, CallbackHandler):
+    key = "report_page"
+
+    async def _process_update(self):
+        page = self.callback.data.get("n")
+        if not isinstance(page, int) or page < 0:
+            logger.warning(f"Invalid page \"{page}\", aborting handler")
+            return
+
+        cursor_id, cursor = await self._get_cursor()
+        if not cursor:
             return
 
-        await asyncio.gather(self.post_stats(message_stats), response_task)
+        rows, has_next = await cursor.get_page(page)
+        if not rows:
+            logger.warning(f"Page {page} of the report is empty, aborting handler")
+            await self.bot_api.answer_callback(self.callback.id)
+            return
 
-    async def post_stats(self, message_stats):
-        num_messages = (len(message_stats) // self.STATS_PER_MESSAGE) + 1
-        batches = batch(message_stats, n=self.STATS_PER_MESSAGE)
+        await asyncio.gather(
+            self.bot_api.answer_callback(self.callback.id),
+            self.bot_api.edit_message_text(
+                self.chat.id,
+                self.message.message_id,
+                self._render_page(cursor, page, rows),
+                reply_markup={
+                    "inline_keyboard": self._build_page_keyboard(
+                        cursor_id, page, has_next,
+                    ),
+                },
+            ),
+        )
+
+
+class ReportFileHandler(ReportPagesMixin, CallbackHandler):
+    key = "report_file"
+    replies = {
+        **ReportPagesMixin.replies,
+        "document": (
+            "Stats of {num_messages} messages for channel \"{channel_title}\""
+        ),
+    }
 
-        for i, stats_batch in enumerate(batches):
-            message_text = "".join(stats_batch)
+    async def _process_update(self):
+        _, cursor = await self._get_cursor()
+        if not cursor:
+            return
 
-            start = time.monotonic()
-            await self.bot_api.post_message(self.message.chat.id, message_text)
-            elapsed = time.monotonic() - start
+        # answered right away, reading the whole report can take a while
+        response_task = asyncio.create_task(
+            self.bot_api.answer_callback(self.callback.id)
+        )
+        try:
+            rows = await cursor.get_rows()
+            await self._post_document(rows, cursor.channel_id)
+        finally:
+            await response_task
+
+    async def _post_document(self, rows, channel_id):
+        if not (chat_dto := await chat_dao.get_chat(channel_id)):
+            logger.warning(
+                f"Channel channel_id={channel_id} not found, aborting handler"
+            )
+            return
 
-            if i < num_messages - 1:
-                sleep_time = self.POSTING_DELAY_SEC - elapsed
-                if sleep_time > 0:
-                    await asyncio.sleep(sleep_time)
+        # thousands of rows take long enough to stall the event loop
+        if REPORT_DOCUMENT_FORMAT == "csv":
+            content = await asyncio.to_thread(render_csv, rows)
+            mime_type = "text/csv"
+        else:
+            content = await asyncio.to_thread(render_html, rows, chat_dto.title)
+            mime_type = "text/html"
 
+        await self.bot_api.send_document(
+            self.chat.id,
+            f"stats_{chat_dto.chat_id}.{mime_type.partition('/')[2]}",
+            content,
+            mime_type,
+            caption=self.replies["document"].format(
+                num_messages=len(rows), channel_title=chat_dto.title,
+            ),
+            priority=self.bot_api.PRIORITY_BULK,
+        )
@@ -1,12 +1,19 @@
-import json
+from bot_api import codec
+
+# Telegram rejects buttons with longer callback data
+MAX_CALLBACK_DATA_BYTES = 64
 
 
 def make_keyboard(buttons, columns=2):
     keyboard, row = [], []
     for i, button in enumerate(buttons):
+        callback_data = codec.dumps(button[1])
+        assert len(callback_data) <= MAX_CALLBACK_DATA_BYTES, (
+            f"Callback data {callback_data} is over {MAX_CALLBACK_DATA_BYTES} bytes"
+        )
         row.append({
             "text": button[0],
-            "callback_data": json.dumps(button[1])
+            "callback_data": callback_data.decode(),
         })
 
         if i % columns == 1:
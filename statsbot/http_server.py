@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from http import HTTPStatus
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    headers: dict[str, str]
+    body: bytes = b""
+
+
+@dataclass
+class Response:
+    status: int = HTTPStatus.OK
+    body: bytes = b""
+    headers: dict[str, str] = field(default_factory=dict)
+
+
+class HttpServer:
+    """Minimal HTTP/1.1 server on top of asyncio streams.
+
+    Only what the bot needs is supported: requests with a `Content-Length` body,
+    keep-alive connections and exact-match routing on (method, path).
+    """
+
+    MAX_BODY_SIZE = 1024 * 1024
+    READ_TIMEOUT_SEC = 30
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.routes = {}
+        self._server = None
+
+    def route(self, method, path, handler):
+        self.routes[(method, path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port,
+        )
+        logger.info(f"HTTP server listening on {self.host}:{self.port}")
+
+    async def serve_forever(self):
+        if not self._server:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while request := await self._read_request(reader):
+                response = await self._dispatch(request)
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                await self._write_response(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        except ValueError as exc:
+            logger.warning(f"Malformed HTTP request: {exc}")
+            await self._write_response(
+                writer, Response(HTTPStatus.BAD_REQUEST), keep_alive=False,
+            )
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        request_line = await asyncio.wait_for(
+            reader.readline(), timeout=self.READ_TIMEOUT_SEC,
+        )
+        if not request_line:
+            return None
+
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        content_length = int(headers.get("content-length", 0))
+        if content_length > self.MAX_BODY_SIZE:
+            raise ValueError(f"body too large ({content_length} bytes)")
+
+        body = b""
+        if content_length:
+            body = await asyncio.wait_for(
+                reader.readexactly(content_length), timeout=self.READ_TIMEOUT_SEC,
+            )
+
+        path, _, _ = path.partition("?")
+        return Request(method.upper(), path, headers, body)
+
+    async def _dispatch(self, request):
+        if not (handler := self.routes.get((request.method, request.path))):
+            return Response(HTTPStatus.NOT_FOUND)
+
+        try:
+            return await handler(request)
+        except Exception:
+            logger.exception(f"Failed to handle {request.method} {request.path}")
+            return Response(HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    @staticmethod
+    async def _write_response(writer, response, keep_alive):
+        status = HTTPStatus(response.status)
+        headers = {
+            "Content-Length": str(len(response.body)),
+            "Connection": "keep-alive" if keep_alive else "close",
+            **response.headers,
+        }
+        head = f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+        head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        writer.write(head.encode("latin-1") + b"\r\n" + response.body)
+        await writer.drain()
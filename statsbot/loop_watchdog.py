@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_SECONDS = registry.histogram(
+    "statsbot_loop_lag_seconds", "Delay of event loop wake-ups past their deadline",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+LOOP_STALLS = registry.counter(
+    "statsbot_loop_stalls_total", "Event loop stalls longer than the lag threshold",
+)
+
+
+class LoopWatchdog:
+    """Detects event loop stalls caused by blocking or CPU-heavy code.
+
+    A heartbeat coroutine wakes up every `INTERVAL_SEC` and records how late
+    it was scheduled. A separate thread watches the heartbeat: when the loop
+    hasn't made it back to the heartbeat within `lag_threshold` seconds, the
+    loop is still stuck in the offending code, so the stack of the loop thread
+    is logged while it's happening.
+
+    In debug mode asyncio itself logs every callback or task step that runs
+    longer than `slow_callback_duration`.
+    """
+
+    INTERVAL_SEC = 0.1
+
+    def __init__(self, lag_threshold, debug=False, slow_callback_duration=0.1):
+        self.lag_threshold = lag_threshold
+        self.debug = debug
+        self.slow_callback_duration = slow_callback_duration
+        self.last_beat = time.monotonic()
+        self._loop_thread_id = None
+        self._monitor = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        if self.debug:
+            loop.set_debug(True)
+            loop.slow_callback_duration = self.slow_callback_duration
+            logger.info(
+                f"Loop debug mode is on, logging callbacks slower than "
+                f"{self.slow_callback_duration}s"
+            )
+
+        self._monitor = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True,
+        )
+        self._monitor.start()
+
+        logger.info("Enter event loop watchdog")
+
+        while True:
+            self.last_beat = time.monotonic()
+            await asyncio.sleep(self.INTERVAL_SEC)
+            lag = time.monotonic() - self.last_beat - self.INTERVAL_SEC
+            LOOP_LAG_SECONDS.observe(max(0, lag))
+
+    def _watch(self):
+        stalled_beat = None
+        while True:
+            time.sleep(self.INTERVAL_SEC)
+            last_beat = self.last_beat
+            stalled_for = time.monotonic() - last_beat - self.INTERVAL_SEC
+
+            # report every stall once, while the loop is still stuck in it
+            if stalled_for < self.lag_threshold or last_beat == stalled_beat:
+                continue
+            stalled_beat = last_beat
+            LOOP_STALLS.inc()
+            logger.warning(
+                f"Event loop is blocked for {stalled_for:.2f}s, "
+                f"it is executing:\n{self._format_loop_stack()}"
+            )
+
+    def _format_loop_stack(self):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return "<unknown>"
+
+        return "".join(traceback.format_stack(frame))
@@ -3,9 +3,22 @@ import asyncio
 import logging
 
 from bot import Bot
-from db import Database, QuestDbIngester, create_schema, db
+from db import Database, QuestDbIngester, SpillLog, create_schema, db
+from metrics import MetricsServer, registry
+from settings import (
+    INGEST_SPILL_DIR,
+    INGEST_SPILL_MAX_SIZE,
+    INGEST_SPILL_SEGMENT_SIZE,
+    LOOP_DEBUG,
+    LOOP_LAG_THRESHOLD_MS,
+    METRICS_HOST,
+    METRICS_PORT,
+    SLOW_CALLBACK_MS,
+)
 from telegram_client import telegram_client
 from service.stats_collector import StatsCollector
+from service.stats_rollup import stats_rollup
+from loop_watchdog import LoopWatchdog
 
 logging.basicConfig(
     format='[%(levelname) 5s/%(asctime)s] %(name)s: %(message)s', level=logging.INFO,
@@ -20,16 +33,40 @@ logger = logging.getLogger(__name__)
 def main():
     logger.info("Starting statsbot")
 
-    questdb_ingester = QuestDbIngester()
+    spill_log = None
+    if INGEST_SPILL_DIR:
+        spill_log = SpillLog(
+            INGEST_SPILL_DIR,
+            segment_size=INGEST_SPILL_SEGMENT_SIZE,
+            max_size=INGEST_SPILL_MAX_SIZE,
+        )
+    else:
+        logger.warning(
+            "INGEST_SPILL_DIR is empty, rows will be dropped while QuestDB is down"
+        )
+
+    questdb_ingester = QuestDbIngester(spill_log=spill_log)
     questdb_ingester.start()
 
     bot = Bot()
     stats_collector = StatsCollector(questdb_ingester)
+    watchdog = LoopWatchdog(
+        lag_threshold=LOOP_LAG_THRESHOLD_MS / 1000,
+        debug=LOOP_DEBUG,
+        slow_callback_duration=SLOW_CALLBACK_MS / 1000,
+    )
 
     async def run():
         await db.connect()
         await create_schema()
-        await asyncio.gather(bot.start(), stats_collector.start())
+        tasks = [
+            watchdog.start(), bot.start(), stats_collector.start(),
+            stats_rollup.start(questdb_ingester),
+        ]
+        if METRICS_PORT:
+            metrics_server = MetricsServer(registry, METRICS_HOST, METRICS_PORT)
+            tasks.append(metrics_server.serve_forever())
+        await asyncio.gather(*tasks)
 
     with telegram_client:
         try:
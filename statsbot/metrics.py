@@ -0,0 +1,249 @@
+import logging
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from http import HTTPStatus
+
+from http_server import HttpServer, Response
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+
+    labels = ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+    return f"{{{labels}}}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    """Base class of metrics, children hold the values for each label set.
+
+    Updating a metric is a dict lookup and an arithmetic operation, without
+    locking, so it's cheap enough to be done on every update. Metrics updated
+    from several threads may occasionally lose an increment.
+    """
+
+    type = None
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._default = self._children[()] = self._make_child()
+
+    def labels(self, *labelvalues):
+        try:
+            return self._children[labelvalues]
+        except KeyError:
+            assert len(labelvalues) == len(self.labelnames), (
+                f"Metric {self.name} expects labels {self.labelnames}"
+            )
+            child = self._children[labelvalues] = self._make_child()
+            return child
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for labelvalues, child in list(self._children.items()):
+            lines.extend(self._render_child(labelvalues, child))
+        return lines
+
+    @abstractmethod
+    def _make_child(self):
+        ...
+
+    def _render_child(self, labelvalues, child):
+        labels = _format_labels(self.labelnames, labelvalues)
+        return [f"{self.name}{labels} {_format_value(child.get())}"]
+
+
+class _Value:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """Compute the value on every scrape instead of storing it."""
+        self.function = function
+
+    def get(self):
+        return self.function() if self.function else self.value
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _make_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def set_function(self, function):
+        self._default.set_function(function)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def _make_child(self):
+        return _Value()
+
+    def set(self, value):
+        self._default.set(value)
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+    def set_function(self, function):
+        self._default.set_function(function)
+
+
+class Histogram(Metric):
+    type = "histogram"
+    DEFAULT_BUCKETS = (
+        0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+    )
+
+    def __init__(self, name, description, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, description, labelnames)
+
+    def _make_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def _render_child(self, labelvalues, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            labels = _format_labels(
+                self.labelnames, labelvalues, ("le", _format_value(bound)),
+            )
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+        labels = _format_labels(self.labelnames, labelvalues)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def counter(self, name, description, labelnames=()):
+        return self._get_or_create(Counter, name, description, labelnames)
+
+    def gauge(self, name, description, labelnames=()):
+        return self._get_or_create(Gauge, name, description, labelnames)
+
+    def histogram(self, name, description, labelnames=(), **kwargs):
+        return self._get_or_create(
+            Histogram, name, description, labelnames, **kwargs
+        )
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                logger.exception(f"Failed to render metric {metric.name}")
+        return "\n".join(lines) + "\n"
+
+    def _get_or_create(self, metric_cls, name, description, labelnames, **kwargs):
+        if metric := self._metrics.get(name):
+            assert isinstance(metric, metric_cls), (
+                f"Metric {name} is already registered as a {metric.type}"
+            )
+            return metric
+
+        metric = self._metrics[name] = metric_cls(
+            name, description, labelnames, **kwargs
+        )
+        return metric
+
+
+class MetricsServer:
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, registry, host, port):
+        self.registry = registry
+        self.http_server = HttpServer(host, port)
+        self.http_server.route("GET", "/metrics", self._handle_metrics)
+
+    async def serve_forever(self):
+        await self.http_server.serve_forever()
+
+    async def _handle_metrics(self, request):
+        return Response(
+            HTTPStatus.OK,
+            self.registry.render().encode(),
+            {"Content-Type": self.CONTENT_TYPE},
+        )
+
+registry = MetricsRegistry()
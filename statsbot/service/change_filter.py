@@ -0,0 +1,86 @@
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from dao import stats_dao
+
+logger = logging.getLogger(__name__)
+
+
+def _hash_counters(stats_dto):
+    return hash(
+        (stats_dto.views, stats_dto.reactions, stats_dto.forwards, stats_dto.replies)
+    )
+
+
+class StatsChangeFilter:
+    """Counters last written for every message, to skip writing unchanged ones.
+
+    Only a hash of the counters and the time of the write are kept per
+    `(chat_id, message_id)`. A message whose counters didn't change is still
+    written once every `heartbeat` seconds, so rollups find its previous
+    counters within their seed window. A channel skipped for a cycle is
+    forgotten, so all its messages are written on the next cycle regardless.
+
+    Counters are remembered once the ingester has accepted their row. A row
+    can still be lost after that, when the ingester drops it on overflow or
+    fails to flush it without a spill log, and is then only written again at
+    the next heartbeat or change.
+    """
+
+    def __init__(self, heartbeat):
+        self.heartbeat = heartbeat
+        # (chat_id, message_id) -> (hash of the counters, unix time of the write)
+        self._written = {}
+
+    def __len__(self):
+        return len(self._written)
+
+    def should_write(self, chat_id, message_id, stats_dto):
+        """Return whether the counters have changed or are due for a heartbeat."""
+        if (written := self._written.get((chat_id, message_id))) is None:
+            return True
+
+        written_hash, written_at = written
+        return (
+            written_hash != _hash_counters(stats_dto)
+            or time.time() - written_at >= self.heartbeat
+        )
+
+    def remember(self, chat_id, message_id, stats_dto):
+        """Remember the counters once their row has been handed to the ingester."""
+        self._written[(chat_id, message_id)] = (
+            _hash_counters(stats_dto), int(time.time()),
+        )
+
+    def forget_chat(self, chat_id):
+        """Forget the counters of a chat, so that they're all written next time."""
+        self._written = {
+            key: written for key, written in self._written.items()
+            if key[0] != chat_id
+        }
+
+    def prune(self):
+        """Forget messages that haven't been collected for two heartbeats."""
+        expire_before = time.time() - 2 * self.heartbeat
+        self._written = {
+            key: written for key, written in self._written.items()
+            if written[1] >= expire_before
+        }
+
+    async def load(self):
+        """Seed the counters from the snapshots written within the last heartbeat.
+
+        Messages written before that are due for a heartbeat anyway.
+        """
+        logger.info("Start loading last written stats")
+
+        since = datetime.now(timezone.utc) - timedelta(seconds=self.heartbeat)
+        for chat_id, message_id, written_at, stats_dto in (
+            await stats_dao.get_latest_counters(since)
+        ):
+            self._written[(chat_id, message_id)] = (
+                _hash_counters(stats_dto), int(written_at.timestamp()),
+            )
+
+        logger.info(f"Finish loading last written stats: {len(self)} messages")
@@ -6,6 +6,7 @@ from telethon.errors.rpcerrorlist import ChannelPrivateError
 from dao import chat_dao
 from dto import ChatDto
 from telegram_client import telegram_client
+from utils import SingleFlight
 
 from .exceptions import ChannelPrivateError as ServiceChannelPrivateError
 
@@ -13,7 +14,17 @@ from .exceptions import ChannelPrivateError as ServiceChannelPrivateError
 class ChatService:
     SEARCH_RESULTS_LIMIT = 20
 
+    def __init__(self):
+        self._creating = SingleFlight()
+
     async def get_or_create_channel(self, channel_id, chat_title):
+        # forwards of the same channel from different users are handled
+        # concurrently, they share one check-then-insert
+        return await self._creating.do(
+            int(channel_id), self._get_or_create_channel, channel_id, chat_title,
+        )
+
+    async def _get_or_create_channel(self, channel_id, chat_title):
         if chat_dto := await chat_dao.get_chat(channel_id):
             return chat_dto, False
 
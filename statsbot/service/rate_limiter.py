@@ -0,0 +1,51 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class FloodAwareRateLimiter:
+    """Token bucket shared between concurrent Telegram readers.
+
+    The refill rate adapts to Telegram's flood control: every FloodWait halves
+    it (down to `min_rate`) and every successful read slowly restores it
+    towards `max_rate`.
+    """
+
+    RECOVERY_STEP = 0.1
+
+    def __init__(self, max_rate, burst, min_rate=0.1):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.rate = max_rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.RECOVERY_STEP)
+
+    def on_flood_wait(self, seconds):
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0
+        logger.warning(
+            f"FloodWait for {seconds}s, reading rate lowered to {self.rate:.2f}/s"
+        )
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import secrets
+import time
+from collections import OrderedDict
+
+from settings import REPORT_CURSOR_TTL_SEC, REPORT_MAX_CURSORS
+
+logger = logging.getLogger(__name__)
+
+
+class ReportCursor:
+    """Rows of one report, pulled from its source only as far as pages are viewed."""
+
+    def __init__(self, source, chat_id, channel_id, page_size):
+        self.chat_id = chat_id
+        self.channel_id = channel_id
+        self.page_size = page_size
+        self.rows = []
+        self.exhausted = False
+        self.closed = False
+        self.used_at = time.monotonic()
+        self._source = source
+        # the source is an async generator, it can't be advanced concurrently
+        self._lock = asyncio.Lock()
+
+    @property
+    def num_pages(self):
+        """Number of pages, `None` until the whole report was read."""
+        if not self.exhausted:
+            return None
+        return -(-len(self.rows) // self.page_size)
+
+    async def get_page(self, page):
+        """Return the rows of a page and whether there's a page after it."""
+        start = page * self.page_size
+        end = start + self.page_size
+        # one row more tells whether there's a next page
+        await self._fill(end + 1)
+        return self.rows[start:end], len(self.rows) > end
+
+    async def get_rows(self):
+        await self._fill(None)
+        return self.rows
+
+    async def close(self):
+        # a fill in progress stops after its current row and lets go of the lock
+        self.closed = True
+        async with self._lock:
+            await self._source.aclose()
+
+    async def _fill(self, num_rows):
+        async with self._lock:
+            while not (self.exhausted or self.closed) and (
+                num_rows is None or len(self.rows) < num_rows
+            ):
+                try:
+                    self.rows.append(await anext(self._source))
+                except StopAsyncIteration:
+                    self.exhausted = True
+
+
+class ReportCursorStore:
+    """Open report cursors by a short random id that fits into callback data.
+
+    Cursors unused for `ttl` seconds are closed, and so are the least recently
+    used ones once there are more than `max_cursors`. Evicted cursors are
+    closed in the background, so opening a report never waits for a page
+    another one is filling. A cursor only answers to the chat it was opened for.
+    """
+
+    ID_BYTES = 6
+
+    def __init__(self, ttl, max_cursors):
+        self.ttl = ttl
+        self.max_cursors = max_cursors
+        self._cursors = OrderedDict()
+        self._closing = set()
+
+    def __len__(self):
+        return len(self._cursors)
+
+    async def open(self, source, chat_id, channel_id, page_size):
+        """Return the id and the cursor over the report rows of `source`."""
+        self._evict()
+
+        # random rather than sequential, so ids from before a restart can't
+        # point at someone else's report
+        cursor_id = secrets.token_urlsafe(self.ID_BYTES)
+        cursor = ReportCursor(source, chat_id, channel_id, page_size)
+        self._cursors[cursor_id] = cursor
+        return cursor_id, cursor
+
+    async def get(self, cursor_id, chat_id):
+        self._evict()
+
+        cursor = self._cursors.get(cursor_id)
+        if cursor is None or cursor.chat_id != chat_id:
+            return None
+
+        cursor.used_at = time.monotonic()
+        self._cursors.move_to_end(cursor_id)
+        return cursor
+
+    async def close(self, cursor_id):
+        if (cursor := self._cursors.pop(cursor_id, None)) is not None:
+            await cursor.close()
+
+    def _evict(self):
+        expire_before = time.monotonic() - self.ttl
+        while self._cursors:
+            cursor_id, cursor = next(iter(self._cursors.items()))
+            if len(self._cursors) < self.max_cursors and cursor.used_at > expire_before:
+                break
+
+            del self._cursors[cursor_id]
+            task = asyncio.create_task(self._close_evicted(cursor_id, cursor))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    async def _close_evicted(cursor_id, cursor):
+        logger.debug(f"Closing report cursor {cursor_id}")
+        try:
+            await cursor.close()
+        except Exception:
+            logger.exception(f"Failed to close report cursor {cursor_id}")
+
+report_cursors = ReportCursorStore(
+    ttl=REPORT_CURSOR_TTL_SEC, max_cursors=REPORT_MAX_CURSORS,
+)
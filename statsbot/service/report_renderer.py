@@ -0,0 +1,149 @@
+import csv
+import io
+from html import escape
+from zoneinfo import ZoneInfo
+
+from settings import DEFAULT_TZ
+
+default_tz = ZoneInfo(DEFAULT_TZ)
+
+CSV_COLUMNS = (
+    "date", "text", "reactions", "replies", "forwards", "total", "views",
+    "involvement",
+)
+
+
+def _inline_text(text, max_len=50):
+    inline = text[:max_len].replace("\n", " ")
+    if len(text) > max_len:
+        inline += "..."
+
+    return inline
+
+
+def _format_date(timestamp):
+    local_time = timestamp.astimezone(default_tz)
+    return local_time.strftime("%a %d %b %Y %H:%M")
+
+
+def _get_involvement(stats):
+    if stats.views > 0:
+        return round((stats.total_reactions / stats.views) * 100, 2)
+    return None
+
+
+def _format_involvement(involvement):
+    return f"{involvement}%" if involvement is not None else 'n/a'
+
+
+def render_message_line(text, date, stats):
+    """Render one report row for a message with HTML parse mode."""
+    involvement = _get_involvement(stats)
+
+    title = _inline_text(text) if text else "..."
+    line = f"<b>{title}</b>\n"
+    line += f"<i>{_format_date(date)}</i>\n"
+    line += f"<code>{stats.reactions}</code> reactions + "
+    line += f"<code>{stats.replies}</code> replies + "
+    line += f"<code>{stats.forwards}</code> forwards"
+    line += f" = <code>{stats.total_reactions}</code> total\n"
+    line += f"<code>{stats.views}</code> views\n"
+    line += f"<b>involvement</b> = "
+    line += f"<code>{_format_involvement(involvement)}</code>\n\n"
+    return line
+
+
+def render_csv(rows):
+    """Render report rows as a CSV document, one row per message."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for text, date, stats in rows:
+        writer.writerow((
+            date.astimezone(default_tz).isoformat(),
+            text or "",
+            stats.reactions,
+            stats.replies,
+            stats.forwards,
+            stats.total_reactions,
+            stats.views,
+            _get_involvement(stats),
+        ))
+
+    return buffer.getvalue().encode()
+
+
+def render_html(rows, title):
+    """Render report rows as a standalone HTML page with one table."""
+    parts = [
+        "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">",
+        f"<title>{escape(title)}</title>",
+        "<style>table{border-collapse:collapse}"
+        "td,th{border:1px solid #ccc;padding:4px 8px}"
+        "td.n{text-align:right}</style>",
+        f"</head><body><h1>{escape(title)}</h1><table>",
+        "<tr><th>Post</th><th>Date</th><th>Reactions</th><th>Replies</th>"
+        "<th>Forwards</th><th>Total</th><th>Views</th><th>Involvement</th></tr>",
+    ]
+    for text, date, stats in rows:
+        parts.append(
+            f"<tr><td>{escape(_inline_text(text)) if text else '...'}</td>"
+            f"<td>{_format_date(date)}</td>"
+            f"<td class=\"n\">{stats.reactions}</td>"
+            f"<td class=\"n\">{stats.replies}</td>"
+            f"<td class=\"n\">{stats.forwards}</td>"
+            f"<td class=\"n\">{stats.total_reactions}</td>"
+            f"<td class=\"n\">{stats.views}</td>"
+            f"<td class=\"n\">{_format_involvement(_get_involvement(stats))}</td></tr>"
+        )
+    parts.append("</table></body></html>\n")
+
+    return "\n".join(parts).encode()
+
+
+TREND_TITLES = {"h": "hourly", "d": "daily", "w": "weekly"}
+TREND_DATE_FORMATS = {"h": "%d %b %H:%M", "d": "%a %d %b", "w": "%d %b %Y"}
+TREND_COLUMNS = ("views", "+views", "react", "inv")
+TREND_LEGEND = (
+    "views and reactions of all collected posts at the end of each interval, "
+    "+views gained during it"
+)
+
+
+def _format_count(count):
+    if abs(count) >= 1_000_000:
+        return f"{count / 1_000_000:.1f}M"
+    if abs(count) >= 10_000:
+        return f"{count / 1_000:.1f}k"
+    return str(count)
+
+
+def render_trends(title, granularity, points):
+    """Render `(datetime, StatsDto)` totals as a fixed-width table.
+
+    Views and reactions are the totals of all collected posts at the end of
+    each interval, "+views" is how many views the interval added.
+    """
+    date_format = TREND_DATE_FORMATS[granularity]
+    rows, prev_views = [], None
+    for timestamp, stats in points:
+        added = stats.views - prev_views if prev_views is not None else None
+        prev_views = stats.views
+        rows.append((
+            timestamp.astimezone(default_tz).strftime(date_format),
+            _format_count(stats.views),
+            _format_count(added) if added is not None else "",
+            _format_count(stats.total_reactions),
+            _format_involvement(_get_involvement(stats)),
+        ))
+
+    date_width = max(len(row[0]) for row in rows)
+    lines = [" " * date_width + "".join(f"{name:>8}" for name in TREND_COLUMNS)]
+    for date, *values in rows:
+        lines.append(f"{date:<{date_width}}" + "".join(f"{v:>8}" for v in values))
+
+    table = escape("\n".join(lines))
+    return (
+        f"<b>{escape(title)}</b>, {TREND_TITLES[granularity]}\n<pre>{table}</pre>\n"
+        f"<i>{TREND_LEGEND}</i>"
+    )
@@ -0,0 +1,199 @@
+import logging
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from dto import StatsDto
+from settings import SNAPSHOT_STORE_MAX_MESSAGES, SNAPSHOT_STORE_TTL_SEC
+
+logger = logging.getLogger(__name__)
+
+
+class ChannelSnapshot:
+    """Latest counters of one channel's messages in parallel arrays sorted by id."""
+
+    ARRAYS = (
+        "message_ids", "posted_at", "views", "reactions", "forwards", "replies",
+    )
+    __slots__ = ARRAYS + ("titles", "updated_at")
+
+    TITLE_LEN = 50
+
+    def __init__(self):
+        self.message_ids = array("q")
+        self.posted_at = array("d")
+        self.views = array("q")
+        self.reactions = array("q")
+        self.forwards = array("q")
+        self.replies = array("q")
+        self.titles = []
+        self.updated_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.message_ids)
+
+    def get(self, message_id):
+        """Return the stored counters of a message, None if it isn't stored."""
+        i = bisect_left(self.message_ids, message_id)
+        if i == len(self.message_ids) or self.message_ids[i] != message_id:
+            return None
+        return StatsDto(
+            self.views[i], self.reactions[i], self.forwards[i], self.replies[i],
+        )
+
+    def remove(self, message_id):
+        """Forget a deleted message."""
+        i = bisect_left(self.message_ids, message_id)
+        if i == len(self.message_ids) or self.message_ids[i] != message_id:
+            return
+        for name in self.ARRAYS:
+            del getattr(self, name)[i]
+        del self.titles[i]
+
+    def update(self, message_id, stats_dto, posted_at=None, text=None):
+        """Store new counters of a message.
+
+        A message that isn't in the snapshot yet is only added when its posting
+        time is given, counters alone are not enough to render it in a report.
+        """
+        i = bisect_left(self.message_ids, message_id)
+        if i < len(self.message_ids) and self.message_ids[i] == message_id:
+            self.views[i] = stats_dto.views
+            self.reactions[i] = stats_dto.reactions
+            self.forwards[i] = stats_dto.forwards
+            self.replies[i] = stats_dto.replies
+            if text is not None:
+                self.titles[i] = text[:self.TITLE_LEN + 1]
+            return True
+
+        if posted_at is None:
+            return False
+
+        self.message_ids.insert(i, message_id)
+        self.posted_at.insert(i, posted_at.timestamp())
+        self.views.insert(i, stats_dto.views)
+        self.reactions.insert(i, stats_dto.reactions)
+        self.forwards.insert(i, stats_dto.forwards)
+        self.replies.insert(i, stats_dto.replies)
+        # one extra character keeps the "..." suffix of truncated titles
+        self.titles.insert(i, text[:self.TITLE_LEN + 1] if text else None)
+        return True
+
+    def prune(self, since):
+        """Forget messages posted before `since`."""
+        since_ts = since.timestamp()
+        keep = [i for i, ts in enumerate(self.posted_at) if ts >= since_ts]
+        if len(keep) == len(self.message_ids):
+            return
+
+        for name in self.ARRAYS:
+            values = getattr(self, name)
+            setattr(self, name, array(values.typecode, (values[i] for i in keep)))
+        self.titles = [self.titles[i] for i in keep]
+
+    def iter_rows(self, since):
+        """Yield `(title, posted_at, StatsDto)` tuples ordered by posting time.
+
+        Iterates over a copy of the counters, so the collector can keep
+        updating the snapshot while a report is being sent.
+        """
+        since_ts = since.timestamp()
+        posted_at = self.posted_at[:]
+        views, reactions = self.views[:], self.reactions[:]
+        forwards, replies = self.forwards[:], self.replies[:]
+        titles = self.titles[:]
+
+        order = sorted(
+            (i for i, ts in enumerate(posted_at) if ts >= since_ts),
+            key=posted_at.__getitem__,
+        )
+        for i in order:
+            yield (
+                titles[i],
+                datetime.fromtimestamp(posted_at[i], tz=timezone.utc),
+                StatsDto(views[i], reactions[i], forwards[i], replies[i]),
+            )
+
+
+class SnapshotStore:
+    """In-process store of the latest per-message counters of every channel.
+
+    Filled by the collector on every cycle and read by reports. Channels that
+    haven't been updated for `ttl` seconds are evicted, and when the total
+    number of stored messages exceeds `max_messages` the least recently
+    updated channels are evicted first. Channels of the collection cycle in
+    progress are pinned and never evicted for capacity, so the cap can't drop
+    a channel the collector is about to fill and reload it every cycle.
+    """
+
+    def __init__(self, ttl, max_messages):
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._channels = OrderedDict()
+        self._pinned = set()
+        self._warned_pinned = False
+
+    def __contains__(self, chat_id):
+        return self.get(chat_id) is not None
+
+    @property
+    def num_messages(self):
+        return sum(len(snapshot) for snapshot in self._channels.values())
+
+    def get(self, chat_id):
+        if (snapshot := self._channels.get(chat_id)) is None:
+            return None
+
+        if time.monotonic() - snapshot.updated_at > self.ttl:
+            del self._channels[chat_id]
+            return None
+
+        return snapshot
+
+    def get_or_create(self, chat_id):
+        if (snapshot := self.get(chat_id)) is None:
+            snapshot = self._channels[chat_id] = ChannelSnapshot()
+        return snapshot
+
+    def pin(self, chat_ids):
+        """Keep the channels from being evicted for capacity until `unpin`."""
+        self._pinned = set(chat_ids)
+        self._warned_pinned = False
+
+    def unpin(self):
+        self._pinned = set()
+
+    def touch(self, chat_id):
+        """Mark the channel as freshly updated and enforce the memory cap."""
+        if (snapshot := self._channels.get(chat_id)) is not None:
+            snapshot.updated_at = time.monotonic()
+            self._channels.move_to_end(chat_id)
+
+        if (num_messages := self.num_messages) <= self.max_messages:
+            return
+
+        evictable = [
+            evicted_id for evicted_id in self._channels
+            if evicted_id != chat_id and evicted_id not in self._pinned
+        ]
+        for evicted_id in evictable:
+            if num_messages <= self.max_messages:
+                break
+            num_messages -= len(self._channels.pop(evicted_id))
+            logger.info(
+                f"Snapshot store is over capacity, evicted channel_id={evicted_id}"
+            )
+
+        if num_messages > self.max_messages and not self._warned_pinned:
+            self._warned_pinned = True
+            logger.warning(
+                f"Snapshot store holds {num_messages} messages of the channels "
+                f"being collected, over SNAPSHOT_STORE_MAX_MESSAGES="
+                f"{self.max_messages}"
+            )
+
+snapshot_store = SnapshotStore(
+    ttl=SNAPSHOT_STORE_TTL_SEC, max_messages=SNAPSHOT_STORE_MAX_MESSAGES,
+)
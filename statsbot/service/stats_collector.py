@@ -1,51 +1,276 @@
 import asyncio
 import logging
+import time
+from dataclasses import dataclass, field
 
-from dao import chat_dao
+from telethon.errors import FloodWaitError
+from telethon.utils import resolve_id
+
+from dao import chat_dao, stats_dao
+from db import IngestRow
+from metrics import registry
+from service.change_filter import StatsChangeFilter
+from service.rate_limiter import FloodAwareRateLimiter
+from service.snapshot_store import snapshot_store
+from service.stats_rollup import stats_rollup
 from service.stats_service import stats_service
+from service.watermarks import ChannelWatermarks
+from settings import COLLECT_CONCURRENCY, COLLECT_READS_PER_SEC, STATS_HEARTBEAT_SEC
 
 logger = logging.getLogger(__name__)
 
+CYCLE_SECONDS = registry.histogram(
+    "statsbot_collect_cycle_seconds", "Duration of a stats collection cycle",
+    buckets=(1, 5, 15, 30, 60, 120, 180, 240, 300, 600),
+)
+MESSAGES_COLLECTED = registry.counter(
+    "statsbot_collect_messages_total", "Messages whose stats were collected",
+)
+FLOOD_WAITS = registry.counter(
+    "statsbot_collect_flood_waits_total", "Flood waits hit while collecting stats",
+)
+ROWS_UNCHANGED = registry.counter(
+    "statsbot_collect_rows_unchanged_total",
+    "Stats rows not written because the counters didn't change",
+)
+CHANNELS_SKIPPED = registry.counter(
+    "statsbot_collect_channels_skipped_total", "Channels skipped in a collection cycle",
+)
+
+
+@dataclass
+class CollectionReport:
+    channels: int = 0
+    collected: int = 0
+    messages: int = 0
+    flood_waits: int = 0
+    skipped: list[int] = field(default_factory=list)
+    duration: float = 0.0
+
+
+@dataclass
+class ChannelProgress:
+    """How far a channel got in this cycle, so a retry picks up from there."""
+
+    refresh_ids: list[int] | None = None
+    refreshed_until: int = 0
+    messages: int = 0
+
 
 class StatsCollector:
     COLLECT_INTERVAL_SEC = 5 * 60
+    SAVE_BATCH_SIZE = 500
+    # reactions are only re-read for messages whose views changed, except on
+    # every this many cycles, as someone who has seen a post can still react
+    REACTIONS_REFRESH_CYCLES = 6
 
     def __init__(self, questdb_ingester):
         self.questdb_ingester = questdb_ingester
+        self.rate_limiter = FloodAwareRateLimiter(
+            max_rate=COLLECT_READS_PER_SEC, burst=COLLECT_CONCURRENCY,
+        )
+        self.watermarks = ChannelWatermarks()
+        self.change_filter = StatsChangeFilter(heartbeat=STATS_HEARTBEAT_SEC)
+        self.num_cycles = 0
+        registry.gauge(
+            "statsbot_collect_rate", "Current Telegram read rate of the collector",
+        ).set_function(lambda: self.rate_limiter.rate)
 
     async def start(self):
+        await self.watermarks.load(since=self._get_collection_start())
+        await self.change_filter.load()
+
         logger.info("Enter stats-collecting loop")
 
         while True:
-            await self._collect_stats()
-            await asyncio.sleep(self.COLLECT_INTERVAL_SEC)
+            report = await self._collect_stats()
+            await asyncio.sleep(max(0, self.COLLECT_INTERVAL_SEC - report.duration))
 
     async def _collect_stats(self):
         logger.debug("Start collecting stats")
+        started_at = time.monotonic()
+        deadline = started_at + self.COLLECT_INTERVAL_SEC
 
         chats = await chat_dao.get_chats()
+        report = CollectionReport(channels=len(chats))
+        semaphore = asyncio.Semaphore(COLLECT_CONCURRENCY)
+
+        snapshot_store.pin(chat.chat_id for chat in chats)
+        try:
+            await asyncio.gather(*(
+                self._collect_channel(chat, semaphore, deadline, report)
+                for chat in chats
+            ))
+        finally:
+            snapshot_store.unpin()
+
+        self.change_filter.prune()
+        self.num_cycles += 1
+        report.duration = time.monotonic() - started_at
+        CYCLE_SECONDS.observe(report.duration)
+        MESSAGES_COLLECTED.inc(report.messages)
+        FLOOD_WAITS.inc(report.flood_waits)
+        CHANNELS_SKIPPED.inc(len(report.skipped))
+        logger.info(
+            f"Finish collecting stats in {report.duration:.1f}s: "
+            f"{report.collected}/{report.channels} channels, "
+            f"{report.messages} messages, {report.flood_waits} flood waits, "
+            f"skipped channels: {report.skipped or 'none'}"
+        )
+        return report
 
-        for chat in chats:
-            logger.debug(f"Start collecting stats for channel_id={chat.chat_id}")
+    async def _collect_channel(self, chat, semaphore, deadline, report):
+        progress = ChannelProgress()
+        while True:
+            async with semaphore:
+                try:
+                    await self._collect_channel_stats(chat, progress)
+                except FloodWaitError as exc:
+                    report.flood_waits += 1
+                    self.rate_limiter.on_flood_wait(exc.seconds)
+                    retry_at = time.monotonic() + exc.seconds
+                except Exception:
+                    logger.exception(
+                        f"Failed to collect stats for channel_id={chat.chat_id}"
+                    )
+                    self._skip_channel(chat, progress, report)
+                    return
+                else:
+                    self.rate_limiter.on_success()
+                    report.messages += progress.messages
+                    report.collected += 1
+                    return
+
+            # wait outside of the semaphore so other channels keep being collected
+            if retry_at > deadline:
+                logger.warning(
+                    f"Channel channel_id={chat.chat_id} is flood-limited past the "
+                    f"end of the cycle, skipping it"
+                )
+                self._skip_channel(chat, progress, report)
+                return
+            await asyncio.sleep(retry_at - time.monotonic())
 
+    def _skip_channel(self, chat, progress, report):
+        report.messages += progress.messages
+        report.skipped.append(chat.chat_id)
+        # skipped cycles add up on top of the heartbeat, so the channel's
+        # messages are written on the next cycle to stay within the seed window
+        peer_channel_id, _ = resolve_id(chat.chat_id)
+        self.change_filter.forget_chat(peer_channel_id)
+
+    async def _collect_channel_stats(self, chat, progress):
+        logger.debug(f"Start collecting stats for channel_id={chat.chat_id}")
+
+        peer_channel_id, _ = resolve_id(chat.chat_id)
+        snapshot = await self._get_snapshot(chat.chat_id, peer_channel_id)
+        rows = []
+
+        try:
+            # messages seen before only need their counters refreshed, a retry
+            # goes on after the last refreshed one
+            if self.watermarks.is_known(chat.chat_id):
+                if progress.refresh_ids is None:
+                    progress.refresh_ids = self.watermarks.get_known_ids(
+                        chat.chat_id, since=self._get_collection_start(),
+                    )
+                refresh_ids = [
+                    message_id for message_id in progress.refresh_ids
+                    if message_id > progress.refreshed_until
+                ]
+                refresh_reactions = self.num_cycles % self.REACTIONS_REFRESH_CYCLES == 0
+                async for message_id, stats_dto in stats_service.refresh_message_stats(
+                    chat.chat_id,
+                    refresh_ids,
+                    known_stats=None if refresh_reactions else snapshot.get,
+                    rate_limiter=self.rate_limiter,
+                ):
+                    progress.refreshed_until = message_id
+                    if stats_dto is None:
+                        self.watermarks.discard(chat.chat_id, message_id)
+                        snapshot.remove(message_id)
+                        continue
+                    self._add_row(rows, peer_channel_id, message_id, stats_dto)
+                    snapshot.update(message_id, stats_dto)
+                    progress.messages += 1
+                    rows = await self._save_rows(rows)
+
+            # only messages newer than the watermark are read in full, which
+            # also makes a retry go on after the last message read
             async for message, stats_dto in stats_service.get_message_stats(
-                chat.chat_id
+                chat.chat_id,
+                min_id=self.watermarks.get(chat.chat_id),
+                rate_limiter=self.rate_limiter,
             ):
-                self.questdb_ingester.save(
-                    "stats",
-                    symbols={
-                        "message_id": str(message.id),
-                        "chat_id": str(message.peer_id.channel_id),
-                    },
-                    columns={
-                        "views": stats_dto.views,
-                        "reactions": stats_dto.reactions,
-                        "forwards": stats_dto.forwards,
-                        "replies": stats_dto.replies,
-                    },
-                )
+                self.watermarks.add(chat.chat_id, message.id, message.date)
+                self._add_row(rows, peer_channel_id, message.id, stats_dto)
+                snapshot.update(message.id, stats_dto, message.date, message.raw_text)
+                progress.messages += 1
+                rows = await self._save_rows(rows)
+            self.watermarks.mark_known(chat.chat_id)
+        finally:
+            await self._save_rows(rows, force=True)
+
+        snapshot.prune(stats_service.get_from_date(stats_service.MAX_REPORT_WEEKS))
+        snapshot_store.touch(chat.chat_id)
+
+        logger.debug(f"Finish collecting stats for channel_id={chat.chat_id}")
+
+    @staticmethod
+    async def _get_snapshot(chat_id, peer_channel_id):
+        if (snapshot := snapshot_store.get(chat_id)) is not None:
+            return snapshot
+
+        # (re)fill the store from the stats table so that reports can be served
+        # from memory for messages that are no longer refreshed
+        snapshot = snapshot_store.get_or_create(chat_id)
+        since = stats_service.get_from_date(stats_service.MAX_REPORT_WEEKS)
+        for message_dto, stats_dto in await stats_dao.get_latest_stats(
+            peer_channel_id, since, stats_rollup.rolled_up_until.get("1d"),
+        ):
+            snapshot.update(
+                message_dto.message_id, stats_dto, message_dto.date, message_dto.text,
+            )
+        return snapshot
+
+    @staticmethod
+    def _get_collection_start():
+        return stats_service.get_from_date(stats_service.COLLECTION_WEEKS)
+
+    def _add_row(self, rows, peer_channel_id, message_id, stats_dto):
+        if self.change_filter.should_write(peer_channel_id, message_id, stats_dto):
+            rows.append((peer_channel_id, message_id, stats_dto))
+        else:
+            ROWS_UNCHANGED.inc()
+
+    async def _save_rows(self, rows, force=False):
+        """Hand rows over to the ingester once a batch is full, return what's left.
 
-            logger.debug(f"Finish collecting stats for channel_id={chat.chat_id}")
+        The change filter only remembers rows the ingester has accepted, so
+        rows of a failed batch are written again on the next cycle.
+        """
+        if rows and (force or len(rows) >= self.SAVE_BATCH_SIZE):
+            await self.questdb_ingester.save_many(
+                [self._make_stats_row(*row) for row in rows],
+            )
+            for row in rows:
+                self.change_filter.remember(*row)
+            return []
 
-        logger.debug("Finish collecting stats")
+        return rows
 
+    @staticmethod
+    def _make_stats_row(peer_channel_id, message_id, stats_dto):
+        return IngestRow(
+            "stats",
+            symbols={
+                "message_id": str(message_id),
+                "chat_id": str(peer_channel_id),
+            },
+            columns={
+                "views": stats_dto.views,
+                "reactions": stats_dto.reactions,
+                "forwards": stats_dto.forwards,
+                "replies": stats_dto.replies,
+            },
+        )
@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+from operator import itemgetter
+from zoneinfo import ZoneInfo
+
+from dao import stats_dao
+from dto import StatsDto
+from metrics import registry
+from settings import DEFAULT_TZ, STATS_RETENTION_DAYS, STATS_SEED_WINDOW_DAYS
+
+logger = logging.getLogger(__name__)
+default_tz = ZoneInfo(DEFAULT_TZ)
+
+ROLLUP_SECONDS = registry.histogram(
+    "statsbot_rollup_seconds", "Duration of a stats rollup run",
+    buckets=(0.1, 0.5, 1, 5, 15, 60, 300),
+)
+
+
+def _floor(date, sample_by):
+    """Start of the local calendar interval `date` is in."""
+    local_date = date.astimezone(default_tz).replace(
+        minute=0, second=0, microsecond=0,
+    )
+    if sample_by == "1d":
+        local_date = local_date.replace(hour=0)
+    return local_date.astimezone(timezone.utc)
+
+
+def carry_totals(rows, counters, totals):
+    """Add the last snapshots of messages per interval to the channel totals.
+
+    `rows` are `(ts, peer_channel_id, message_id, StatsDto)` tuples ordered by
+    time, `counters` maps `(peer_channel_id, message_id)` to the `(StatsDto,
+    ts)` counted so far and `totals` maps peer channel ids to `(StatsDto,
+    number of messages)`. Both are updated in place. Every message adds how
+    much its counters grew since they were counted last, so messages that are
+    no longer refreshed keep their last counters in the totals. Returns the
+    `(ts, peer_channel_id, StatsDto, number of messages)` totals at the end of
+    every interval a channel had snapshots in.
+    """
+    results = []
+    for ts, ts_rows in groupby(rows, key=itemgetter(0)):
+        changed = {}
+        for _, peer_channel_id, message_id, stats_dto in ts_rows:
+            total, num_messages = totals.get(
+                peer_channel_id, (StatsDto(0, 0, 0, 0), 0),
+            )
+            if (counted := counters.get((peer_channel_id, message_id))) is None:
+                last = StatsDto(0, 0, 0, 0)
+                num_messages += 1
+            else:
+                last, _ = counted
+            totals[peer_channel_id] = changed[peer_channel_id] = (
+                StatsDto(
+                    total.views + stats_dto.views - last.views,
+                    total.reactions + stats_dto.reactions - last.reactions,
+                    total.forwards + stats_dto.forwards - last.forwards,
+                    total.replies + stats_dto.replies - last.replies,
+                ),
+                num_messages,
+            )
+            counters[(peer_channel_id, message_id)] = (stats_dto, ts)
+
+        results.extend(
+            (ts, peer_channel_id, total, num_messages)
+            for peer_channel_id, (total, num_messages) in changed.items()
+        )
+
+    return results
+
+
+@dataclass
+class RollupState:
+    """What a rollup has counted up to `until`, kept between runs."""
+
+    until: datetime
+    counters: dict = field(default_factory=dict)
+    totals: dict = field(default_factory=dict)
+
+
+class StatsRollup:
+    """Keeps hourly and daily rollups of the stats table up to date.
+
+    Every run aggregates the intervals that have ended since the last one,
+    then drops raw stats older than the retention period. Channel totals
+    carry the last counters of every message collected so far, so they don't
+    shrink when old posts stop being refreshed. The counters are kept in
+    memory between runs and only loaded from the rollup tables on start, or
+    when spilled rows were replayed into intervals that are rolled up already.
+    """
+
+    ROLLUP_INTERVAL_SEC = 10 * 60
+    # rows of an interval can still arrive shortly after it has ended
+    SETTLE_SEC = 2 * 60
+    INTERVALS = {"1h": timedelta(hours=1), "1d": timedelta(days=1)}
+    # bounds how many snapshots a single query reads and a single call adds
+    # up when catching up, so the event loop isn't held up for long
+    MAX_INTERVALS_PER_QUERY = {"1h": 3, "1d": 1}
+    # a message is written at least once a heartbeat while it's refreshed, so
+    # one that has a snapshot had its previous one no longer than this before
+    SEED_WINDOW = timedelta(days=STATS_SEED_WINDOW_DAYS)
+
+    def __init__(self, retention_days):
+        self.retention_days = retention_days
+        self.rolled_up_until = {}
+        self.questdb_ingester = None
+        self._states = {}
+        # replays are rolled up again on the run after the one that took them,
+        # by then QuestDB has applied the replayed rows
+        self._reroll_since = None
+
+    async def start(self, questdb_ingester=None):
+        self.questdb_ingester = questdb_ingester
+        logger.info("Enter stats-rollup loop")
+
+        while True:
+            started_at = time.perf_counter()
+            try:
+                await self.run()
+            except Exception:
+                logger.exception("Failed to roll up stats")
+            ROLLUP_SECONDS.observe(time.perf_counter() - started_at)
+            await asyncio.sleep(self.ROLLUP_INTERVAL_SEC)
+
+    async def run(self):
+        reroll_since, self._reroll_since = self._reroll_since, None
+        if self.questdb_ingester is not None:
+            self._reroll_since = self.questdb_ingester.take_replayed_since("stats")
+
+        try:
+            for sample_by in self.INTERVALS:
+                await self._roll_up(sample_by, reroll_since)
+        except Exception:
+            # a failed chunk is rolled up again, so is the replay
+            if reroll_since is not None:
+                self._reroll_since = min(
+                    reroll_since, self._reroll_since or reroll_since,
+                )
+            raise
+
+        if self.retention_days:
+            await self._drop_expired_stats()
+
+    async def _roll_up(self, sample_by, reroll_since=None):
+        interval = self.INTERVALS[sample_by]
+        settled_at = datetime.now(timezone.utc) - timedelta(seconds=self.SETTLE_SEC)
+        until = _floor(settled_at, sample_by)
+
+        last_ts = await stats_dao.get_last_rollup_ts(sample_by)
+        if last_ts:
+            # only what's visible in the rollup tables already, intervals
+            # written below become visible once QuestDB has applied them
+            self.rolled_up_until[sample_by] = last_ts + interval
+
+        if (state := self._states.get(sample_by)) is None:
+            if last_ts:
+                since = last_ts + interval
+            elif first_ts := await stats_dao.get_first_stats_ts():
+                since = _floor(first_ts, sample_by)
+            else:
+                return
+            state = await self._load_state(sample_by, since)
+        if reroll_since is not None and _floor(reroll_since, sample_by) < state.until:
+            logger.info(f"Rolling up {sample_by} stats again from {reroll_since}")
+            state = await self._load_state(sample_by, _floor(reroll_since, sample_by))
+        self._states[sample_by] = state
+
+        while state.until < until:
+            chunk_until = min(
+                until,
+                state.until + interval * self.MAX_INTERVALS_PER_QUERY[sample_by],
+            )
+            logger.debug(
+                f"Rolling up {sample_by} stats from {state.until} to {chunk_until}"
+            )
+            await stats_dao.roll_up_messages(sample_by, state.until, chunk_until)
+            rows = await stats_dao.get_last_per_message(
+                sample_by, state.until, chunk_until,
+            )
+            await stats_dao.save_channel_totals(
+                sample_by, carry_totals(rows, state.counters, state.totals),
+            )
+            state.until = chunk_until
+
+        # messages without a snapshot for this long aren't refreshed anymore
+        expire_before = state.until - self.SEED_WINDOW
+        state.counters = {
+            key: counted for key, counted in state.counters.items()
+            if counted[1] >= expire_before
+        }
+
+    async def _load_state(self, sample_by, until):
+        """Load what was counted before `until` from the rollup tables."""
+        counters = {
+            (peer_channel_id, message_id): (stats_dto, ts)
+            for peer_channel_id, message_id, ts, stats_dto in (
+                await stats_dao.get_latest_counters(
+                    until - self.SEED_WINDOW, until, sample_by=sample_by,
+                )
+            )
+        }
+        totals = await stats_dao.get_channel_totals(sample_by, before=until)
+        return RollupState(until, counters, totals)
+
+    async def _drop_expired_stats(self):
+        # stats that aren't rolled up yet are kept however old they are
+        if (rolled_up_until := self.rolled_up_until.get("1d")) is None:
+            return
+
+        expire_before = min(
+            datetime.now(timezone.utc) - timedelta(days=self.retention_days),
+            rolled_up_until,
+        )
+        # stats are partitioned by month, partly expired months are kept whole
+        expire_before = expire_before.replace(
+            day=1, hour=0, minute=0, second=0, microsecond=0,
+        )
+
+        first_ts = await stats_dao.get_first_stats_ts()
+        if first_ts is None or first_ts >= expire_before:
+            return
+
+        logger.info(f"Dropping raw stats before {expire_before}")
+        await stats_dao.drop_stats_before(expire_before)
+
+stats_rollup = StatsRollup(retention_days=STATS_RETENTION_DAYS)
@@ -1,24 +1,27 @@
+from contextlib import aclosing
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 import logging
 
-from dao import message_dao
+from telethon.tl.functions.messages import (
+    GetMessagesReactionsRequest,
+    GetMessagesViewsRequest,
+)
+from telethon.tl.types import UpdateMessageReactions
+from telethon.utils import resolve_id
+
+from dao import chat_dao, message_dao, stats_dao
 from dto import StatsDto, MessageDto
+from service.snapshot_store import snapshot_store
+from service.stats_rollup import stats_rollup
 from settings import DEFAULT_TZ
 from telegram_client import telegram_client
+from utils import SingleFlight, SingleFlightStream, batch
 
 logger = logging.getLogger(__name__)
 default_tz = ZoneInfo(DEFAULT_TZ)
 
 
-def _inline_text(text, max_len=50):
-    inline = text[:max_len].replace("\n", " ")
-    if len(text) > max_len:
-        inline += "..."
-
-    return inline
-
-
 def _get_number(number):
     return number if number is not None else 0
 
@@ -28,75 +31,242 @@ def _get_local_time():
     return now.astimezone(default_tz)
 
 
-def _format_date(timestamp):
-    local_time = timestamp.astimezone(default_tz)
-    return local_time.strftime("%a %d %b %Y %H:%M")
-
-
-def _format_involvement(involvement):
-    return f"{involvement}%" if involvement is not None else 'n/a'
-
-
 def _make_message_dto(message):
     return MessageDto(
         message.id,
         message.peer_id.channel_id,
-        message.text,
+        message.raw_text,
         message.date,
     )
 
 
-def _make_stats_dto(message):
-    num_views = _get_number(message.views)
-    num_forwards = _get_number(message.forwards)
-    if reactions := message.reactions:
-        num_reactions = sum(res.count for res in reactions.results)
-    else:
-        num_reactions = 0
+def _count_reactions(reactions):
+    if reactions:
+        return sum(res.count for res in reactions.results)
 
-    if replies := message.replies:
-        num_replies = replies.replies
-    else:
-        num_replies = 0
+    return 0
 
-    return StatsDto(num_views, num_reactions, num_forwards, num_replies)
+
+def _count_replies(replies):
+    return replies.replies if replies else 0
+
+
+def _make_stats_dto(message):
+    return StatsDto(
+        _get_number(message.views),
+        _count_reactions(message.reactions),
+        _get_number(message.forwards),
+        _count_replies(message.replies),
+    )
 
 
 class StatsService:
+    REFRESH_BATCH_SIZE = 100
+    # messages Telethon fetches per request when iterating over a channel
+    MESSAGES_PAGE_SIZE = 100
+    # how far back the collector keeps refreshing message counters
+    COLLECTION_WEEKS = 1
+    MAX_REPORT_WEEKS = 4
+    # rollup interval and how far back trends go for each granularity, weeks
+    # are made of days
+    TRENDS = {
+        "h": ("1h", timedelta(days=2)),
+        "d": ("1d", timedelta(days=30)),
+        "w": ("1d", timedelta(weeks=12)),
+    }
+
+    def __init__(self):
+        self._reports = SingleFlight()
+        self._live_reports = SingleFlightStream()
+
     async def get_report(self, channel_id, weeks_back=1):
-        logger.debug("Start building report")
-        lines = []
-        async for message, stats in self.get_message_stats(channel_id, weeks_back):
-            if stats.views > 0:
-                involvement = round((stats.total_reactions / stats.views) * 100, 2)
-            else:
-                involvement = None
-
-            title = _inline_text(message.raw_text) if message.raw_text else "..."
-            line = f"<b>{title}</b>\n"
-            line += f"<i>{_format_date(message.date)}</i>\n"
-            line += f"<code>{stats.reactions}</code> reactions + "
-            line += f"<code>{stats.replies}</code> replies + "
-            line += f"<code>{stats.forwards}</code> forwards"
-            line += f" = <code>{stats.total_reactions}</code> total\n"
-            line += f"<code>{stats.views}</code> views\n"
-            line += f"<b>involvement</b> = "
-            line += f"<code>{_format_involvement(involvement)}</code>\n\n"
-            lines.append(line)
-
-        logger.debug("Finished building report")
-        return lines
-
-    async def get_message_stats(self, channel_id, weeks_back=1):
-        async for message in telegram_client.iter_messages(
-            channel_id, reverse=True, offset_date=self._get_from_date(weeks_back)
+        """Yield `(text, date, stats)` rows of the report as soon as each is available.
+
+        Rows come from the collected snapshots when they cover the period and
+        are streamed from Telegram otherwise.
+        """
+        rows = iter(await self._get_snapshot_rows(channel_id, weeks_back))
+        if (first_row := next(rows, None)) is not None:
+            logger.debug("Building report from collected snapshots")
+            yield first_row
+            for row in rows:
+                yield row
+            return
+
+        # concurrent requests for the same report share one scan of the channel,
+        # closed along with the report so that a report closed early stops it
+        async with aclosing(self._live_reports.iterate(
+            (channel_id, weeks_back), self.get_message_stats, channel_id, weeks_back,
+        )) as messages:
+            async for message, stats in messages:
+                yield message.raw_text, message.date, stats
+
+    async def _get_snapshot_rows(self, channel_id, weeks_back):
+        from_date = self.get_from_date(weeks_back)
+
+        # the collector only has snapshots of messages posted up to
+        # `COLLECTION_WEEKS` before the channel was added
+        chat_dto = await chat_dao.get_chat(channel_id)
+        if not chat_dto:
+            return []
+        if chat_dto.created_at - timedelta(weeks=self.COLLECTION_WEEKS) > from_date:
+            return []
+
+        if (snapshot := snapshot_store.get(int(channel_id))) is not None:
+            return snapshot.iter_rows(from_date)
+
+        # concurrent requests for the same report share one query
+        return await self._reports.do(
+            (channel_id, weeks_back), self._load_latest_stats, channel_id, from_date,
+        )
+
+    @staticmethod
+    async def _load_latest_stats(channel_id, from_date):
+        peer_channel_id, _ = resolve_id(int(channel_id))
+        snapshots = await stats_dao.get_latest_stats(
+            peer_channel_id, from_date, stats_rollup.rolled_up_until.get("1d"),
+        )
+
+        return [
+            (message_dto.text, message_dto.date, stats_dto)
+            for message_dto, stats_dto in snapshots
+        ]
+
+    async def get_trends(self, channel_id, granularity):
+        """Return `(datetime, StatsDto)` totals of the channel for each interval.
+
+        Totals include every post collected so far. Daily and weekly trends
+        end with today's totals as of the last hourly rollup.
+        """
+        sample_by, _ = self.TRENDS[granularity]
+        since = self.get_trends_since(granularity)
+        peer_channel_id, _ = resolve_id(int(channel_id))
+        points = await stats_dao.get_trends(peer_channel_id, since, sample_by)
+
+        if sample_by == "1d" and (
+            latest := await stats_dao.get_latest_channel_total(peer_channel_id, "1h")
         ):
-            message_dto = _make_message_dto(message)
-            await message_dao.create_message(message_dto)
-            yield message, _make_stats_dto(message)
+            timestamp, stats_dto = latest
+            today = timestamp.astimezone(default_tz).replace(
+                hour=0, minute=0, second=0, microsecond=0,
+            )
+            if today >= since and (not points or points[-1][0] < today):
+                points.append((today, stats_dto))
+
+        if granularity != "w":
+            return points
+
+        # a week ends with the totals of its last day
+        weeks = {}
+        for timestamp, stats_dto in points:
+            week = (timestamp - since) // timedelta(weeks=1)
+            weeks[week] = (since + timedelta(weeks=week), stats_dto)
+        return list(weeks.values())
+
+    def get_trends_since(self, granularity):
+        _, period = self.TRENDS[granularity]
+        since = (_get_local_time() - period).replace(
+            minute=0, second=0, microsecond=0,
+        )
+        # whole days for daily and weekly intervals
+        return since if granularity == "h" else since.replace(hour=0)
+
+    async def get_message_stats(
+        self, channel_id, weeks_back=1, min_id=0, rate_limiter=None,
+    ):
+        """Yield messages of the channel with their counters, oldest first.
+
+        With a `rate_limiter` a token is taken before every page is requested.
+        """
+        message_dtos = []
+        num_messages = 0
+        try:
+            if rate_limiter:
+                await rate_limiter.acquire()
+            async for message in telegram_client.iter_messages(
+                channel_id,
+                reverse=True,
+                offset_date=self.get_from_date(weeks_back),
+                min_id=min_id,
+            ):
+                message_dtos.append(_make_message_dto(message))
+                if len(message_dtos) >= message_dao.INSERT_BATCH_SIZE:
+                    await message_dao.save_messages(message_dtos)
+                    message_dtos = []
+
+                yield message, _make_stats_dto(message)
+
+                num_messages += 1
+                # the next message comes from a new page
+                if rate_limiter and num_messages % self.MESSAGES_PAGE_SIZE == 0:
+                    await rate_limiter.acquire()
+        finally:
+            if message_dtos:
+                await message_dao.save_messages(message_dtos)
+
+    async def refresh_message_stats(
+        self, channel_id, message_ids, known_stats=None, rate_limiter=None,
+    ):
+        """Yield current counters of known messages without fetching their bodies.
+
+        Views, forwards and replies come from messages.getMessagesViews and
+        reactions from messages.getMessagesReactions, both for up to
+        `REFRESH_BATCH_SIZE` ids per request. With `known_stats`, a function
+        returning the last counters of a message or None, reactions are only
+        requested for messages whose views changed, the others keep their last
+        reactions. Deleted messages are yielded with None instead of counters.
+        With a `rate_limiter` a token is taken before every request.
+        """
+        if not message_ids:
+            return
+
+        peer = await telegram_client.get_input_entity(channel_id)
+
+        for ids_batch in batch(message_ids, n=self.REFRESH_BATCH_SIZE):
+            if rate_limiter:
+                await rate_limiter.acquire()
+            views_result = await telegram_client(
+                GetMessagesViewsRequest(peer, ids_batch, increment=False)
+            )
+            counters = dict(zip(ids_batch, views_result.views))
+
+            reactions, reactions_ids = {}, []
+            for message_id, views in counters.items():
+                # deleted messages come back without any counters
+                if views.views is None:
+                    continue
+                known = known_stats(message_id) if known_stats else None
+                if known is not None and known.views == views.views:
+                    reactions[message_id] = known.reactions
+                else:
+                    reactions_ids.append(message_id)
+            if reactions_ids:
+                if rate_limiter:
+                    await rate_limiter.acquire()
+                reactions.update(await self._get_reactions(peer, reactions_ids))
+
+            for message_id, views in counters.items():
+                if views.views is None:
+                    yield message_id, None
+                    continue
+                yield message_id, StatsDto(
+                    views.views,
+                    reactions.get(message_id, 0),
+                    _get_number(views.forwards),
+                    _count_replies(views.replies),
+                )
+
+    @staticmethod
+    async def _get_reactions(peer, message_ids):
+        updates = await telegram_client(GetMessagesReactionsRequest(peer, message_ids))
+        return {
+            update.msg_id: _count_reactions(update.reactions)
+            for update in updates.updates
+            if isinstance(update, UpdateMessageReactions)
+        }
 
     @staticmethod
-    def _get_from_date(weeks_back):
+    def get_from_date(weeks_back):
         return (_get_local_time() - timedelta(weeks=weeks_back)).replace(
             hour=0, minute=0, second=0, microsecond=0,
         )
@@ -0,0 +1,66 @@
+import logging
+from datetime import timezone
+
+from telethon.tl.types import PeerChannel
+from telethon.utils import get_peer_id
+
+from dao import message_dao
+
+logger = logging.getLogger(__name__)
+
+
+class ChannelWatermarks:
+    """Messages already seen by the collector, per channel.
+
+    For every channel the newest seen message id (the watermark) is kept along
+    with the posting time of every message still inside the collection window,
+    so that only posts newer than the watermark have to be read in full and
+    the rest can be refreshed by id.
+    """
+
+    def __init__(self):
+        # chat_id -> {message_id: posted_at timestamp}
+        self._messages = {}
+        self._watermarks = {}
+
+    def is_known(self, chat_id):
+        return chat_id in self._messages
+
+    def get(self, chat_id):
+        return self._watermarks.get(chat_id, 0)
+
+    def add(self, chat_id, message_id, posted_at):
+        self._messages.setdefault(chat_id, {})[message_id] = posted_at.timestamp()
+        if message_id > self._watermarks.get(chat_id, 0):
+            self._watermarks[chat_id] = message_id
+
+    def discard(self, chat_id, message_id):
+        """Stop refreshing a deleted message, the watermark stays where it is."""
+        self._messages.get(chat_id, {}).pop(message_id, None)
+
+    def mark_known(self, chat_id):
+        self._messages.setdefault(chat_id, {})
+
+    def get_known_ids(self, chat_id, since):
+        """Return ids of known messages posted after `since`, forgetting older ones."""
+        messages = self._messages.get(chat_id, {})
+        since_ts = since.timestamp()
+
+        for message_id in [id_ for id_, ts in messages.items() if ts < since_ts]:
+            del messages[message_id]
+
+        return sorted(messages)
+
+    async def load(self, since):
+        logger.info("Start loading channel watermarks")
+
+        rows = await message_dao.get_messages_since(since)
+        for row in rows:
+            chat_id = get_peer_id(PeerChannel(int(row["chat_id"])))
+            posted_at = row["posted_at"].replace(tzinfo=timezone.utc)
+            self.add(chat_id, int(row["message_id"]), posted_at)
+
+        logger.info(
+            f"Finish loading channel watermarks: {len(rows)} messages in "
+            f"{len(self._messages)} channels"
+        )
@@ -1,4 +1,4 @@
-from utils import get_env_int, get_env
+from utils import get_env_int, get_env, panic
 
 DEFAULT_TZ = get_env("DEFAULT_TZ", "Europe/Moscow")
 BOT_TOKEN = get_env("BOT_TOKEN")
@@ -7,7 +7,112 @@ API_HASH = get_env("API_HASH")
 SESSION_PATH = get_env("SESSION_PATH", default="stats-bot")
 QDB_HOST = get_env("QDB_HOST", default="questdb")
 QDB_INFLUX_PORT = get_env_int("QDB_INFLUX_PORT", default=9009)
-QDB_POSTGRES_PORT = get_env_int("QDB_INFLUX_PORT", default=8812)
+QDB_POSTGRES_PORT = get_env_int("QDB_POSTGRES_PORT", default=8812)
 QDB_USER = get_env("QDB_USER", "admin")
 QDB_PASSWORD = get_env("QDB_PASSWORD", "quest")
 
+MAX_CONCURRENT_UPDATES = get_env_int("MAX_CONCURRENT_UPDATES", default=32)
+
+BOT_API_URL = get_env("BOT_API_URL", default="https://api.telegram.org")
+# connections kept open for sending, long polling uses a separate one
+BOT_API_MAX_CONNECTIONS = get_env_int("BOT_API_MAX_CONNECTIONS", default=32)
+# needs the h2 package, falls back to HTTP/1.1 without it
+BOT_API_HTTP2 = get_env("BOT_API_HTTP2", default="0") == "1"
+# "polling" for getUpdates long polling or "webhook" for the embedded webhook server
+UPDATES_MODE = get_env("UPDATES_MODE", default="polling")
+WEBHOOK_URL = get_env("WEBHOOK_URL", default="")
+WEBHOOK_PATH = get_env("WEBHOOK_PATH", default="/webhook")
+WEBHOOK_SECRET = get_env("WEBHOOK_SECRET", default="")
+WEBHOOK_LISTEN_HOST = get_env("WEBHOOK_LISTEN_HOST", default="0.0.0.0")
+WEBHOOK_LISTEN_PORT = get_env_int("WEBHOOK_LISTEN_PORT", default=8443)
+if UPDATES_MODE == "webhook":
+    if not WEBHOOK_URL:
+        panic("Error: WEBHOOK_URL env variable must be set in webhook mode.")
+    # without a secret anyone who finds the URL could post updates
+    if not WEBHOOK_SECRET:
+        panic("Error: WEBHOOK_SECRET env variable must be set in webhook mode.")
+
+# Telegram's limits on outgoing messages: overall, per private chat and per group
+SEND_RATE_PER_SEC = get_env_int("SEND_RATE_PER_SEC", default=30)
+SEND_CHAT_RATE_PER_SEC = get_env_int("SEND_CHAT_RATE_PER_SEC", default=1)
+SEND_CHAT_BURST = get_env_int("SEND_CHAT_BURST", default=3)
+SEND_GROUP_RATE_PER_MIN = get_env_int("SEND_GROUP_RATE_PER_MIN", default=20)
+
+# reports are browsed page by page, each open report keeps its rows this long
+REPORT_CURSOR_TTL_SEC = get_env_int("REPORT_CURSOR_TTL_SEC", default=15 * 60)
+REPORT_MAX_CURSORS = get_env_int("REPORT_MAX_CURSORS", default=1000)
+# format of the downloadable report, "html" or "csv"
+REPORT_DOCUMENT_FORMAT = get_env("REPORT_DOCUMENT_FORMAT", default="html")
+
+# raw stats older than this are dropped once rolled up, in whole monthly
+# partitions, 0 keeps them forever
+STATS_RETENTION_DAYS = get_env_int("STATS_RETENTION_DAYS", default=90)
+# reports read up to 4 weeks of raw stats
+MIN_STATS_RETENTION_DAYS = 35
+if 0 < STATS_RETENTION_DAYS < MIN_STATS_RETENTION_DAYS:
+    panic(
+        f"Error: STATS_RETENTION_DAYS env variable must be 0 or at least "
+        f"{MIN_STATS_RETENTION_DAYS}."
+    )
+
+# rollups look this far back for the counters a message had before, a message
+# without a snapshot for longer is counted as a new one
+STATS_SEED_WINDOW_DAYS = 9
+# unchanged counters of a message are written again after this long, at most
+# the seed window less a day, as daily rollups start at midnight
+STATS_HEARTBEAT_SEC = get_env_int("STATS_HEARTBEAT_SEC", default=6 * 60 * 60)
+MAX_STATS_HEARTBEAT_SEC = (STATS_SEED_WINDOW_DAYS - 1) * 24 * 60 * 60
+if not 0 < STATS_HEARTBEAT_SEC <= MAX_STATS_HEARTBEAT_SEC:
+    panic(
+        f"Error: STATS_HEARTBEAT_SEC env variable must be between 1 and "
+        f"{MAX_STATS_HEARTBEAT_SEC}."
+    )
+
+COLLECT_CONCURRENCY = get_env_int("COLLECT_CONCURRENCY", default=8)
+COLLECT_READS_PER_SEC = get_env_int("COLLECT_READS_PER_SEC", default=4)
+
+SNAPSHOT_STORE_TTL_SEC = get_env_int("SNAPSHOT_STORE_TTL_SEC", default=15 * 60)
+SNAPSHOT_STORE_MAX_MESSAGES = get_env_int(
+    "SNAPSHOT_STORE_MAX_MESSAGES", default=500_000
+)
+
+DB_POOL_MIN_SIZE = get_env_int("DB_POOL_MIN_SIZE", default=1)
+DB_POOL_MAX_SIZE = get_env_int("DB_POOL_MAX_SIZE", default=4)
+DB_POOL_TIMEOUT_SEC = get_env_int("DB_POOL_TIMEOUT_SEC", default=30)
+
+CHAT_CACHE_SIZE = get_env_int("CHAT_CACHE_SIZE", default=4096)
+USER_CACHE_SIZE = get_env_int("USER_CACHE_SIZE", default=16384)
+# remember lookups that found nothing, safe as long as this is the only writer
+DAO_CACHE_MISSING = get_env("DAO_CACHE_MISSING", default="1") == "1"
+
+INGEST_QUEUE_SIZE = get_env_int("INGEST_QUEUE_SIZE", default=100_000)
+# what to do when the ingestion queue is full: "block", "drop_oldest" or "spill"
+INGEST_OVERFLOW_POLICY = get_env("INGEST_OVERFLOW_POLICY", default="block")
+# directory of the on-disk buffer for rows QuestDB couldn't take, relative to the
+# working directory unless absolute, empty to disable
+INGEST_SPILL_DIR = get_env("INGEST_SPILL_DIR", default="spill")
+if INGEST_OVERFLOW_POLICY not in ("block", "drop_oldest", "spill"):
+    panic(
+        "Error: INGEST_OVERFLOW_POLICY env variable must be "
+        "\"block\", \"drop_oldest\" or \"spill\"."
+    )
+if INGEST_OVERFLOW_POLICY == "spill" and not INGEST_SPILL_DIR:
+    panic("Error: INGEST_SPILL_DIR env variable must be set for the spill policy.")
+INGEST_SPILL_THRESHOLD = get_env_int("INGEST_SPILL_THRESHOLD", default=50_000)
+INGEST_SPILL_SEGMENT_SIZE = get_env_int(
+    "INGEST_SPILL_SEGMENT_SIZE", default=8 * 1024 * 1024
+)
+INGEST_SPILL_MAX_SIZE = get_env_int(
+    "INGEST_SPILL_MAX_SIZE", default=512 * 1024 * 1024
+)
+INGEST_REPLAY_ROWS_PER_SEC = get_env_int("INGEST_REPLAY_ROWS_PER_SEC", default=20_000)
+
+# address of the Prometheus /metrics endpoint, a port of 0 disables it
+METRICS_HOST = get_env("METRICS_HOST", default="127.0.0.1")
+METRICS_PORT = get_env_int("METRICS_PORT", default=9464)
+
+# log the event loop's stack when it doesn't get back to the watchdog in time
+LOOP_LAG_THRESHOLD_MS = get_env_int("LOOP_LAG_THRESHOLD_MS", default=500)
+# asyncio debug mode, logs every callback that runs longer than SLOW_CALLBACK_MS
+LOOP_DEBUG = get_env("LOOP_DEBUG", default="0") == "1"
+SLOW_CALLBACK_MS = get_env_int("SLOW_CALLBACK_MS", default=100)
@@ -1,3 +1,4 @@
+import asyncio
 import sys
 import os
 
@@ -31,3 +32,98 @@ def batch(iterable, n=1):
     for ndx in range(0, l, n):
         yield iterable[ndx:min(ndx + n, l)]
 
+
+
+class SingleFlight:
+    """Shares one in-flight call between concurrent callers with the same key."""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, func, *args, **kwargs):
+        if not (future := self._calls.get(key)):
+            future = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+
+        # a cancelled caller must not cancel the call for everyone else
+        return await asyncio.shield(future)
+
+
+class _SharedStream:
+    # marks the end of the source in the result of `_next`
+    END = object()
+
+    def __init__(self, source):
+        self.source = source
+        self.items = []
+        self.done = False
+        self.error = None
+        self.pending = None
+        self.consumers = 0
+
+    async def _next(self):
+        try:
+            return await anext(self.source)
+        except StopAsyncIteration:
+            return self.END
+
+    def fetch(self):
+        """Return the future of the next item, started by the first one to ask."""
+        if self.pending is None:
+            self.pending = asyncio.ensure_future(self._next())
+            self.pending.add_done_callback(self._on_item)
+        return self.pending
+
+    def _on_item(self, future):
+        self.pending = None
+        if future.cancelled():
+            self.done = True
+        elif (error := future.exception()) is not None:
+            self.error = error
+            self.done = True
+        elif (item := future.result()) is self.END:
+            self.done = True
+        else:
+            self.items.append(item)
+
+
+class SingleFlightStream:
+    """Shares one in-flight async generator between concurrent consumers.
+
+    Consumers with the same key read the items of a single generator, one who
+    joins later starts over from the first item. The generator is advanced as
+    far as the furthest consumer and closed once the last one is gone.
+    """
+
+    def __init__(self):
+        self._streams = {}
+
+    async def iterate(self, key, func, *args, **kwargs):
+        if (stream := self._streams.get(key)) is None:
+            stream = self._streams[key] = _SharedStream(func(*args, **kwargs))
+        stream.consumers += 1
+
+        try:
+            i = 0
+            while True:
+                if i < len(stream.items):
+                    yield stream.items[i]
+                    i += 1
+                elif stream.error is not None:
+                    raise stream.error
+                elif stream.done:
+                    return
+                else:
+                    # a cancelled consumer must not cancel the read for everyone
+                    await asyncio.shield(stream.fetch())
+        finally:
+            stream.consumers -= 1
+            if stream.done or not stream.consumers:
+                if self._streams.get(key) is stream:
+                    del self._streams[key]
+            if not stream.consumers:
+                if stream.pending is not None:
+                    stream.pending.cancel()
+                else:
+                    await stream.source.aclose()